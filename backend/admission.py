@@ -0,0 +1,196 @@
+import asyncio
+import math
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+
+
+class AdmissionRejected(Exception):
+    """A call was shed instead of queued; retry_after is a suggested wait in whole seconds."""
+
+    def __init__(self, lane: str, reason: str, retry_after: int):
+        super().__init__(f"The {lane} queue is {reason}, retry in {retry_after}s")
+        self.lane = lane
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class _Waiter:
+    __slots__ = ("lane", "client", "priority", "future", "enqueued", "timer")
+
+    def __init__(self, lane: str, client: str, priority: int, future: asyncio.Future):
+        self.lane = lane
+        self.client = client
+        self.priority = priority
+        self.future = future
+        self.enqueued = time.perf_counter()
+        self.timer = None
+
+
+class AdmissionController:
+    """Bound concurrent upstream calls, queueing the rest fairly and shedding what would wait too long.
+
+    At most capacity calls hold a slot at once; the others wait in a queue per
+    lane (an LLM route), bounded to max_queue. A freed slot goes to the lane
+    with the best (lowest) priority that has waiters, and within a priority
+    clients take turns, so one client's burst can't starve the rest. A call
+    is rejected straight away if its lane's queue is full or its expected
+    wait (calls ahead of it times the average slot hold time, over capacity)
+    exceeds target_wait, and a queued call that has waited target_wait is
+    dropped: a prompt rejection with a retry hint beats a late answer.
+    target_wait is in seconds, or a function of the lane returning them so
+    the limit can follow observed latency. Calls with shed=False
+    (background jobs) wait as long as it takes.
+
+    on_wait(lane, seconds) is called whenever a call is admitted and
+    on_reject(lane, reason) whenever one is shed, with reason "full",
+    "overloaded" or "timeout".
+    """
+
+    def __init__(self, capacity: int, max_queue: int = 32, target_wait: float = 10.0,
+                 priorities: dict = None, default_priority: int = 1, on_wait=None, on_reject=None):
+        self.capacity = capacity
+        self.max_queue = max_queue
+        self.target_wait = target_wait
+        self.priorities = priorities or {}
+        self.default_priority = default_priority
+        self.on_wait = on_wait
+        self.on_reject = on_reject
+        self.active = 0
+        self.waiting = {}  # priority -> client -> waiters; clients in turn order
+        self.depth = {}  # lane -> queued calls
+        self.admitted = {}
+        self.rejected = {}
+        self.hold_seconds = None  # moving average of how long a slot is held
+
+    def priority(self, lane: str) -> int:
+        return self.priorities.get(lane, self.default_priority)
+
+    def wait_limit(self, lane: str) -> float:
+        """Seconds a call on lane may wait in the queue before it is shed."""
+        return self.target_wait(lane) if callable(self.target_wait) else self.target_wait
+
+    def expected_wait(self, priority: int = None) -> float:
+        """Seconds a call queued now at priority (or behind everything) can expect to wait."""
+        if self.hold_seconds is None:
+            return 0.0
+        ahead = sum(
+            len(waiters)
+            for level, clients in self.waiting.items() if priority is None or level <= priority
+            for waiters in clients.values()
+        )
+        return (ahead + 1) * self.hold_seconds / self.capacity
+
+    def _retry_after(self, seconds: float) -> int:
+        return max(math.ceil(seconds), 1)
+
+    def _reject(self, lane: str, reason: str, retry_after: float):
+        self.rejected.setdefault(lane, {})
+        self.rejected[lane][reason] = self.rejected[lane].get(reason, 0) + 1
+        if self.on_reject is not None:
+            self.on_reject(lane, reason)
+        return AdmissionRejected(lane, reason, self._retry_after(retry_after))
+
+    def _admit(self, lane: str, waited: float):
+        self.active += 1
+        self.admitted[lane] = self.admitted.get(lane, 0) + 1
+        if self.on_wait is not None:
+            self.on_wait(lane, waited)
+
+    def _dequeue(self, waiter: _Waiter):
+        clients = self.waiting[waiter.priority]
+        waiters = clients[waiter.client]
+        waiters.remove(waiter)
+        if not waiters:
+            del clients[waiter.client]
+            if not clients:
+                del self.waiting[waiter.priority]
+        self.depth[waiter.lane] -= 1
+        if waiter.timer is not None:
+            waiter.timer.cancel()
+
+    def _next_waiter(self):
+        if not self.waiting:
+            return None
+        clients = self.waiting[min(self.waiting)]
+        client, waiters = next(iter(clients.items()))
+        waiter = waiters[0]
+        self._dequeue(waiter)
+        if client in clients:
+            # Round robin: the client's next call goes behind the other clients'
+            clients.move_to_end(client)
+        return waiter
+
+    def _grant(self):
+        while self.active < self.capacity:
+            waiter = self._next_waiter()
+            if waiter is None:
+                return
+            self._admit(waiter.lane, time.perf_counter() - waiter.enqueued)
+            waiter.future.set_result(None)
+
+    def _expire(self, waiter: _Waiter):
+        if waiter.future.done():
+            return
+        self._dequeue(waiter)
+        waiter.future.set_exception(self._reject(waiter.lane, "timeout", self.expected_wait(waiter.priority)))
+
+    async def acquire(self, lane: str, client: str, shed: bool = True):
+        """Wait for a slot, or raise AdmissionRejected. Pair with release()."""
+        priority = self.priority(lane)
+        if self.active < self.capacity and not any(level <= priority for level in self.waiting):
+            self._admit(lane, 0.0)
+            return
+
+        if shed:
+            if self.depth.get(lane, 0) >= self.max_queue:
+                raise self._reject(lane, "full", self.expected_wait())
+            expected = self.expected_wait(priority)
+            wait_limit = self.wait_limit(lane)
+            if expected > wait_limit:
+                raise self._reject(lane, "overloaded", expected)
+
+        waiter = _Waiter(lane, client, priority, asyncio.get_running_loop().create_future())
+        clients = self.waiting.setdefault(priority, OrderedDict())
+        clients.setdefault(client, deque()).append(waiter)
+        self.depth[lane] = self.depth.get(lane, 0) + 1
+        if shed:
+            waiter.timer = asyncio.get_running_loop().call_later(wait_limit, self._expire, waiter)
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if not waiter.future.done() or waiter.future.cancelled():
+                if waiter in self.waiting.get(priority, {}).get(client, ()):
+                    self._dequeue(waiter)
+            elif waiter.future.exception() is None:
+                # Granted a slot just as the caller gave up: pass it on
+                self.release(0.0)
+            raise
+
+    def release(self, held: float):
+        """Give back a slot held for held seconds and hand it to the next waiter."""
+        if held > 0:
+            self.hold_seconds = held if self.hold_seconds is None else 0.8 * self.hold_seconds + 0.2 * held
+        self.active -= 1
+        self._grant()
+
+    @asynccontextmanager
+    async def slot(self, lane: str, client: str, shed: bool = True):
+        """Hold a slot for the duration of the block."""
+        await self.acquire(lane, client, shed)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.release(time.perf_counter() - start)
+
+    def stats(self) -> dict:
+        return {
+            "capacity": self.capacity,
+            "active": self.active,
+            "queued": {lane: depth for lane, depth in self.depth.items() if depth},
+            "admitted": dict(self.admitted),
+            "rejected": {lane: dict(reasons) for lane, reasons in self.rejected.items()},
+            "hold_seconds": round(self.hold_seconds, 3) if self.hold_seconds is not None else None,
+            "expected_wait_seconds": round(self.expected_wait(), 3)
+        }
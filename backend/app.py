@@ -1,44 +1,365 @@
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
+import asyncio
+import base64
+import hashlib
+import contextvars
+from concurrent.futures import ProcessPoolExecutor
+import json
 import logging
 import re
 import sys
 import subprocess
+import time
 import google.generativeai as genai
-from fastapi import UploadFile, File
-from PIL import Image 
-import io 
-from fastapi.responses import HTMLResponse
+from fastapi import UploadFile, File, Request
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse, StreamingResponse
 from dotenv import load_dotenv
 import os
 import groq
 from datetime import datetime
+from admission import AdmissionController, AdmissionRejected
+from cache import PerceptualHashIndex, QuestionIndex, ResponseCache, cache_key
+from css_parser import merge_declarations, parse_stylesheet
+from singleflight import SingleFlight
+from patching import PatchError, apply_unified_diff
+from code_index import (
+    css_fragments, html_fragments, js_fragments, merge_html_fragments, merge_js_fragments, select_context,
+    select_fragments
+)
+from model_output import (
+    CodeBlockStream, ReasoningFilter, clean_text, extract_code_blocks, find_code_blocks,
+    split_html_document, split_reasoning
+)
+from prompts import PROMPTS
+from images import ImageTooLarge, UploadSizeLimit, prepare_image, read_upload
+from jobs import JobQueue
+from projects import SECTIONS, DerivedCache, ProjectStore, VersionConflict
+from http_encoding import CompressionMiddleware, ETagMiddleware
+from log_config import current_request_id, elapsed_ms, end_request, log_payload, setup_logging, start_request
+from metrics import LAG_BUCKETS, SIZE_BUCKETS, MetricsRegistry, StageTimer, monitor_loop_lag, server_timing
+from providers import Router, build_providers
+from tokens import TokenBudgetError, TokenMeter, completion_budget, estimate_tokens
 
 load_dotenv()
 
 GROQ_API_KEY = os.getenv("groq_api_key")
 API_KEY = os.getenv("api_key")  # Keeping Gemini API key for image analysis
+GROQ_MODEL = os.getenv("groq_model", "deepseek-r1-distill-llama-70b")
+# Comma-separated kind:model entries, e.g. "groq:llama-3.3-70b-versatile,gemini:gemini-2.0-flash"
+LLM_PROVIDERS = os.getenv("llm_providers", f"groq:{GROQ_MODEL}")
+# JSON mapping of endpoint class (generate, tutor, review) to provider names; unlisted classes use all
+LLM_ROUTES = json.loads(os.getenv("llm_routes", "{}"))
+LLM_HEDGE = os.getenv("llm_hedge", "true").lower() in ("1", "true", "yes")
+LLM_HEDGE_MIN_DELAY = float(os.getenv("llm_hedge_min_delay", "2"))
+LLM_CONTEXT_TOKENS = int(os.getenv("llm_context_tokens", "32768"))
+LLM_MIN_COMPLETION_TOKENS = int(os.getenv("llm_min_completion_tokens", "256"))
+LLM_MAX_COMPLETION_TOKENS = int(os.getenv("llm_max_completion_tokens", "8192"))
+# Allowance for the model's reasoning before the answer (deepseek-r1 thinks out loud)
+LLM_REASONING_TOKENS = int(os.getenv("llm_reasoning_tokens", "1024"))
+# Default max_tokens per endpoint class; modifications are sized from the existing code instead.
+# Short answers get the reasoning allowance on top, or a long <think> trace could use up the budget
+ROUTE_MAX_TOKENS = {
+    "generate": 4096,
+    "tutor": 1536 + LLM_REASONING_TOKENS,
+    "review": 2560 + LLM_REASONING_TOKENS,
+    **json.loads(os.getenv("llm_max_tokens", "{}"))
+}
+# max_tokens (including reasoning) for each completion of sectioned generation
+SECTION_MAX_TOKENS = {
+    "plan": 1536,
+    "html": 4096,
+    "css": 3072,
+    "javascript": 4096,
+    **json.loads(os.getenv("section_max_tokens", "{}"))
+}
+OPENAI_API_KEY = os.getenv("openai_api_key")  # for openai: providers, if the server needs one
+LOG_LEVEL = os.getenv("log_level", "INFO")
+LOG_FORMAT = os.getenv("log_format", "text")  # text or json
+# Fraction of requests whose prompts and responses are logged (at DEBUG)
+LOG_PAYLOAD_SAMPLE_RATE = float(os.getenv("log_payload_sample_rate", "0"))
+LOG_PAYLOAD_MAX_CHARS = int(os.getenv("log_payload_max_chars", "2000"))
+LLM_MAX_CONCURRENCY = int(os.getenv("llm_max_concurrency", "8"))
+LLM_TIMEOUT = float(os.getenv("llm_timeout", "300"))
+# Admission control: completions beyond the capacity queue per route, fairly per client
+ADMISSION_CAPACITY = int(os.getenv("admission_capacity", str(LLM_MAX_CONCURRENCY)))
+ADMISSION_MAX_QUEUE = int(os.getenv("admission_max_queue", "32"))  # per route
+# How long a queued call may wait before it is shed with 429. Completions take tens of
+# seconds, so a short target sheds nearly every queued call once capacity is full, while a
+# long one leaves clients waiting minutes for an answer they may have given up on. Unset,
+# it follows the slowest p95 completion latency of the route's providers (times
+# admission_target_wait_latencies, never below admission_min_target_wait); set, it is fixed.
+ADMISSION_TARGET_WAIT = os.getenv("admission_target_wait")
+ADMISSION_TARGET_WAIT_LATENCIES = float(os.getenv("admission_target_wait_latencies", "2"))
+ADMISSION_MIN_TARGET_WAIT = float(os.getenv("admission_min_target_wait", "60"))
+# Lower is served first: interactive tutoring ahead of generation, batch-style reviews last
+ADMISSION_PRIORITIES = {
+    "tutor": 0,
+    "generate": 1,
+    "review": 2,
+    **json.loads(os.getenv("admission_priorities", "{}"))
+}
+LLM_CACHE_MAX_BYTES = int(os.getenv("llm_cache_max_bytes", str(64 * 1024 * 1024)))
+LLM_CACHE_TTL = float(os.getenv("llm_cache_ttl", "3600"))
+LLM_CACHE_DB = os.getenv("llm_cache_db")  # e.g. llm_cache.sqlite3; unset keeps the cache in memory only
+KEEP_UNICODE = os.getenv("keep_unicode", "false").lower() in ("1", "true", "yes")
+MODIFY_CONTEXT_TOKENS = int(os.getenv("modify_context_tokens", "6000"))
+IMAGE_MAX_BYTES = int(os.getenv("image_max_bytes", str(20 * 1024 * 1024)))
+IMAGE_MAX_DIMENSION = int(os.getenv("image_max_dimension", "1600"))
+IMAGE_ENCODE_FORMAT = os.getenv("image_encode_format", "WEBP")
+IMAGE_WORKERS = int(os.getenv("image_workers", "2"))
+BATCH_CONCURRENCY = int(os.getenv("batch_concurrency", "4"))
+BATCH_MAX_ITEMS = int(os.getenv("batch_max_items", "100"))
+JOB_DB = os.getenv("job_db", "jobs.sqlite3")
+JOB_WORKERS = int(os.getenv("job_workers", "2"))  # 0 makes this process accept jobs without running them
+JOB_ABANDON_AFTER = float(os.getenv("job_abandon_after", "120"))  # seconds without polling; 0 disables
+JOB_RETENTION = float(os.getenv("job_retention", "86400"))
+IMAGE_HASH_DB = os.getenv("image_hash_db", "image_descriptions.sqlite3")  # empty keeps the index in memory only
+IMAGE_HASH_THRESHOLD = int(os.getenv("image_hash_threshold", "10"))  # differing bits of 256
+IMAGE_HASH_MAX_ENTRIES = int(os.getenv("image_hash_max_entries", "5000"))
+TUTOR_INDEX_DB = os.getenv("tutor_index_db", "tutor_answers.sqlite3")  # empty keeps the index in memory only
+TUTOR_INDEX_THRESHOLD = float(os.getenv("tutor_index_threshold", "0.8"))  # Jaccard similarity of content words
+TUTOR_INDEX_MAX_ENTRIES = int(os.getenv("tutor_index_max_entries", "5000"))
+# "compact" leaves the duplicated combined document out of code responses; ?format= overrides per request
+RESPONSE_FORMAT = os.getenv("response_format", "full")
+COMPRESSION_MIN_SIZE = int(os.getenv("compression_min_size", "500"))
+PROJECT_DB = os.getenv("project_db", "projects.sqlite3")
+PROJECT_MAX_VERSIONS = int(os.getenv("project_max_versions", "50"))
+DERIVED_CACHE_ENTRIES = int(os.getenv("derived_cache_entries", "512"))
+# Custom Gemini API host, e.g. a proxy or benchmarks/fake_llm_server.py
+GEMINI_API_ENDPOINT = os.getenv("gemini_api_endpoint")
+LOOP_LAG_INTERVAL = float(os.getenv("loop_lag_interval", "0.5"))
+GROQ_SYSTEM_PROMPT = "You are a web development expert specializing in generating clean, modern web code."
+
+# Prometheus metrics, served at /metrics
+metrics = MetricsRegistry()
+stage_timer = StageTimer(metrics)
+http_requests = metrics.counter(
+    "app_http_requests_total", "HTTP requests by route, method and status", ("route", "method", "status")
+)
+http_duration = metrics.histogram(
+    "app_http_request_duration_seconds", "HTTP request latency; time to first byte for streams", ("route", "method")
+)
+http_in_flight = metrics.gauge("app_http_requests_in_flight", "HTTP requests being handled")
+http_request_bytes = metrics.histogram(
+    "app_http_request_size_bytes", "Request body sizes", ("route",), buckets=SIZE_BUCKETS
+)
+http_response_bytes = metrics.histogram(
+    "app_http_response_size_bytes", "Response body sizes, for responses with a known length", ("route",),
+    buckets=SIZE_BUCKETS
+)
+upstream_calls = metrics.counter(
+    "app_upstream_calls_total", "Calls to LLM and vision providers by outcome", ("provider", "outcome")
+)
+upstream_duration = metrics.histogram(
+    "app_upstream_call_duration_seconds", "Latency of calls to LLM and vision providers", ("provider",)
+)
+jobs_gauge = metrics.gauge("app_jobs", "Jobs in the queue by status", ("status",))
+llm_cache_entries = metrics.gauge("app_llm_cache_entries", "Responses in the in-memory LLM cache")
+llm_cache_bytes = metrics.gauge("app_llm_cache_bytes", "Size of the in-memory LLM cache")
+admission_wait = metrics.histogram(
+    "app_admission_wait_seconds", "Time admitted LLM calls waited for a slot", ("lane",)
+)
+admission_rejections = metrics.counter(
+    "app_admission_rejections_total", "LLM calls shed with 429 by lane and reason", ("lane", "reason")
+)
+admission_queue = metrics.gauge("app_admission_queue_depth", "LLM calls waiting for a slot", ("lane",))
+admission_active = metrics.gauge("app_admission_active", "LLM calls holding a slot")
+event_loop_lag = metrics.histogram(
+    "app_event_loop_lag_seconds", "How late the event loop runs a timer; blocking work shows up here",
+    buckets=LAG_BUCKETS
+)
 
-# Configure Groq
-groq_client = groq.Groq(api_key=GROQ_API_KEY)
+def record_upstream_call(provider: str, seconds: float, outcome: str):
+    upstream_calls.inc(provider=provider, outcome=outcome)
+    upstream_duration.observe(seconds, provider=provider)
+
+# Configure Groq (async client so completions don't block the event loop). Each call
+# passes its own timeout, and the router fails over instead of the SDK retrying, since a
+# retried completion that timed out is billed again
+groq_client = groq.AsyncGroq(api_key=GROQ_API_KEY, timeout=LLM_TIMEOUT, max_retries=0)
+llm_semaphore = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+llm_router = Router(
+    build_providers(LLM_PROVIDERS, groq_client=groq_client, openai_api_key=OPENAI_API_KEY),
+    routes=LLM_ROUTES,
+    semaphore=llm_semaphore,
+    hedge=LLM_HEDGE,
+    min_hedge_delay=LLM_HEDGE_MIN_DELAY,
+    on_call=record_upstream_call
+)
+response_cache = ResponseCache(
+    max_bytes=LLM_CACHE_MAX_BYTES,
+    ttl=LLM_CACHE_TTL,
+    db_path=LLM_CACHE_DB
+)
+llm_flights = SingleFlight()
+
+def admission_target_wait(route: str) -> float:
+    """Queue wait limit for route, derived from its providers' observed p95 latency."""
+    p95 = max(
+        (llm_router.trackers[name].percentile(0.95) or 0.0 for name in llm_router.signature(route)), default=0.0
+    )
+    return max(ADMISSION_TARGET_WAIT_LATENCIES * p95, ADMISSION_MIN_TARGET_WAIT)
+
+admission = AdmissionController(
+    capacity=ADMISSION_CAPACITY,
+    max_queue=ADMISSION_MAX_QUEUE,
+    target_wait=float(ADMISSION_TARGET_WAIT) if ADMISSION_TARGET_WAIT else admission_target_wait,
+    priorities=ADMISSION_PRIORITIES,
+    on_wait=lambda lane, seconds: admission_wait.observe(seconds, lane=lane),
+    on_reject=lambda lane, reason: admission_rejections.inc(lane=lane, reason=reason)
+)
+token_meter = TokenMeter()
+
+# Per-request scratch state shared between middleware and helpers like run_groq
+request_state = contextvars.ContextVar("request_state", default=None)
+
+def stage(name: str):
+    """Time a stage of handling into the stage metrics and the request's Server-Timing header."""
+    state = request_state.get()
+    return stage_timer(name, state["timings"] if state is not None else None)
 
 # Configure Google Generative AI for image analysis
-genai.configure(api_key=API_KEY)
-vision_model = genai.GenerativeModel('gemini-2.0-flash')
+if GEMINI_API_ENDPOINT:
+    # Custom hosts are reached over REST, which the SDK only supports with its sync client
+    genai.configure(api_key=API_KEY, transport="rest", client_options={"api_endpoint": GEMINI_API_ENDPOINT})
+else:
+    genai.configure(api_key=API_KEY)
+VISION_MODEL = 'gemini-2.0-flash'
+vision_model = genai.GenerativeModel(VISION_MODEL)
+# Image decoding and resizing is CPU-bound, so it runs outside the event loop process
+image_pool = ProcessPoolExecutor(max_workers=IMAGE_WORKERS)
+# Long generations submitted with ?job=true, run by a local worker pool
+job_queue = JobQueue(
+    db_path=JOB_DB,
+    workers=JOB_WORKERS,
+    abandon_after=JOB_ABANDON_AFTER,
+    retention=JOB_RETENTION
+)
+# Versioned projects, so iterative edits send a project id instead of the whole code
+project_store = ProjectStore(db_path=PROJECT_DB, max_versions=PROJECT_MAX_VERSIONS)
+# Token counts and indexes of code sections, computed once per distinct text
+derived_indexes = DerivedCache(max_entries=DERIVED_CACHE_ENTRIES)
+# Vision descriptions of previously analyzed images, matched by perceptual hash
+image_descriptions = PerceptualHashIndex(
+    max_entries=IMAGE_HASH_MAX_ENTRIES,
+    threshold=IMAGE_HASH_THRESHOLD,
+    db_path=IMAGE_HASH_DB or None
+)
+# Tutor answers to past questions, reused for rephrasings of the same question
+tutor_questions = QuestionIndex(
+    max_entries=TUTOR_INDEX_MAX_ENTRIES,
+    threshold=TUTOR_INDEX_THRESHOLD,
+    db_path=TUTOR_INDEX_DB or None,
+    version=PROMPTS.templates["ai_tutor"].key
+)
 
 app = FastAPI()
 
+# Inside CORS, so a 413 still carries CORS headers; the allowance covers multipart framing
+app.add_middleware(UploadSizeLimit, paths=("/analyze-image",), max_bytes=IMAGE_MAX_BYTES + 64 * 1024)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Cache", "X-Prompt-Tokens", "X-Completion-Tokens", "X-Request-ID", "Server-Timing", "ETag",
+                    "Retry-After"],
 )
 
-logging.basicConfig(
-    level=logging.DEBUG,
-    format='%(asctime)s - %(levelname)s - %(message)s'
+@app.middleware("http")
+async def request_context_middleware(request: Request, call_next):
+    """Set up per-request state and report it in headers, metrics and an access log line.
+
+    Assigns the correlation id (X-Request-ID, generated unless the client sent
+    one) and the client admission control schedules fairly (X-Client-ID, or
+    the peer address), honors cache bypass requests, and reports LLM cache hits, token
+    usage and the time spent in each stage (Server-Timing). For streaming
+    responses durations are time to first byte, and Server-Timing only
+    covers the stages that ran before it.
+    """
+    started = time.perf_counter()
+    request_id = request.headers.get("x-request-id", "")[:64]
+    log_token = start_request(request_id if request_id.isprintable() else None)
+    state = {
+        "cache_bypass": (
+            "no-cache" in request.headers.get("cache-control", "").lower()
+            or request.headers.get("x-cache-bypass", "").lower() in ("1", "true", "yes")
+        ),
+        "cache": [],
+        "usage": [],
+        "timings": [],
+        "compact": request.query_params.get("format", RESPONSE_FORMAT) == "compact",
+        "client": request.headers.get("x-client-id", "")[:64] or (request.client.host if request.client else "unknown")
+    }
+    token = request_state.set(state)
+    http_in_flight.inc()
+    try:
+        response = await call_next(request)
+    except Exception as e:
+        route = getattr(request.scope.get("route"), "path", "unmatched")
+        http_requests.inc(route=route, method=request.method, status="500")
+        stage_timer.errors.inc(stage="request", type=type(e).__name__)
+        logging.exception(
+            "%s %s failed", request.method, request.url.path,
+            extra={"duration_ms": elapsed_ms()}
+        )
+        end_request(log_token)
+        raise
+    finally:
+        http_in_flight.dec()
+        request_state.reset(token)
+    if state["cache"]:
+        response.headers["X-Cache"] = "HIT" if all(hit for hit in state["cache"]) else "MISS"
+    elif state["cache_bypass"]:
+        response.headers["X-Cache"] = "BYPASS"
+    if state["usage"]:
+        response.headers["X-Prompt-Tokens"] = str(sum(usage["promptTokens"] for usage in state["usage"]))
+        response.headers["X-Completion-Tokens"] = str(sum(usage["completionTokens"] for usage in state["usage"]))
+    response.headers["X-Request-ID"] = current_request_id()
+    seconds = time.perf_counter() - started
+    response.headers["Server-Timing"] = server_timing(state["timings"], total=seconds)
+
+    # Route templates keep the label set small (/jobs/{job_id}, not every id)
+    route = getattr(request.scope.get("route"), "path", "unmatched")
+    http_requests.inc(route=route, method=request.method, status=str(response.status_code))
+    http_duration.observe(seconds, route=route, method=request.method)
+    if request.headers.get("content-length", "").isdigit():
+        http_request_bytes.observe(int(request.headers["content-length"]), route=route)
+    if response.headers.get("content-length", "").isdigit():
+        http_response_bytes.observe(int(response.headers["content-length"]), route=route)
+
+    fields = {"status": response.status_code, "duration_ms": elapsed_ms()}
+    if "X-Cache" in response.headers:
+        fields["cache"] = response.headers["X-Cache"]
+    if state["usage"]:
+        fields["prompt_tokens"] = int(response.headers["X-Prompt-Tokens"])
+        fields["completion_tokens"] = int(response.headers["X-Completion-Tokens"])
+    logging.info("%s %s %s", request.method, request.url.path, response.status_code, extra=fields)
+    end_request(log_token)
+    return response
+
+# ETags are computed on the uncompressed body, so compression wraps it
+app.add_middleware(ETagMiddleware)
+app.add_middleware(CompressionMiddleware, minimum_size=COMPRESSION_MIN_SIZE)
+
+@app.on_event("startup")
+async def start_job_workers():
+    job_queue.start()
+    app.state.loop_lag_monitor = asyncio.create_task(monitor_loop_lag(event_loop_lag, LOOP_LAG_INTERVAL))
+
+@app.on_event("shutdown")
+async def shutdown_workers():
+    app.state.loop_lag_monitor.cancel()
+    await job_queue.stop()
+    await asyncio.to_thread(image_pool.shutdown, wait=True, cancel_futures=True)
+
+setup_logging(
+    level=LOG_LEVEL,
+    log_format=LOG_FORMAT,
+    payload_sample_rate=LOG_PAYLOAD_SAMPLE_RATE,
+    payload_max_chars=LOG_PAYLOAD_MAX_CHARS
 )
 
 class UserInput(BaseModel):
@@ -50,225 +371,535 @@ class UserInput(BaseModel):
     modificationType: str = None
     timeout: int = 300
     temperature: float = 0.7
+    keepUnicode: bool = KEEP_UNICODE
+    includeReasoning: bool = False  # return the model's <think> trace as "reasoning"
+    projectId: str = None  # load existingCode from the project store and answer with a delta
+    baseVersion: int = None  # project version the client has; the latest if omitted
+    saveProject: bool = False  # store the result as a new project
+    generationMode: str = None  # "sectioned": plan first, then html, css and javascript concurrently
 
-def parse_css_rules(css_text: str) -> dict:
-    """Parse CSS text into a structured dictionary of rules."""
-    rules = {}
-    css_text = re.sub(r'/\*.*?\*/', '', css_text, flags=re.DOTALL)
-    css_text = re.sub(r'\s+', ' ', css_text.strip())
-    
-    brackets_count = 0
-    current_selector = ""
-    current_properties = ""
-    
-    for char in css_text:
-        if char == '{':
-            if brackets_count == 0:
-                current_selector = current_selector.strip()
-            brackets_count += 1
-            if brackets_count == 1:
-                continue
-        elif char == '}':
-            brackets_count -= 1
-            if brackets_count == 0:
-                rules[current_selector] = parse_css_properties(current_properties.strip())
-                current_selector = ""
-                current_properties = ""
-                continue
-        
-        if brackets_count == 0:
-            current_selector += char
-        else:
-            current_properties += char
-            
-    return rules
-
-def parse_css_properties(properties_text: str) -> dict:
-    """Parse CSS properties string into a dictionary."""
-    properties = {}
-    for prop in properties_text.split(';'):
-        prop = prop.strip()
-        if not prop:
+def merge_css_rules(original_css: str, edits_css: str) -> str:
+    """Merge CSS rule edits into existing CSS at rule granularity.
+
+    Edited rules keep their original declarations, with edited properties
+    replaced or appended (merge_declarations), new rules are appended, and
+    an edit with an empty body deletes the rule. Edits to at-rules such as
+    @media are merged the same way, rule by rule, into the existing block.
+    Untouched rules keep their original text.
+    """
+    original_nodes = derived_indexes.get("css_tree", original_css, parse_stylesheet)
+    replacements, appended = css_edit_replacements(original_css, original_nodes, edits_css, parse_stylesheet(edits_css))
+
+    # Apply from the end backwards so earlier spans stay valid
+    merged = original_css
+    for start, end, text in sorted(replacements, reverse=True):
+        merged = merged[:start] + text + merged[end:]
+
+    if appended:
+        merged = merged.rstrip() + "\n\n" + "\n\n".join(appended)
+    return merged
+
+def css_edit_replacements(original_css: str, nodes: list, edits_css: str, edit_nodes: list):
+    """Return (replacements, appended) merging edit_nodes into sibling nodes of original_css.
+
+    replacements are (start, end, text) spans of original_css; appended are
+    the source texts of edited rules with no existing counterpart.
+    """
+    # With duplicate selectors the last one wins in the cascade, so edit that one
+    existing = {node.prelude: node for node in nodes if node.has_block}
+    edits = {node.prelude: node for node in edit_nodes if node.has_block}
+
+    replacements = []
+    appended = []
+    for selector, edit in edits.items():
+        edit_body = edits_css[edit.body_start:edit.body_end]
+        node = existing.get(selector)
+        if node is None:
+            if edit_body.strip():
+                appended.append(edits_css[edit.start:edit.end])
+            continue
+        if not edit_body.strip():
+            replacements.append((node.start, node.end, ''))
+            continue
+        if not node.children and not edit.children:
+            body = original_css[node.body_start:node.body_end]
+            replacements.append((node.body_start, node.body_end, merge_declarations(body, edit_body)))
+            continue
+
+        # A block of rules (@media, @supports, nesting): merge rule by rule inside it
+        declarations_end = node.children[0].start if node.children else node.body_end
+        declarations = original_css[node.body_start:declarations_end]
+        edit_declarations = edits_css[edit.body_start:edit.children[0].start if edit.children else edit.body_end]
+        if edit_declarations.strip():
+            declarations = merge_declarations(declarations, edit_declarations)
+        child_replacements, child_appended = css_edit_replacements(
+            original_css, node.children, edits_css, edit.children
+        )
+        replacements.extend(child_replacements)
+        added = "".join(f"\n    {rule}" for rule in child_appended) + "\n" if child_appended else ''
+        if not node.children:
+            replacements.append((node.body_start, node.body_end, declarations.rstrip() + added if added else declarations))
             continue
-        if ':' in prop:
-            key, value = prop.split(':', 1)
-            properties[key.strip()] = value.strip()
-    return properties
+        if edit_declarations.strip():
+            replacements.append((node.body_start, declarations_end, declarations))
+        if added:
+            tail = original_css[node.children[-1].end:node.body_end]
+            replacements.append((node.children[-1].end, node.body_end, tail.rstrip() + added))
+    return replacements, appended
+
+SYSTEM_PROMPT_TOKENS = estimate_tokens(GROQ_SYSTEM_PROMPT)
+
+def token_budget(prompt: str, route: str, max_tokens: int = None):
+    """Return (prompt_tokens, max_tokens) for a completion, or raise 413 if the prompt is too big.
 
-async def run_groq(prompt: str, temperature: float = 0.7):
-    """Run Groq model with the given prompt."""
+    max_tokens defaults to the endpoint class's budget and is clamped to what
+    the context window leaves after the prompt, so oversize inputs fail here
+    instead of after a round trip to the provider.
+    """
+    prompt_tokens = estimate_tokens(prompt) + SYSTEM_PROMPT_TOKENS
+    wanted = min(max_tokens or ROUTE_MAX_TOKENS.get(route, ROUTE_MAX_TOKENS["generate"]), LLM_MAX_COMPLETION_TOKENS)
     try:
-        chat_completion = groq_client.chat.completions.create(
-            messages=[
-                {
-                    "role": "system",
-                    "content": "You are a web development expert specializing in generating clean, modern web code."
-                },
-                {
-                    "role": "user",
-                    "content": prompt
-                }
-            ],
-            model="deepseek-r1-distill-llama-70b",
-            temperature=temperature,
-            max_tokens=4096
+        return prompt_tokens, completion_budget(prompt_tokens, wanted, LLM_CONTEXT_TOKENS, LLM_MIN_COMPLETION_TOKENS)
+    except TokenBudgetError as e:
+        token_meter.record(route, rejected=True)
+        raise HTTPException(status_code=413, detail=str(e))
+
+def report_usage(prompt_tokens: int, completion: str) -> dict:
+    """Estimate completion tokens and attach the usage to the current request's headers."""
+    usage = {"promptTokens": prompt_tokens, "completionTokens": estimate_tokens(completion or '')}
+    state = request_state.get()
+    if state is not None:
+        state["usage"].append(usage)
+    return usage
+
+def with_reasoning(result: dict, reasoning: str, requested: bool) -> dict:
+    """Add the model's reasoning trace to a response if the client asked for it."""
+    if requested:
+        result["reasoning"] = reasoning or ""
+    return result
+
+async def resolve_project(user_input: UserInput):
+    """Load existingCode from the project store when the request names a projectId.
+
+    Sections the client does send in existingCode override the stored ones,
+    so a client only uploads sections it edited locally.
+    """
+    if not user_input.projectId:
+        return
+    with stage("project_load"):
+        project = await project_store.get(user_input.projectId, user_input.baseVersion)
+    if project is None:
+        raise HTTPException(status_code=404, detail="Project version not found")
+    user_input.baseVersion = project["version"]
+    user_input.existingCode = {**project["code"], **(user_input.existingCode or {})}
+
+async def project_response(user_input: UserInput, result: dict) -> dict:
+    """Store a result's code in the project store if the request uses it.
+
+    With a projectId the code becomes the project's next version and only
+    the sections that differ from what the client had are sent back, without
+    the combined document (GET /projects/{id} returns it). With saveProject
+    a new project is created and the full result is returned with its id.
+    A result based on a version that is no longer the latest is refused
+    with 409 rather than forking the project.
+    """
+    if not (user_input.projectId or user_input.saveProject):
+        return result
+    code = {key: result["code"].get(key, '') or '' for key in SECTIONS}
+    with stage("project_save"):
+        if not user_input.projectId:
+            result.update(await project_store.create(code))
+            return result
+        try:
+            version = await project_store.commit(user_input.projectId, code, parent=user_input.baseVersion)
+        except VersionConflict as e:
+            raise HTTPException(status_code=409, detail=str(e))
+        if version is None:
+            # The base version was pruned while the request ran, so newer versions exist
+            raise HTTPException(
+                status_code=409, detail=f"Version {user_input.baseVersion} of the project no longer exists"
+            )
+
+    base = user_input.existingCode or {}
+    changed = {key: text for key, text in code.items() if text != (base.get(key) or '')}
+    result.update({
+        "code": changed,
+        "unchanged": [key for key in SECTIONS if key not in changed],
+        "projectId": user_input.projectId,
+        "version": version,
+        "baseVersion": user_input.baseVersion
+    })
+    return result
+
+def modification_max_tokens(user_input: UserInput, patch: bool = False) -> int:
+    """Size max_tokens for a modification from how much code the model has to send back."""
+    if patch:
+        return LLM_REASONING_TOKENS + 1024
+    if needs_context_pruning(user_input.existingCode):
+        return LLM_REASONING_TOKENS + 2048
+    existing_tokens = sum(section_tokens(user_input.existingCode.get(key, '')) for key in SECTIONS)
+    return max(existing_tokens + existing_tokens // 4 + LLM_REASONING_TOKENS, 2048)
+
+def admission_client(state: dict) -> str:
+    # Requests are scheduled per client; job workers run outside any request
+    return state["client"] if state is not None else "jobs"
+
+def admission_error(e: AdmissionRejected) -> HTTPException:
+    return HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+async def run_groq(prompt: str, temperature: float = 0.7, timeout: float = None, route: str = "generate",
+                   max_tokens: int = None):
+    """Run the prompt on the best available LLM provider for route.
+
+    Responses are cached on (route providers, system prompt, prompt,
+    temperature) unless the request asked to bypass the cache, and
+    concurrent calls with the same key share a single completion. The router
+    picks the provider and hedges or fails over between them; at most
+    LLM_MAX_CONCURRENCY completions are in flight at once. Cache misses go
+    through admission control, which queues them fairly or sheds them with
+    a 429; the timeout covers both waiting for a slot and the completion
+    itself. max_tokens is budgeted by token_budget.
+
+    Returns (answer, reasoning, 0): a leading <think> trace is split off
+    before callers parse, log or return the output.
+    """
+    timeout = timeout or LLM_TIMEOUT
+    prompt_tokens, max_tokens = token_budget(prompt, route, max_tokens)
+    state = request_state.get()
+    use_cache = not (state and state["cache_bypass"])
+    # The template version is part of the key so editing a template invalidates its cached responses
+    key = cache_key(
+        llm_router.signature(route), GROQ_SYSTEM_PROMPT, PROMPTS.identify(prompt), prompt, temperature, max_tokens
+    )
+
+    if use_cache:
+        with stage("llm_cache"):
+            cached = await response_cache.get(key)
+        if state is not None:
+            state["cache"].append(cached is not None)
+        if cached is not None:
+            report_usage(prompt_tokens, cached)
+            reasoning, answer = split_reasoning(cached)
+            return answer, reasoning, 0
+
+    async def _complete():
+        async with admission.slot(route, admission_client(state), shed=state is not None):
+            content = await llm_router.complete(
+                route, GROQ_SYSTEM_PROMPT, prompt, temperature, max_tokens=max_tokens, timeout=timeout
+            )
+        token_meter.record(route, prompt_tokens, estimate_tokens(content or ''))
+        if content:
+            await response_cache.set(key, content)
+        return content
+
+    try:
+        with stage("llm"):
+            content = await asyncio.wait_for(llm_flights.do(key, _complete), timeout=timeout)
+
+    except AdmissionRejected as e:
+        raise admission_error(e)
+    except asyncio.TimeoutError:
+        raise HTTPException(
+            status_code=504,
+            detail=f"LLM request timed out after {timeout}s"
         )
-        
-        return chat_completion.choices[0].message.content, None, 0
-        
     except Exception as e:
         raise HTTPException(
             status_code=500,
-            detail=f"Error running Groq: {str(e)}"
+            detail=f"Error running LLM: {str(e)}"
         )
 
+    report_usage(prompt_tokens, content)
+    reasoning, answer = split_reasoning(content)
+    return answer, reasoning, 0
+
+async def stream_groq(prompt: str, temperature: float = 0.7, timeout: float = None, route: str = "generate",
+                      max_tokens: int = None):
+    """Stream completion text from the best available provider as it is generated.
+
+    Shares the concurrency limit and admission control with run_groq; the
+    timeout is a deadline for the whole stream rather than per chunk.
+    """
+    timeout = timeout or LLM_TIMEOUT
+    prompt_tokens, max_tokens = token_budget(prompt, route, max_tokens)
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    state = request_state.get()
+    try:
+        await admission.acquire(route, admission_client(state), shed=state is not None)
+    except AdmissionRejected as e:
+        raise admission_error(e)
+    held = loop.time()
+    chunks = llm_router.stream(route, GROQ_SYSTEM_PROMPT, prompt, temperature, max_tokens=max_tokens, timeout=timeout)
+    completion_tokens = 0
+    started = loop.time()
+
+    try:
+        while True:
+            try:
+                text = await asyncio.wait_for(
+                    chunks.__anext__(),
+                    timeout=max(deadline - loop.time(), 0)
+                )
+            except StopAsyncIteration:
+                break
+            if not completion_tokens:
+                stage_timer.duration.observe(loop.time() - started, stage="llm_first_token")
+            completion_tokens += estimate_tokens(text)
+            yield text
+        stage_timer.duration.observe(loop.time() - started, stage="llm_stream")
+        token_meter.record(route, prompt_tokens, completion_tokens)
+
+    except asyncio.TimeoutError:
+        stage_timer.errors.inc(stage="llm_stream", type="TimeoutError")
+        raise HTTPException(
+            status_code=504,
+            detail=f"LLM request timed out after {timeout}s"
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        stage_timer.errors.inc(stage="llm_stream", type=type(e).__name__)
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error running LLM: {str(e)}"
+        )
+    finally:
+        await chunks.aclose()
+        admission.release(loop.time() - held)
+
+def section_tokens(text: str) -> int:
+    return derived_indexes.get("tokens", text or '', estimate_tokens)
+
+def code_index(existing_code: dict) -> list:
+    """build_index for existing code, reusing the fragments of sections seen before."""
+    return (
+        derived_indexes.get("html_fragments", existing_code.get('html', '') or '', html_fragments)
+        + derived_indexes.get("css_fragments", existing_code.get('css', '') or '', css_fragments)
+        + derived_indexes.get("js_fragments", existing_code.get('javascript', '') or '', js_fragments)
+    )
+
+def needs_context_pruning(existing_code: dict) -> bool:
+    """Whether existing code is too large to send in full to the model."""
+    return sum(section_tokens(existing_code.get(key, '')) for key in SECTIONS) > MODIFY_CONTEXT_TOKENS
+
+def format_code_context(user_input: UserInput) -> str:
+    """Render the "Current Code" section of a modification prompt.
+
+    Small projects are sent in full. Larger ones are indexed and only the
+    sections, CSS rules and JS statements relevant to the request are sent,
+    up to MODIFY_CONTEXT_TOKENS, with an outline of everything else.
+    """
+    existing_code = user_input.existingCode
+    if not needs_context_pruning(existing_code):
+        return PROMPTS.render(
+            "code_context",
+            html=existing_code.get('html', ''),
+            css=existing_code.get('css', ''),
+            javascript=existing_code.get('javascript', '')
+        )
+
+    context, outline = select_context(
+        existing_code, user_input.prompt, MODIFY_CONTEXT_TOKENS, index=code_index(existing_code)
+    )
+    outline_text = "\n".join(
+        f"- {label}: {', '.join(outline[key]) or 'none'}"
+        for key, label in [('html', 'HTML sections'), ('css', 'CSS rules'), ('javascript', 'JavaScript')]
+    )
+    return PROMPTS.render(
+        "code_context_pruned",
+        outline=outline_text,
+        html="\n".join(context['html']),
+        css="\n".join(context['css']),
+        javascript="\n".join(context['javascript'])
+    )
+
 def construct_modification_prompt(user_input: UserInput):
     """Constructs an enhanced modification prompt for Groq."""
+    if needs_context_pruning(user_input.existingCode):
+        return PROMPTS.render(
+            "modify_code_pruned",
+            code_context=format_code_context(user_input),
+            prompt=user_input.prompt
+        )
+
     html_elements = re.findall(r'<(\w+)[^>]*>', user_input.existingCode.get('html', ''))
     js_functions = re.findall(r'function\s+(\w+)', user_input.existingCode.get('javascript', ''))
     css_classes = re.findall(r'\.(\w+)', user_input.existingCode.get('css', ''))
 
-    base_prompt = f"""Act as a web development expert. Please modify the existing code based on this request: {user_input.prompt}
-
-IMPORTANT GUIDELINES:
-1. Preserve ALL existing styles and functionality
-2. Only add or modify the specific styles or elements mentioned in the request
-3. Return complete, unmodified sections for HTML/JS if they don't need changes
-4. For CSS changes:
-   - Keep all existing CSS rules intact
-   - Only modify the specific properties mentioned
-   - Add new rules without removing existing ones
+    return PROMPTS.render(
+        "modify_code",
+        html_elements=', '.join(set(html_elements[:10])),
+        js_functions=', '.join(set(js_functions[:10])),
+        css_classes=', '.join(set(css_classes[:10])),
+        code_context=format_code_context(user_input),
+        prompt=user_input.prompt
+    )
 
-Existing Elements Analysis:
-- HTML elements: {', '.join(set(html_elements[:10]))}...
-- JavaScript functions: {', '.join(set(js_functions[:10]))}...
-- CSS classes: {', '.join(set(css_classes[:10]))}...
+def merge_modification(existing_code: dict, code_blocks: dict, prompt: str) -> dict:
+    """Combine model output with the existing code for a modification request.
 
-Current Code:
+    Full-context responses replace each language wholesale, keeping existing
+    code for languages the model left empty. Pruned-context responses only
+    contain changed fragments, which are merged into the existing code;
+    html sections are matched against the ones format_code_context sent.
+    """
+    if needs_context_pruning(existing_code):
+        sent = [
+            fragment for fragment in select_fragments(code_index(existing_code), prompt, MODIFY_CONTEXT_TOKENS)
+            if fragment["language"] == "html"
+        ]
+        return {
+            'html': merge_html_fragments(existing_code.get('html', '') or '', code_blocks['html'], sent),
+            'css': merge_css_rules(existing_code.get('css', '') or '', code_blocks['css']),
+            'javascript': merge_js_fragments(existing_code.get('javascript', '') or '', code_blocks['javascript'])
+        }
 
-```html
-{user_input.existingCode.get('html', '')}
-```
+    for key in ['html', 'css', 'javascript']:
+        if not code_blocks[key].strip():
+            code_blocks[key] = existing_code.get(key, '')
+    return code_blocks
 
-```css
-{user_input.existingCode.get('css', '')}
-```
+def construct_patch_prompt(user_input: UserInput):
+    """Constructs a modification prompt that asks Groq for patches instead of full code."""
+    return PROMPTS.render(
+        "modify_code_patch",
+        code_context=format_code_context(user_input),
+        prompt=user_input.prompt
+    )
 
-```javascript
-{user_input.existingCode.get('javascript', '')}
-```
+def apply_patch_output(output: str, existing_code: dict) -> dict:
+    """Apply html/javascript diffs and CSS rule edits from a patch-mode completion.
 
-Return the complete code with your specific modifications in clearly marked sections using the exact format below:
-```html
-[Your HTML code here]
-```
+    Raises PatchError if the completion contains no changes, a hunk doesn't
+    apply, or it has plain html/javascript blocks instead of diffs.
+    """
+    output = output.replace('\r\n', '\n').replace('\r', '\n')
+    sections = {}
+    for block in find_code_blocks(output):
+        key = block["info"].lower() if block["info"].lower().endswith('-patch') else block["language"]
+        sections.setdefault(key, block["code"])
+    html_patch = sections.get('html-patch', '')
+    css_edits = sections.get('css', '')
+    js_patch = sections.get('javascript-patch', '') or sections.get('js-patch', '')
 
-```css
-[Your CSS code here]
-```
+    if not (html_patch or css_edits or js_patch):
+        raise PatchError("No patch sections in model output")
+    full_blocks = [language for language in ('html', 'javascript', 'js') if sections.get(language, '').strip()]
+    if full_blocks:
+        # The model answered in full-replacement form; applying only its CSS would drop the rest
+        raise PatchError(f"Model output has non-patch {', '.join(full_blocks)} blocks")
 
-```javascript
-[Your JavaScript code here]
-```"""
+    code_blocks = {
+        'html': existing_code.get('html', ''),
+        'css': existing_code.get('css', ''),
+        'javascript': existing_code.get('javascript', '')
+    }
+    if html_patch:
+        code_blocks['html'] = apply_unified_diff(code_blocks['html'], html_patch)
+    if css_edits:
+        code_blocks['css'] = merge_css_rules(code_blocks['css'], css_edits)
+    if js_patch:
+        code_blocks['javascript'] = apply_unified_diff(code_blocks['javascript'], js_patch)
+    return code_blocks
 
-    return base_prompt
+def format_requirements(user_input: UserInput) -> str:
+    return (
+        "\n".join(f"- {req}" for req in user_input.requirements)
+        if user_input.requirements else "- Standard implementation"
+    )
 
 def construct_new_code_prompt(user_input: UserInput):
     """Constructs a prompt for generating new code using Groq."""
     if "similar to this image" in user_input.prompt.lower():
-        return f"""Act as a web development expert. Generate complete website code matching this description:
-{user_input.prompt}
-
-Requirements:
-- Pixel-perfect layout matching
-- Responsive design
-- Modern CSS (Flexbox/Grid)
-- Semantic HTML
-- Interactive elements where appropriate
-
-Return the code in the exact format below:
-```html
-[Your HTML code here]
-```
-
-```css
-[Your CSS code here]
-```
-
-```javascript
-[Your JavaScript code here]
-```"""
-
-    base_templates = {
-        "web": (
-            "Create a web application following these guidelines:\n"
-            "1. Semantic HTML5 structure\n"
-            "2. Modern, responsive CSS\n"
-            "3. Clean JavaScript with error handling\n"
-            "4. Cross-browser compatible\n"
-            "5. Performance optimized"
-        ),
-        "game": (
-            "Create a browser game with:\n"
-            "1. Clean JavaScript architecture\n"
-            "2. Game state management\n"
-            "3. User input handling\n"
-            "4. Victory/loss conditions\n"
-            "5. Error handling\n"
-            "6. Responsive design"
-        )
-    }
+        return PROMPTS.render("new_code_from_image", prompt=user_input.prompt)
 
-    base_prompt = base_templates.get(user_input.type, base_templates["web"])
-    requirements = (
-        "\n".join(f"- {req}" for req in user_input.requirements)
-        if user_input.requirements else "- Standard implementation"
-    )
-    
-    return (
-        f"Act as a web development expert. Create code for this request: {user_input.prompt}\n\n"
-        f"Requirements:\n{requirements}\n\n"
-        f"{base_prompt}\n\n"
-        "Return the code in the exact format below:\n"
-        "```html\n[Your HTML code here]\n```\n\n"
-        "```css\n[Your CSS code here]\n```\n\n"
-        "```javascript\n[Your JavaScript code here]\n```"
-    )
+    template = "new_code_game" if user_input.type == "game" else "new_code_web"
+    return PROMPTS.render(template, prompt=user_input.prompt, requirements=format_requirements(user_input))
+
+async def generate_sectioned(user_input: UserInput):
+    """Generate new code as a structure plan, then html, css and javascript concurrently.
 
-def clean_text(text: str) -> str:
-    """Clean and sanitize text output from Groq."""
-    if not text:
-        return ""
-    text = ''.join(char for char in text if ord(char) < 128)
-    text = text.replace('\r\n', '\n').replace('\r', '\n')
-    text = re.sub(r'\x1B(?:[@-Z\\-_]|\[[0-?]*[ -/]*[@-~])', '', text)
-    text = '\n'.join(line.strip() for line in text.split('\n'))
-    return text.strip()
-
-def extract_code_blocks(text: str) -> dict:
-    """Extract code blocks from the Groq output."""
-    blocks = {
-        'html': '',
-        'css': '',
-        'javascript': ''
+    The plan fixes the ids, classes and function names the three sections
+    share, so each section can be written by its own completion with its
+    own SECTION_MAX_TOKENS budget, and wall-clock time is the plan plus the
+    slowest section. Returns (code_blocks, reasoning): each section output
+    goes through extract_code_blocks and only its own language is kept, or
+    the whole output if the model left out the code fence.
+    """
+    values = {
+        "kind": "browser game" if user_input.type == "game" else "web application",
+        "prompt": user_input.prompt,
+        "requirements": format_requirements(user_input)
     }
-    
-    html_pattern = r'```html\s*(.*?)\s*```'
-    css_pattern = r'```css\s*(.*?)\s*```'
-    js_pattern = r'```javascript\s*(.*?)\s*```'
-    
-    html_match = re.search(html_pattern, text, re.DOTALL)
-    css_match = re.search(css_pattern, text, re.DOTALL)
-    js_match = re.search(js_pattern, text, re.DOTALL)
-    
-    if html_match:
-        blocks['html'] = html_match.group(1).strip()
-    if css_match:
-        blocks['css'] = css_match.group(1).strip()
-    if js_match:
-        blocks['javascript'] = js_match.group(1).strip()
-    
-    return blocks
+    with stage("prompt"):
+        plan_prompt = PROMPTS.render("plan_structure", **values)
+    plan, plan_reasoning, _ = await run_groq(
+        plan_prompt, temperature=0.3, timeout=user_input.timeout, max_tokens=SECTION_MAX_TOKENS["plan"]
+    )
+    plan = clean_text(plan, user_input.keepUnicode)
+    if not plan:
+        raise HTTPException(status_code=500, detail="No structure plan generated")
+
+    with stage("prompt"):
+        prompts = [PROMPTS.render(f"section_{language}", plan=plan, **values) for language in SECTIONS]
+    tasks = [
+        asyncio.create_task(run_groq(
+            prompt, temperature=user_input.temperature, timeout=user_input.timeout,
+            max_tokens=SECTION_MAX_TOKENS[language]
+        ))
+        for language, prompt in zip(SECTIONS, prompts)
+    ]
+    try:
+        with stage("sections"):
+            results = await asyncio.gather(*tasks)
+    finally:
+        # One failed section fails the request; don't leave the others running
+        for task in tasks:
+            task.cancel()
+
+    code_blocks = {}
+    for language, (output, _, _) in zip(SECTIONS, results):
+        with stage("clean_text"):
+            cleaned_output = clean_text(output, user_input.keepUnicode)
+        with stage("extract_code_blocks"):
+            code_blocks[language] = extract_code_blocks(cleaned_output)[language] or cleaned_output
+    if not any(code_blocks.values()):
+        raise HTTPException(status_code=500, detail="No code generated")
+
+    reasoning = "\n\n".join(part for part in [plan_reasoning, *(result[1] for result in results)] if part)
+    return code_blocks, reasoning
+
+def compact_response() -> bool:
+    """Whether the current request asked for responses without the combined document."""
+    state = request_state.get()
+    return state["compact"] if state is not None else RESPONSE_FORMAT == "compact"
+
+def add_combined(code_blocks: dict, title: str) -> dict:
+    """Attach the combined preview document to code blocks, unless the response is compact."""
+    if not compact_response():
+        code_blocks['combined'] = build_combined_document(code_blocks, title)
+    return code_blocks
+
+def build_combined_document(code_blocks: dict, title: str = "Generated Web Application") -> str:
+    """Assemble html/css/javascript blocks into a single previewable document."""
+    return f"""<!DOCTYPE html>
+<html>
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>{title}</title>
+    <style>
+    {code_blocks['css']}
+    </style>
+</head>
+<body>
+    {code_blocks['html']}
+    <script>
+    {code_blocks['javascript']}
+    </script>
+</body>
+</html>"""
 
 @app.get("/", response_class=HTMLResponse)
 async def root():
@@ -306,94 +937,211 @@ async def root():
                 <p>Modify existing web application code using Gemini AI.</p>
             </div>
             
+            <div class="endpoint">
+                <h3>"generationMode": "sectioned" on /generate-code</h3>
+                <p>Plan the page structure first, then write the HTML, CSS and JavaScript in concurrent completions, each with its own token budget.</p>
+            </div>
+            
+            <div class="endpoint">
+                <h3>POST /generate-code/stream, /modify-code/stream</h3>
+                <p>Streaming variants that return NDJSON events (token, reasoning, block, done, error) as code is generated.</p>
+            </div>
+            
             <div class="endpoint">
                 <h3>POST /analyze-image</h3>
                 <p>Analyze an image using Gemini Vision API.</p>
             </div>
             
+            <div class="endpoint">
+                <h3>?job=true on /generate-code, /modify-code, /analyze-image</h3>
+                <p>Run as a background job: returns a job id; poll GET /jobs/{id}, follow GET /jobs/{id}/events, or cancel with DELETE /jobs/{id}.</p>
+            </div>
+            
+            <div class="endpoint">
+                <h3>POST /code-review/batch, /ai-tutor/batch</h3>
+                <p>Process a list of items concurrently, streaming one NDJSON result per item as it completes.</p>
+            </div>
+            
+            <div class="endpoint">
+                <h3>?format=compact on code endpoints</h3>
+                <p>Leave out the combined document, which repeats the html, css and javascript. Responses are gzip/brotli compressed and carry an ETag; send it back as If-None-Match to get a 304 when the result is unchanged.</p>
+            </div>
+            
+            <div class="endpoint">
+                <h3>POST /projects, GET /projects/{id}</h3>
+                <p>Store code as a versioned project. Code requests can then send projectId (and baseVersion) instead of existingCode, and get back only the sections that changed.</p>
+            </div>
+            
+            <div class="endpoint">
+                <h3>GET /metrics</h3>
+                <p>Prometheus metrics: per-endpoint and per-stage latency, upstream calls, errors, in-flight requests and payload sizes. Responses also carry a Server-Timing header.</p>
+            </div>
+            
             <p>For detailed API documentation, visit <a href="/docs">/docs</a></p>
         </body>
     </html>
     """
 
+@app.get("/llm-stats")
+async def llm_stats():
+    """Report cache, request coalescing and prompt rendering statistics."""
+    return {
+        "cache": response_cache.stats(),
+        "singleflight": llm_flights.stats(),
+        "image_descriptions": image_descriptions.stats(),
+        "tutor_questions": tutor_questions.stats(),
+        "jobs": await asyncio.to_thread(job_queue.stats),
+        "router": llm_router.stats(),
+        "tokens": token_meter.stats(),
+        "prompts": PROMPTS.stats(),
+        "projects": await asyncio.to_thread(project_store.stats),
+        "derived_indexes": derived_indexes.stats(),
+        "admission": admission.stats()
+    }
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Expose request, stage and upstream call metrics in the Prometheus text format."""
+    job_stats = await asyncio.to_thread(job_queue.stats)
+    for status, count in job_stats.items():
+        if status not in ("workers", "running_here"):
+            jobs_gauge.set(count, status=status)
+    cache_stats = response_cache.stats()
+    llm_cache_entries.set(cache_stats["entries"])
+    llm_cache_bytes.set(cache_stats["bytes"])
+    admission_active.set(admission.active)
+    for lane, depth in admission.depth.items():
+        admission_queue.set(depth, lane=lane)
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+class ProjectInput(BaseModel):
+    code: dict
+
+@app.post("/projects")
+async def create_project(project: ProjectInput):
+    """Store code as a new project; later requests send its projectId instead of existingCode."""
+    return await project_store.create({key: project.code.get(key, '') or '' for key in SECTIONS})
+
+@app.get("/projects/{project_id}")
+async def get_project(project_id: str, version: int = None):
+    """Return a project version's full code, including the combined document."""
+    project = await project_store.get(project_id, version)
+    if project is None:
+        raise HTTPException(status_code=404, detail="Project version not found")
+    project["code"]["combined"] = build_combined_document(project["code"])
+    return project
+
+async def submit_job(kind: str, payload: dict, dedupe_key: str = None) -> JSONResponse:
+    """Queue a job and answer 202 with its id and where to poll for it."""
+    job = await job_queue.submit(kind, payload, dedupe_key or cache_key(kind, payload))
+    job["statusUrl"] = f"/jobs/{job['jobId']}"
+    return JSONResponse(status_code=202, content=job)
+
 @app.post("/generate-code")
-async def generate_code(user_input: UserInput):
+async def generate_code(user_input: UserInput, job: bool = False):
+    if job:
+        return await submit_job("generate-code", user_input.model_dump(exclude_none=True))
     try:
         if not user_input.prompt.strip():
             raise HTTPException(status_code=400, detail="Empty prompt")
+        await resolve_project(user_input)
         
-        if user_input.existingCode:
-            full_prompt = construct_modification_prompt(user_input)
+        if user_input.generationMode == "sectioned" and not user_input.existingCode:
+            code_blocks, reasoning = await generate_sectioned(user_input)
         else:
-            full_prompt = construct_new_code_prompt(user_input)
-        
-        stdout, stderr, returncode = await run_groq(
-            full_prompt,
-            temperature=user_input.temperature
-        )
-        
-        cleaned_output = clean_text(stdout)
-        
-        if not cleaned_output:
-            raise HTTPException(status_code=500, detail="No code generated")
-        
-        code_blocks = extract_code_blocks(cleaned_output)
+            with stage("prompt"):
+                if user_input.existingCode:
+                    full_prompt = construct_modification_prompt(user_input)
+                else:
+                    full_prompt = construct_new_code_prompt(user_input)
+            
+            stdout, reasoning, returncode = await run_groq(
+                full_prompt,
+                temperature=user_input.temperature,
+                timeout=user_input.timeout,
+                max_tokens=modification_max_tokens(user_input) if user_input.existingCode else None
+            )
+            
+            with stage("clean_text"):
+                cleaned_output = clean_text(stdout, user_input.keepUnicode)
+            
+            if not cleaned_output:
+                raise HTTPException(status_code=500, detail="No code generated")
+            
+            with stage("extract_code_blocks"):
+                code_blocks = extract_code_blocks(cleaned_output)
         
         if user_input.existingCode:
-            for key in ['html', 'css', 'javascript']:
-                if not code_blocks[key].strip():
-                    code_blocks[key] = user_input.existingCode.get(key, '')
+            code_blocks = merge_modification(user_input.existingCode, code_blocks, user_input.prompt)
         
-        code_blocks['combined'] = f"""<!DOCTYPE html>
-<html>
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>Generated Web Application</title>
-    <style>
-    {code_blocks['css']}
-    </style>
-</head>
-<body>
-    {code_blocks['html']}
-    <script>
-    {code_blocks['javascript']}
-    </script>
-</body>
-</html>"""
+        add_combined(code_blocks, "Generated Web Application")
         
-        return {
+        return await project_response(user_input, with_reasoning({
             "code": code_blocks,
             "type": user_input.type,
             "framework": user_input.framework,
             "isModification": bool(user_input.existingCode)
-        }
+        }, reasoning, user_input.includeReasoning))
         
+    except HTTPException:
+        raise
     except Exception as e:
         logging.error(f"Error in code generation: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/modify-code")
-async def modify_code(user_input: UserInput):
+async def modify_code(user_input: UserInput, job: bool = False):
+    if job:
+        if not (user_input.existingCode or user_input.projectId):
+            raise HTTPException(status_code=400, detail="No existing code provided")
+        return await submit_job("modify-code", user_input.model_dump(exclude_none=True))
     try:
+        await resolve_project(user_input)
         if not user_input.existingCode:
             raise HTTPException(status_code=400, detail="No existing code provided")
         
-        # Add logging for diagnostics
-        logging.debug(f"Modification Request Details:")
-        logging.debug(f"Prompt: {user_input.prompt}")
-        logging.debug(f"Modification Type: {user_input.modificationType}")
+        logging.debug(
+            "Modification request",
+            extra={"modification_type": user_input.modificationType, "prompt_chars": len(user_input.prompt)}
+        )
+        
+        # Patch mode: ask for diffs/rule edits and apply them server-side,
+        # falling back to a full-replacement round trip if they don't apply
+        patch_requested = user_input.modificationType == "patch"
+        if patch_requested:
+            with stage("prompt"):
+                patch_prompt = construct_patch_prompt(user_input)
+            stdout, reasoning, returncode = await run_groq(
+                patch_prompt,
+                temperature=0.3,
+                timeout=user_input.timeout,
+                max_tokens=modification_max_tokens(user_input, patch=True)
+            )
+            try:
+                with stage("apply_patch"):
+                    code_blocks = apply_patch_output(stdout or '', user_input.existingCode)
+                add_combined(code_blocks, "Modified Web Application")
+                return await project_response(user_input, with_reasoning(
+                    {"code": code_blocks, "patchApplied": True}, reasoning, user_input.includeReasoning
+                ))
+            except PatchError as patch_error:
+                logging.warning("Patch not applied, falling back to full replacement: %s", patch_error)
         
         # Construct modification prompt
-        full_prompt = construct_modification_prompt(user_input)
-        logging.debug(f"Full Prompt:\n{full_prompt}")
+        with stage("prompt"):
+            full_prompt = construct_modification_prompt(user_input)
+        log_payload("modify prompt", full_prompt)
         
         # Run Groq with detailed error handling
         try:
-            stdout, stderr, returncode = await run_groq(
+            stdout, reasoning, returncode = await run_groq(
                 full_prompt,
-                temperature=0.3
+                temperature=0.3,
+                timeout=user_input.timeout,
+                max_tokens=modification_max_tokens(user_input)
             )
+        except HTTPException:
+            raise
         except Exception as groq_error:
             logging.error(f"Groq API Error: {str(groq_error)}")
             raise HTTPException(status_code=500, detail=f"Groq API Error: {str(groq_error)}")
@@ -401,139 +1149,227 @@ async def modify_code(user_input: UserInput):
         # More robust error checking
         if not stdout:
             logging.warning("No output received from Groq")
-            return {
+            return await project_response(user_input, {
                 "code": user_input.existingCode,
                 "message": "No modifications suggested"
-            }
+            })
         
-        cleaned_output = clean_text(stdout)
-        logging.debug(f"Cleaned Output:\n{cleaned_output}")
+        with stage("clean_text"):
+            cleaned_output = clean_text(stdout, user_input.keepUnicode)
+        log_payload("modify output", cleaned_output)
         
-        code_blocks = extract_code_blocks(cleaned_output)
+        with stage("extract_code_blocks"):
+            code_blocks = extract_code_blocks(cleaned_output)
         
         # Fallback to existing code if no modifications
-        for key in ['html', 'css', 'javascript']:
-            if not code_blocks[key].strip():
-                code_blocks[key] = user_input.existingCode.get(key, '')
+        code_blocks = merge_modification(user_input.existingCode, code_blocks, user_input.prompt)
         
-        code_blocks['combined'] = f"""<!DOCTYPE html>
-<html>
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>Modified Web Application</title>
-    <style>
-    {code_blocks['css']}
-    </style>
-</head>
-<body>
-    {code_blocks['html']}
-    <script>
-    {code_blocks['javascript']}
-    </script>
-</body>
-</html>"""
+        add_combined(code_blocks, "Modified Web Application")
         
-        return {"code": code_blocks}
+        result = {"code": code_blocks}
+        if patch_requested:
+            result["patchApplied"] = False
+        return await project_response(user_input, with_reasoning(result, reasoning, user_input.includeReasoning))
         
+    except HTTPException:
+        raise
     except Exception as e:
         logging.error(f"Comprehensive Modification Error: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.post("/analyze-image")
-async def analyze_image(image: UploadFile = File(...)):
+async def stream_code_events(user_input: UserInput, full_prompt: str, temperature: float, title: str):
+    """Yield NDJSON events for a streamed generation: tokens, finished blocks, then the full result."""
+    extractor = CodeBlockStream(user_input.keepUnicode)
+    reasoning_filter = ReasoningFilter()
+    output = []
+    completion = []
+    max_tokens = modification_max_tokens(user_input) if user_input.existingCode else None
     try:
-        contents = await image.read()
-        img = Image.open(io.BytesIO(contents))
-        
-        # Convert image to format compatible with Gemini
-        img_bytes = io.BytesIO()
-        img.save(img_bytes, format=img.format)
-        img_bytes = img_bytes.getvalue()
+        async for text in stream_groq(full_prompt, temperature=temperature, timeout=user_input.timeout,
+                                      max_tokens=max_tokens):
+            completion.append(text)
+            # The <think> trace is dropped (or sent as reasoning events) before any parsing
+            reasoning, text = reasoning_filter.feed(text)
+            if reasoning and user_input.includeReasoning:
+                yield json.dumps({"event": "reasoning", "text": reasoning}) + "\n"
+            if not text:
+                continue
+            output.append(text)
+            yield json.dumps({"event": "token", "text": text}) + "\n"
+            for language, code in extractor.feed(text):
+                yield json.dumps({"event": "block", "language": language, "code": code}) + "\n"
+
+        reasoning, text = reasoning_filter.flush()
+        if reasoning and user_input.includeReasoning:
+            yield json.dumps({"event": "reasoning", "text": reasoning}) + "\n"
+        if text:
+            output.append(text)
+            yield json.dumps({"event": "token", "text": text}) + "\n"
+            for language, code in extractor.feed(text):
+                yield json.dumps({"event": "block", "language": language, "code": code}) + "\n"
+
+        with stage("clean_text"):
+            cleaned_output = clean_text("".join(output), user_input.keepUnicode)
+        if not cleaned_output and not user_input.existingCode:
+            raise HTTPException(status_code=500, detail="No code generated")
+
+        with stage("extract_code_blocks"):
+            code_blocks = extract_code_blocks(cleaned_output)
+        if user_input.existingCode:
+            code_blocks = merge_modification(user_input.existingCode, code_blocks, user_input.prompt)
+        add_combined(code_blocks, title)
+
+        yield json.dumps(await project_response(user_input, {
+            "event": "done",
+            "code": code_blocks,
+            "type": user_input.type,
+            "framework": user_input.framework,
+            "isModification": bool(user_input.existingCode),
+            "usage": report_usage(estimate_tokens(full_prompt) + SYSTEM_PROMPT_TOKENS, "".join(completion))
+        })) + "\n"
+
+    except HTTPException as he:
+        logging.error(f"Streaming generation error: {he.detail}")
+        event = {"event": "error", "status": he.status_code, "detail": he.detail}
+        if he.headers and "Retry-After" in he.headers:
+            event["retryAfter"] = int(he.headers["Retry-After"])
+        yield json.dumps(event) + "\n"
+    except Exception as e:
+        logging.error(f"Streaming generation error: {str(e)}")
+        yield json.dumps({"event": "error", "status": 500, "detail": str(e)}) + "\n"
+
+@app.post("/generate-code/stream")
+async def generate_code_stream(user_input: UserInput):
+    """Streaming variant of /generate-code that emits NDJSON events as tokens arrive."""
+    if not user_input.prompt.strip():
+        raise HTTPException(status_code=400, detail="Empty prompt")
+    await resolve_project(user_input)
+
+    with stage("prompt"):
+        if user_input.existingCode:
+            full_prompt = construct_modification_prompt(user_input)
+            title = "Modified Web Application"
+        else:
+            full_prompt = construct_new_code_prompt(user_input)
+            title = "Generated Web Application"
+
+    return StreamingResponse(
+        stream_code_events(user_input, full_prompt, user_input.temperature, title),
+        media_type="application/x-ndjson"
+    )
+
+@app.post("/modify-code/stream")
+async def modify_code_stream(user_input: UserInput):
+    """Streaming variant of /modify-code that emits NDJSON events as tokens arrive."""
+    await resolve_project(user_input)
+    if not user_input.existingCode:
+        raise HTTPException(status_code=400, detail="No existing code provided")
+
+    with stage("prompt"):
+        full_prompt = construct_modification_prompt(user_input)
+    return StreamingResponse(
+        stream_code_events(user_input, full_prompt, 0.3, "Modified Web Application"),
+        media_type="application/x-ndjson"
+    )
+
+async def describe_image(prepared: dict) -> str:
+    """Describe a prepared image with Gemini Vision."""
+    try:
+        # Generate description using updated Gemini Vision model
+        description_prompt = PROMPTS.render("image_description")
         
+        started = time.perf_counter()
+        outcome = "error"
         try:
-            # Generate description using updated Gemini Vision model
-            description_prompt = """Analyze this web design image and describe its structure. Include:
-1. Layout structure
-2. Color scheme
-3. UI components
-4. Typography
-5. Special features"""
-            
-            vision_response = vision_model.generate_content([
-                description_prompt,
-                {"mime_type": f"image/{img.format.lower()}", "data": img_bytes}
-            ])
-            
-            if not vision_response:
-                raise HTTPException(
-                    status_code=500,
-                    detail="Failed to generate description from image"
-                )
-                
-            description = vision_response.text
-            
-        except Exception as vision_error:
-            logging.error(f"Vision API error: {str(vision_error)}")
+            with stage("vision"):
+                content = [description_prompt, {"mime_type": prepared["mime_type"], "data": prepared["data"]}]
+                if GEMINI_API_ENDPOINT:
+                    call = asyncio.to_thread(vision_model.generate_content, content)
+                else:
+                    call = vision_model.generate_content_async(content)
+                vision_response = await asyncio.wait_for(call, timeout=LLM_TIMEOUT)
+            outcome = "ok"
+        except asyncio.CancelledError:
+            outcome = "cancelled"
+            raise
+        finally:
+            record_upstream_call(f"gemini:{VISION_MODEL}", time.perf_counter() - started, outcome)
+        
+        if not vision_response:
             raise HTTPException(
                 status_code=500,
-                detail=f"Error processing image with Gemini Vision: {str(vision_error)}"
+                detail="Failed to generate description from image"
             )
         
-        # Generate code using Gemini
-        code_prompt = f"""Convert this web design description into HTML, CSS, and JavaScript code:
+        description = vision_response.text
         
-Design Description:
-{description}
+    except HTTPException:
+        raise
+    except asyncio.TimeoutError:
+        raise HTTPException(
+            status_code=504,
+            detail=f"Gemini Vision request timed out after {LLM_TIMEOUT}s"
+        )
+    except Exception as vision_error:
+        logging.error(f"Vision API error: {str(vision_error)}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error processing image with Gemini Vision: {str(vision_error)}"
+        )
+        
+    return description
 
-Generate complete code with:
-1. Semantic HTML5 structure
-2. Modern CSS (Flexbox/Grid)
-3. Clean JavaScript
-4. Responsive design
-5. Accessibility features
+@app.post("/analyze-image")
+async def analyze_image(image: UploadFile = File(...), job: bool = False):
+    try:
+        contents = await read_upload(image, IMAGE_MAX_BYTES)
+    except ImageTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    if job:
+        return await submit_job(
+            "analyze-image",
+            {"image": base64.b64encode(contents).decode('ascii')},
+            cache_key("analyze-image", hashlib.sha256(contents).hexdigest())
+        )
+    return await analyze_image_data(contents)
 
-Return the code in the exact format below:
-```html
-[Your HTML code here]
-```
+async def analyze_image_data(contents: bytes) -> dict:
+    """Describe an uploaded image and generate code matching it."""
+    try:
+        # Decode, downscale and re-encode for Gemini in a worker process
+        loop = asyncio.get_running_loop()
+        try:
+            with stage("image_decode"):
+                prepared = await loop.run_in_executor(
+                    image_pool, prepare_image, contents, IMAGE_MAX_DIMENSION, IMAGE_ENCODE_FORMAT
+                )
+        except Exception as decode_error:
+            raise HTTPException(status_code=400, detail=f"Invalid image: {str(decode_error)}")
+        del contents
 
-```css
-[Your CSS code here]
-```
+        state = request_state.get()
+        use_cache = not (state and state["cache_bypass"])
+        width, height = prepared["image_info"]["width"], prepared["image_info"]["height"]
+        description = await image_descriptions.get(prepared["hash"], width, height) if use_cache else None
+        if use_cache and state is not None:
+            state["cache"].append(description is not None)
 
-```javascript
-[Your JavaScript code here]
-```"""
+        if description is None:
+            description = await describe_image(prepared)
+            await image_descriptions.set(prepared["hash"], width, height, description)
+        
+        # Generate code using Gemini
+        with stage("prompt"):
+            code_prompt = PROMPTS.render("image_to_code", description=description)
 
         code_output, _, _ = await run_groq(code_prompt)
-        code_blocks = extract_code_blocks(code_output)
+        with stage("extract_code_blocks"):
+            code_blocks = extract_code_blocks(code_output)
         
-        code_blocks['combined'] = f"""<!DOCTYPE html>
-<html>
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>Generated from Image</title>
-    <style>
-    {code_blocks['css']}
-    </style>
-</head>
-<body>
-    {code_blocks['html']}
-    <script>
-    {code_blocks['javascript']}
-    </script>
-</body>
-</html>"""
+        add_combined(code_blocks, "Generated from Image")
         
         return {
-            "image_info": {
-                "width": img.size[0],
-                "height": img.size[1],
-                "format": img.format,
-                "mode": img.mode
-            },
+            "image_info": prepared["image_info"],
             "description": description,
             "code": code_blocks
         }
@@ -547,29 +1383,56 @@ Return the code in the exact format below:
             detail=f"Error analyzing image: {str(e)}"
         )
 
+job_queue.register("generate-code", lambda payload: generate_code(UserInput(**payload)))
+job_queue.register("modify-code", lambda payload: modify_code(UserInput(**payload)))
+job_queue.register("analyze-image", lambda payload: analyze_image_data(base64.b64decode(payload["image"])))
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Poll a job: its status, plus the result or error once it has finished."""
+    job = await job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str):
+    """Subscribe to a job: one NDJSON line per status change, ending when it finishes."""
+    if await job_queue.get(job_id) is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    async def events():
+        async for job in job_queue.watch(job_id):
+            yield json.dumps(job) + "\n"
+
+    return StreamingResponse(events(), media_type="application/x-ndjson")
+
+@app.delete("/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    if not await job_queue.cancel(job_id):
+        job = await job_queue.get(job_id, touch=False)
+        if job is None:
+            raise HTTPException(status_code=404, detail="Job not found")
+        return {"jobId": job_id, "status": job["status"], "cancelled": False}
+    return {"jobId": job_id, "status": "cancelled", "cancelled": True}
+
 @app.post("/parse-html")
 async def parse_html(content: dict):
     try:
         html_content = content.get('html', '')
         
-        # Parse HTML and extract components
-        css = re.search(r'<style>(.*?)</style>', html_content, re.DOTALL)
-        js = re.search(r'<script>(.*?)</script>', html_content, re.DOTALL)
+        # Split out inline <style>/<script> elements in a single pass
+        code = split_html_document(html_content)
+        if not compact_response():
+            code['combined'] = html_content
         
-        return {
-            "code": {
-                "html": re.sub(r'<style>.*?</style>|<script>.*?</script>', '', html_content, flags=re.DOTALL),
-                "css": css.group(1).strip() if css else '',
-                "javascript": js.group(1).strip() if js else '',
-                "combined": html_content
-            }
-        }
+        return {"code": code}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
         
-@app.post("/ai-tutor")
-async def ai_tutor(input_data: dict):
+async def tutor_answer(input_data: dict) -> dict:
+    """Answer one AI tutor question; errors are reported in the result, not raised."""
     try:
         prompt = input_data.get('prompt', '').strip().lower()  # Lowercase for easier matching
         context = input_data.get('context', 'web development')
@@ -585,7 +1448,7 @@ async def ai_tutor(input_data: dict):
         # Check for simple greetings and respond formally
         greetings = ["hi", "hello", "hey", "hi there"]
         if prompt in greetings:
-            logging.debug(f"Detected greeting: {prompt}")
+            logging.debug("Detected greeting")
             return {
                 "status": "success",
                 "context": context,
@@ -593,30 +1456,28 @@ async def ai_tutor(input_data: dict):
                 "timestamp": datetime.now().isoformat()
             }
         
-        # Full prompt for non-greetings with formal tone
-        full_prompt = f"""You are an AI tutor specializing in web development. 
-Provide a formal, educational response to the following question, maintaining a professional and courteous tone:
-
-Context: {context}
-Question: {prompt}
-
-Guidelines:
-1. Explain concepts clearly and professionally for learners
-2. Include practical examples where applicable
-3. Present complex topics in an organized, step-by-step manner
-4. Offer additional resources or guidance as appropriate
-
-Response Format:
-- Begin with a concise, formal explanation
-- Provide a structured breakdown of steps
-- Include a relevant code example if applicable
-- Conclude with formal suggestions for further learning"""
+        # Rephrasings of a question answered before reuse its answer
+        state = request_state.get()
+        match = None
+        if not (state and state["cache_bypass"]):
+            with stage("question_index"):
+                match = await tutor_questions.get(context, prompt)
+            if state is not None:
+                state["cache"].append(match is not None)
         
-        logging.debug(f"Sending prompt to Groq: {full_prompt}")
-        stdout, stderr, returncode = await run_groq(full_prompt, temperature=0.7)
-        logging.debug(f"Raw Groq Response: {stdout}")
+        if match is not None:
+            stdout, reasoning = match["answer"], match["reasoning"]
+        else:
+            # Full prompt for non-greetings with formal tone
+            with stage("prompt"):
+                full_prompt = PROMPTS.render("ai_tutor", context=context, prompt=prompt)
+            
+            log_payload("tutor prompt", full_prompt)
+            stdout, reasoning, returncode = await run_groq(full_prompt, temperature=0.7, route="tutor")
+            log_payload("tutor response", stdout)
         
-        cleaned_response = clean_text(stdout)
+        with stage("clean_text"):
+            cleaned_response = clean_text(stdout, input_data.get('keepUnicode', KEEP_UNICODE))
         if not cleaned_response:
             logging.warning("Empty response from Groq after cleaning")
             return {
@@ -625,15 +1486,31 @@ Response Format:
                 "response": None
             }
         
-        logging.info("Successfully generated tutor response")
-        return {
+        logging.info(
+            "Generated tutor response",
+            extra={"duration_ms": elapsed_ms(), "response_chars": len(cleaned_response),
+                   "similar_question": match is not None}
+        )
+        result = {
             "status": "success",
             "context": context,
             "response": cleaned_response,
             "timestamp": datetime.now().isoformat()
         }
+        if match is not None:
+            result["source"] = {
+                "type": "similar_question",
+                "question": match["question"],
+                "similarity": match["similarity"],
+                "answeredAt": datetime.fromtimestamp(match["answered_at"]).isoformat()
+            }
+        else:
+            await tutor_questions.set(context, prompt, stdout, reasoning)
+        return with_reasoning(result, reasoning, input_data.get('includeReasoning', False))
         
     except Exception as e:
+        if isinstance(e, HTTPException) and e.status_code == 429:
+            raise  # shed by admission control: a real 429 tells the client to back off
         logging.error(f"AI Tutor Error: {str(e)}", exc_info=True)
         return {
             "status": "error", 
@@ -643,8 +1520,8 @@ Response Format:
 
 
 
-@app.post("/code-review")
-async def code_review(code_data: dict):
+async def review_code(code_data: dict) -> dict:
+    """Review one piece of code, raising HTTPException on failure."""
     try:
         code = code_data.get('code', '').strip()
         language = code_data.get('language', 'javascript')
@@ -653,62 +1530,101 @@ async def code_review(code_data: dict):
             raise HTTPException(status_code=400, detail="No code provided")
         
         # Construct a detailed code review prompt
-        review_prompt = f"""Act as an expert code reviewer for {language} code. 
-Perform a deep, comprehensive code analysis with precise, actionable feedback:
-
-Code to Review:
-{code}
-
-COMPREHENSIVE REVIEW GUIDELINES:
-1. Code Quality Assessment
-   - Evaluate overall code structure
-   - Check adherence to best practices
-   - Assess readability and maintainability
-
-2. Performance Analysis
-   - Identify potential performance bottlenecks
-   - Suggest optimization strategies
-   - Recommend efficient alternatives
-
-3. Security Evaluation
-   - Detect potential security vulnerabilities
-   - Highlight risks and provide mitigation strategies
-   - Suggest defensive programming techniques
-
-4. Best Practices and Improvements
-   - Recommend code refactoring techniques
-   - Suggest modern coding patterns
-   - Provide specific, implementable suggestions
-
-5. Specific Focus Areas:
-   - Variable naming conventions
-   - Error handling
-   - Code modularity
-   - Potential memory leaks
-   - Unnecessary computations
-
-Output Format:
-- Provide a structured, detailed review
-- Use a professional, constructive tone
-- Prioritize actionable insights
-- Include code snippets for improvement where applicable
-"""
+        with stage("prompt"):
+            review_prompt = PROMPTS.render("code_review", language=language, code=code)
         
         # Use Groq to generate the code review
-        stdout, stderr, returncode = await run_groq(review_prompt, temperature=0.3)
+        stdout, reasoning, returncode = await run_groq(review_prompt, temperature=0.3, route="review")
         
         # Clean and parse the output
-        cleaned_output = clean_text(stdout)
+        with stage("clean_text"):
+            cleaned_output = clean_text(stdout, code_data.get('keepUnicode', KEEP_UNICODE))
         
-        return {
+        return with_reasoning({
             "status": "success",
             "language": language,
             "review": cleaned_output
-        }
+        }, reasoning, code_data.get('includeReasoning', False))
         
+    except HTTPException:
+        raise
     except Exception as e:
         logging.error(f"Code Review Error: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
+
+async def batch_events(items: list, defaults: dict, handler):
+    """Run handler over items with bounded concurrency, yielding NDJSON lines as each finishes.
+
+    Each item gets its own result line (with its index, and id if given) so
+    one failure doesn't fail the batch; a final "done" line summarizes.
+    Items still running are cancelled if the client goes away.
+    """
+    semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+    async def run_item(index: int, item):
+        async with semaphore:
+            try:
+                if not isinstance(item, dict):
+                    raise HTTPException(status_code=400, detail="Batch items must be objects")
+                result = await handler({**defaults, **item})
+            except HTTPException as he:
+                result = {"status": "error", "message": he.detail}
+                if he.headers and "Retry-After" in he.headers:
+                    result["retryAfter"] = int(he.headers["Retry-After"])
+            except Exception as e:
+                logging.error(f"Batch item {index} error: {str(e)}")
+                result = {"status": "error", "message": str(e)}
+        line = {"event": "result", "index": index}
+        if isinstance(item, dict) and "id" in item:
+            line["id"] = item["id"]
+        line.update(result)
+        return line
+
+    tasks = [asyncio.create_task(run_item(index, item)) for index, item in enumerate(items)]
+    succeeded = 0
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            line = await next_done
+            if line.get("status") == "success":
+                succeeded += 1
+            yield json.dumps(line) + "\n"
+        yield json.dumps({
+            "event": "done",
+            "total": len(items),
+            "succeeded": succeeded,
+            "failed": len(items) - succeeded
+        }) + "\n"
+    finally:
+        for task in tasks:
+            task.cancel()
+
+def batch_response(batch: dict, handler) -> StreamingResponse:
+    """Validate a batch request body and stream its results."""
+    items = batch.get('items')
+    if not isinstance(items, list) or not items:
+        raise HTTPException(status_code=400, detail="Provide a non-empty list of items")
+    if len(items) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"At most {BATCH_MAX_ITEMS} items per batch")
+    defaults = {key: value for key, value in batch.items() if key != 'items'}
+    return StreamingResponse(batch_events(items, defaults, handler), media_type="application/x-ndjson")
+
+@app.post("/ai-tutor")
+async def ai_tutor(input_data: dict):
+    return await tutor_answer(input_data)
+
+@app.post("/ai-tutor/batch")
+async def ai_tutor_batch(batch: dict):
+    """Answer several tutor questions at once, streaming NDJSON results in completion order."""
+    return batch_response(batch, tutor_answer)
+
+@app.post("/code-review")
+async def code_review(code_data: dict):
+    return await review_code(code_data)
+
+@app.post("/code-review/batch")
+async def code_review_batch(batch: dict):
+    """Review several submissions at once, streaming NDJSON results in completion order."""
+    return batch_response(batch, review_code)
     
     
 if __name__ == "__main__":
@@ -0,0 +1,80 @@
+"""Benchmark clean_text against the previous four-pass implementation.
+
+Run from the backend directory:
+
+    python benchmarks/bench_clean_text.py [--sizes 100K,1M] [--repeat 20]
+"""
+import argparse
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from model_output import clean_text  # noqa: E402
+
+
+def legacy_clean_text(text: str) -> str:
+    """The original clean_text: generator filter, CR replace, ANSI regex, line re-join."""
+    if not text:
+        return ""
+    text = ''.join(char for char in text if ord(char) < 128)
+    text = text.replace('\r\n', '\n').replace('\r', '\n')
+    text = re.sub(r'\x1B(?:[@-Z\\-_]|\[[0-?]*[ -/]*[@-~])', '', text)
+    text = '\n'.join(line.strip() for line in text.split('\n'))
+    return text.strip()
+
+
+def make_completion(size: int, unicode_ratio: bool) -> str:
+    """A completion of roughly size characters with indented code and some non-ASCII text."""
+    lines = [
+        '    <div class="card">',
+        '        <h2>Welcome</h2>',
+        '        <p>Café menu — today’s specials \U0001F600</p>' if unicode_ratio else
+        '        <p>Cafe menu - todays specials</p>',
+        '    </div>',
+        '    .card { display: flex; gap: 8px; }   ',
+        '    document.querySelector(".card").classList.add("ready");',
+    ]
+    block = "\n".join(lines) + "\n"
+    return block * (size // len(block) + 1)
+
+
+def parse_size(text: str) -> int:
+    text = text.strip().upper()
+    multiplier = {"K": 1024, "M": 1024 * 1024}.get(text[-1], 1)
+    return int(float(text.rstrip("KM")) * multiplier)
+
+
+def best_time(fn, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--sizes", default="100K,1M")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    print(f"{'input':>12}  {'size':>6}  {'legacy (ms)':>12}  {'ascii (ms)':>11}  {'unicode (ms)':>12}  {'speedup':>8}")
+    for label in args.sizes.split(","):
+        for name, with_unicode in (("ascii-only", False), ("with unicode", True)):
+            text = make_completion(parse_size(label), with_unicode)
+            assert clean_text(text) == legacy_clean_text(text)
+            legacy = best_time(lambda: legacy_clean_text(text), args.repeat)
+            ascii_mode = best_time(lambda: clean_text(text), args.repeat)
+            unicode_mode = best_time(lambda: clean_text(text, keep_unicode=True), args.repeat)
+            print(
+                f"{name:>12}  {label:>6}  {legacy * 1000:12.2f}  {ascii_mode * 1000:11.2f}  "
+                f"{unicode_mode * 1000:12.2f}  {legacy / ascii_mode:7.1f}x"
+            )
+
+
+if __name__ == "__main__":
+    main()
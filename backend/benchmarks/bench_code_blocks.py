@@ -0,0 +1,108 @@
+"""Benchmark extract_code_blocks and /parse-html splitting against the previous regex scans.
+
+Run from the backend directory:
+
+    python benchmarks/bench_code_blocks.py [--sizes 10K,100K,1M,5M] [--repeat 5]
+"""
+import argparse
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from model_output import extract_code_blocks, split_html_document  # noqa: E402
+
+
+def legacy_extract_code_blocks(text: str) -> dict:
+    """The original extract_code_blocks: three DOTALL searches, first block only."""
+    blocks = {
+        'html': '',
+        'css': '',
+        'javascript': ''
+    }
+    html_match = re.search(r'```html\s*(.*?)\s*```', text, re.DOTALL)
+    css_match = re.search(r'```css\s*(.*?)\s*```', text, re.DOTALL)
+    js_match = re.search(r'```javascript\s*(.*?)\s*```', text, re.DOTALL)
+    if html_match:
+        blocks['html'] = html_match.group(1).strip()
+    if css_match:
+        blocks['css'] = css_match.group(1).strip()
+    if js_match:
+        blocks['javascript'] = js_match.group(1).strip()
+    return blocks
+
+
+def legacy_split_html_document(html_content: str) -> dict:
+    """The original /parse-html body: three more regex passes."""
+    css = re.search(r'<style>(.*?)</style>', html_content, re.DOTALL)
+    js = re.search(r'<script>(.*?)</script>', html_content, re.DOTALL)
+    return {
+        "html": re.sub(r'<style>.*?</style>|<script>.*?</script>', '', html_content, flags=re.DOTALL),
+        "css": css.group(1).strip() if css else '',
+        "javascript": js.group(1).strip() if js else '',
+    }
+
+
+def make_model_output(size: int) -> str:
+    """A completion of roughly size characters: prose, then html, css and js blocks.
+
+    The JavaScript block comes last, so the legacy regexes have to scan the
+    whole text, as they do for real completions.
+    """
+    third = max(size // 3, 1)
+    html_line = '<div class="card"><h2>Title</h2><p>Some text for the card.</p></div>\n'
+    css_line = '.card { display: flex; padding: 12px; border-radius: 8px; }\n'
+    js_line = 'document.querySelectorAll(".card").forEach((c) => c.classList.add("ready"));\n'
+    return (
+        "Here is the implementation you asked for.\n\n"
+        "```html\n" + html_line * (third // len(html_line) + 1) + "```\n\n"
+        "And the styles:\n\n"
+        "```css\n" + css_line * (third // len(css_line) + 1) + "```\n\n"
+        "Finally the script:\n\n"
+        "```javascript\n" + js_line * (third // len(js_line) + 1) + "```\n"
+    )
+
+
+def parse_size(text: str) -> int:
+    text = text.strip().upper()
+    multiplier = {"K": 1024, "M": 1024 * 1024}.get(text[-1], 1)
+    return int(float(text.rstrip("KM")) * multiplier)
+
+
+def best_time(fn, arg, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(arg)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--sizes", default="10K,100K,1M,5M")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'case':>14}  {'size':>6}  {'legacy (ms)':>12}  {'current (ms)':>12}  {'speedup':>8}")
+    for label in args.sizes.split(","):
+        output = make_model_output(parse_size(label))
+        blocks = extract_code_blocks(output)
+        document = (
+            f"<html><head><style>{blocks['css']}</style></head>"
+            f"<body>{blocks['html']}<script>{blocks['javascript']}</script></body></html>"
+        )
+        cases = [
+            ("extract", legacy_extract_code_blocks, extract_code_blocks, output),
+            ("parse-html", legacy_split_html_document, split_html_document, document),
+        ]
+        for name, legacy_fn, current_fn, arg in cases:
+            legacy = best_time(legacy_fn, arg, args.repeat)
+            current = best_time(current_fn, arg, args.repeat)
+            print(f"{name:>14}  {label:>6}  {legacy * 1000:12.2f}  {current * 1000:12.2f}  {legacy / current:7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
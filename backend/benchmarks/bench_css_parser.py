@@ -0,0 +1,122 @@
+"""Benchmark parse_stylesheet against the previous per-character parse_css_rules.
+
+Run from the backend directory:
+
+    python benchmarks/bench_css_parser.py [--sizes 10K,100K,1M,5M] [--repeat 3]
+"""
+import argparse
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from css_parser import parse_stylesheet  # noqa: E402
+
+
+def legacy_parse_css_properties(properties_text: str) -> dict:
+    """The original parse_css_properties, used by the baseline."""
+    properties = {}
+    for prop in properties_text.split(';'):
+        prop = prop.strip()
+        if not prop:
+            continue
+        if ':' in prop:
+            key, value = prop.split(':', 1)
+            properties[key.strip()] = value.strip()
+    return properties
+
+
+def legacy_parse_css_rules(css_text: str) -> dict:
+    """The original parse_css_rules, kept here as the benchmark baseline."""
+    rules = {}
+    css_text = re.sub(r'/\*.*?\*/', '', css_text, flags=re.DOTALL)
+    css_text = re.sub(r'\s+', ' ', css_text.strip())
+
+    brackets_count = 0
+    current_selector = ""
+    current_properties = ""
+
+    for char in css_text:
+        if char == '{':
+            if brackets_count == 0:
+                current_selector = current_selector.strip()
+            brackets_count += 1
+            if brackets_count == 1:
+                continue
+        elif char == '}':
+            brackets_count -= 1
+            if brackets_count == 0:
+                rules[current_selector] = legacy_parse_css_properties(current_properties.strip())
+                current_selector = ""
+                current_properties = ""
+                continue
+
+        if brackets_count == 0:
+            current_selector += char
+        else:
+            current_properties += char
+
+    return rules
+
+
+def make_stylesheet(size: int) -> str:
+    """Build a realistic stylesheet of roughly size characters."""
+    chunks = []
+    total = 0
+    i = 0
+    while total < size:
+        chunk = (
+            f"/* section {i} */\n"
+            f".card-{i}, .card-{i} > .title {{\n"
+            f"    display: flex;\n"
+            f"    padding: {i % 24}px {i % 12}px;\n"
+            f"    font-family: \"Helvetica Neue\", Arial, sans-serif;\n"
+            f"    background: linear-gradient(90deg, #fff 0%, #{i % 999:03d} 100%);\n"
+            f"}}\n"
+        )
+        if i % 10 == 0:
+            chunk += (
+                f"@media (max-width: {600 + i % 400}px) {{\n"
+                f"    .card-{i} {{ flex-direction: column; }}\n"
+                f"    .card-{i} > .title {{ font-size: 1.2em; }}\n"
+                f"}}\n"
+            )
+        chunks.append(chunk)
+        total += len(chunk)
+        i += 1
+    return "".join(chunks)
+
+
+def parse_size(text: str) -> int:
+    text = text.strip().upper()
+    multiplier = {"K": 1024, "M": 1024 * 1024}.get(text[-1], 1)
+    return int(float(text.rstrip("KM")) * multiplier)
+
+
+def best_time(fn, arg, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(arg)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--sizes", default="10K,100K,1M,5M")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'size':>8}  {'legacy (ms)':>12}  {'current (ms)':>12}  {'speedup':>8}")
+    for label in args.sizes.split(","):
+        css = make_stylesheet(parse_size(label))
+        legacy = best_time(legacy_parse_css_rules, css, args.repeat)
+        current = best_time(parse_stylesheet, css, args.repeat)
+        print(f"{label:>8}  {legacy * 1000:12.1f}  {current * 1000:12.1f}  {legacy / current:7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
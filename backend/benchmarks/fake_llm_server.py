@@ -0,0 +1,209 @@
+"""Local stand-in for the Groq (OpenAI-style) and Gemini APIs, for load tests.
+
+Answers chat completions (streamed or not) and Gemini generateContent calls
+with canned outputs after a configurable delay, so the backend can be
+benchmarked without spending API quota. Run from the backend directory:
+
+    python benchmarks/fake_llm_server.py [--port 9100] [--latency 0.5] [--tokens-per-second 200]
+
+and point the backend at it:
+
+    GROQ_BASE_URL=http://127.0.0.1:9100 gemini_api_endpoint=http://127.0.0.1:9100 uvicorn app:app
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+CODE_REPLY = """Here is the application:
+
+```html
+<div class="app">
+    <h1>Todo list</h1>
+    <input id="task" placeholder="New task">
+    <button id="add">Add</button>
+    <ul id="tasks"></ul>
+</div>
+```
+
+```css
+.app { max-width: 480px; margin: 2rem auto; font-family: sans-serif; }
+#tasks li { display: flex; justify-content: space-between; padding: 0.5rem 0; }
+button { padding: 0.5rem 1rem; border-radius: 4px; }
+```
+
+```javascript
+document.getElementById("add").addEventListener("click", () => {
+    const input = document.getElementById("task");
+    if (!input.value.trim()) return;
+    const item = document.createElement("li");
+    item.textContent = input.value;
+    document.getElementById("tasks").appendChild(item);
+    input.value = "";
+});
+```
+"""
+
+TEXT_REPLY = """Flexbox lays out items along a main axis. Set `display: flex` on the
+container, then use `justify-content` to distribute items along the main axis
+and `align-items` to align them on the cross axis. For example:
+
+```css
+.row { display: flex; justify-content: space-between; align-items: center; }
+```
+
+Strengths: clear structure. Suggestions: add error handling and comments.
+"""
+
+IMAGE_DESCRIPTION = (
+    "A landing page with a dark navigation bar, a centered hero heading, a short "
+    "paragraph of text and two rounded call-to-action buttons below it."
+)
+
+# First matching substring of the prompt picks the reply; the last entry is the default
+DEFAULT_REPLIES = [
+    ["AI tutor", TEXT_REPLY],
+    ["code review", TEXT_REPLY],
+    ["", CODE_REPLY]
+]
+
+
+class FakeLLM:
+    """Canned replies delivered at a simulated time to first token and token rate."""
+
+    def __init__(self, replies: list, latency: float, tokens_per_second: float, jitter: float,
+                 error_rate: float):
+        self.replies = replies
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.requests = 0
+
+    def reply(self, prompt: str) -> str:
+        for needle, reply in self.replies:
+            if needle.lower() in prompt.lower():
+                return reply
+        return self.replies[-1][1]
+
+    def chunks(self, text: str, max_tokens: int = None) -> list:
+        # About four characters per token, like the providers' tokenizers on English and code
+        pieces = [text[i:i + 4] for i in range(0, len(text), 4)]
+        return pieces[:max_tokens] if max_tokens else pieces
+
+    def first_token_delay(self) -> float:
+        return max(self.latency * (1 + random.uniform(-self.jitter, self.jitter)), 0)
+
+    def token_delay(self) -> float:
+        return 1 / self.tokens_per_second if self.tokens_per_second > 0 else 0
+
+    def fail(self) -> bool:
+        self.requests += 1
+        return random.random() < self.error_rate
+
+
+def chat_prompt(body: dict) -> str:
+    return "\n".join(str(message.get("content", "")) for message in body.get("messages", []))
+
+
+def create_app(llm: FakeLLM) -> FastAPI:
+    app = FastAPI()
+
+    async def chat_completions(request: Request):
+        body = await request.json()
+        if llm.fail():
+            raise HTTPException(status_code=503, detail="Simulated upstream failure")
+        pieces = llm.chunks(llm.reply(chat_prompt(body)), body.get("max_tokens"))
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        created = int(time.time())
+        model = body.get("model", "fake")
+
+        if not body.get("stream"):
+            await asyncio.sleep(llm.first_token_delay() + llm.token_delay() * len(pieces))
+            return JSONResponse({
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": "".join(pieces)},
+                    "finish_reason": "stop"
+                }],
+                "usage": {"prompt_tokens": len(chat_prompt(body)) // 4, "completion_tokens": len(pieces),
+                          "total_tokens": len(chat_prompt(body)) // 4 + len(pieces)}
+            })
+
+        async def events():
+            await asyncio.sleep(llm.first_token_delay())
+            for piece in pieces:
+                chunk = {
+                    "id": completion_id,
+                    "object": "chat.completion.chunk",
+                    "created": created,
+                    "model": model,
+                    "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}]
+                }
+                yield f"data: {json.dumps(chunk)}\n\n"
+                if llm.token_delay():
+                    await asyncio.sleep(llm.token_delay())
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    # Groq's client posts to /openai/v1/..., generic OpenAI-compatible clients to /v1/...
+    app.post("/openai/v1/chat/completions")(chat_completions)
+    app.post("/v1/chat/completions")(chat_completions)
+
+    @app.post("/v1beta/models/{target}")
+    async def gemini_generate_content(target: str, request: Request):
+        if not target.endswith(":generateContent"):
+            raise HTTPException(status_code=404, detail=f"Unsupported Gemini method {target}")
+        await request.body()
+        if llm.fail():
+            raise HTTPException(status_code=503, detail="Simulated upstream failure")
+        pieces = llm.chunks(IMAGE_DESCRIPTION)
+        await asyncio.sleep(llm.first_token_delay() + llm.token_delay() * len(pieces))
+        return {
+            "candidates": [{
+                "content": {"role": "model", "parts": [{"text": IMAGE_DESCRIPTION}]},
+                "finishReason": "STOP",
+                "index": 0
+            }]
+        }
+
+    @app.get("/stats")
+    async def stats():
+        return {"requests": llm.requests}
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--latency", type=float, default=0.5, help="seconds to the first token")
+    parser.add_argument("--tokens-per-second", type=float, default=200, help="0 sends the whole reply at once")
+    parser.add_argument("--jitter", type=float, default=0.2, help="latency varies by +/- this fraction")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of calls answered with a 503")
+    parser.add_argument("--replies", help='JSON file of [["prompt substring", "reply"], ...]; last is the default')
+    args = parser.parse_args()
+
+    replies = DEFAULT_REPLIES
+    if args.replies:
+        with open(args.replies) as f:
+            replies = json.load(f)
+
+    import uvicorn
+    llm = FakeLLM(replies, args.latency, args.tokens_per_second, args.jitter, args.error_rate)
+    uvicorn.run(create_app(llm), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,307 @@
+"""Load-test the backend's endpoints and report throughput, latency and event-loop lag.
+
+With --spawn, starts benchmarks/fake_llm_server.py and the backend (wired to
+it, with throwaway databases) so nothing calls a real API. Run from the
+backend directory:
+
+    python benchmarks/load_test.py --spawn [--concurrency 16] [--duration 20] [--latency 0.5]
+    python benchmarks/load_test.py --url http://localhost:8000 --endpoints ai-tutor,code-review
+
+Requests send Cache-Control: no-cache (unless --cache) and vary their
+prompts, so every one reaches the (fake) LLM. Event-loop lag comes from the
+backend's app_event_loop_lag_seconds histogram, scraped from /metrics
+before and after the run. --max-loop-lag-ms, --max-p95-ms and --min-rps
+make the run exit non-zero when exceeded, to catch regressions.
+"""
+import argparse
+import asyncio
+import io
+import itertools
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+from PIL import Image
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+EXISTING_CODE = {
+    "html": '<div class="app">\n    <h1>Todo list</h1>\n    <ul id="tasks"></ul>\n</div>',
+    "css": ".app { max-width: 480px; margin: 2rem auto; }\n#tasks li { padding: 0.5rem 0; }",
+    "javascript": 'document.getElementById("tasks").innerHTML = "";'
+}
+
+REVIEW_CODE = """function total(items) {
+    var sum = 0;
+    for (var i = 0; i < items.length; i++) { sum += items[i].price * items[i].qty; }
+    return sum;
+}"""
+
+
+def make_png(seed: int) -> bytes:
+    img = Image.new("RGB", (640, 480), (seed * 37 % 256, seed * 91 % 256, 200))
+    for x in range(0, 640, 40):
+        img.paste((255, 255, 255), (x, 0, x + 4, 480))
+    output = io.BytesIO()
+    img.save(output, format="PNG")
+    return output.getvalue()
+
+
+def request_for(endpoint: str, n: int) -> dict:
+    """httpx request arguments for the nth request to endpoint."""
+    if endpoint == "generate-code":
+        return {"json": {"prompt": f"Build a todo list app with filters (variant {n})"}}
+    if endpoint == "modify-code":
+        return {"json": {"prompt": f"Add a clear-all button (variant {n})", "existingCode": EXISTING_CODE}}
+    if endpoint == "analyze-image":
+        return {"files": {"image": (f"page-{n}.png", make_png(n), "image/png")}}
+    if endpoint == "code-review":
+        return {"json": {"code": f"// variant {n}\n{REVIEW_CODE}", "language": "javascript"}}
+    if endpoint == "ai-tutor":
+        return {"json": {"prompt": f"How does flexbox alignment work? (variant {n})"}}
+    raise ValueError(f"Unknown endpoint {endpoint!r}")
+
+
+def percentile(values: list, fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+def parse_histogram(metrics_text: str, name: str) -> dict:
+    """Bucket counts ({le: count}), sum and count of an unlabeled histogram."""
+    buckets = {}
+    for bound, value in re.findall(rf'^{name}_bucket\{{le="([^"]+)"\}} (\S+)$', metrics_text, re.M):
+        buckets[float(bound)] = float(value)
+    total = re.search(rf'^{name}_sum (\S+)$', metrics_text, re.M)
+    count = re.search(rf'^{name}_count (\S+)$', metrics_text, re.M)
+    return {
+        "buckets": buckets,
+        "sum": float(total.group(1)) if total else 0.0,
+        "count": float(count.group(1)) if count else 0.0
+    }
+
+
+def histogram_delta(before: dict, after: dict) -> dict:
+    """Summarize the observations made between two scrapes; quantiles are bucket upper bounds."""
+    count = after["count"] - before["count"]
+    if count <= 0:
+        return {"samples": 0, "mean_ms": 0.0, "p99_ms": 0.0, "max_ms": 0.0}
+    bounds = sorted(after["buckets"])
+    cumulative = [after["buckets"][bound] - before["buckets"].get(bound, 0.0) for bound in bounds]
+
+    def quantile(fraction):
+        for bound, seen in zip(bounds, cumulative):
+            if seen >= fraction * count:
+                return bound
+        return bounds[-1]
+
+    return {
+        "samples": int(count),
+        "mean_ms": round((after["sum"] - before["sum"]) / count * 1000, 2),
+        "p99_ms": quantile(0.99) * 1000,
+        "max_ms": quantile(1.0) * 1000
+    }
+
+
+def parse_server_timing(header: str) -> dict:
+    stages = {}
+    for entry in filter(None, (part.strip() for part in header.split(","))):
+        name, _, duration = entry.partition(";dur=")
+        if duration:
+            stages[name] = float(duration)
+    return stages
+
+
+async def run_load(base_url: str, endpoints: list, concurrency: int, duration: float, use_cache: bool,
+                   timeout: float) -> dict:
+    results = {endpoint: {"latencies": [], "errors": 0, "statuses": {}, "stages": {}} for endpoint in endpoints}
+    counter = itertools.count()
+    headers = {} if use_cache else {"Cache-Control": "no-cache"}
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=timeout, limits=limits) as client:
+        metrics_before = (await client.get("/metrics")).text
+        deadline = time.perf_counter() + duration
+
+        async def worker():
+            while time.perf_counter() < deadline:
+                n = next(counter)
+                endpoint = endpoints[n % len(endpoints)]
+                result = results[endpoint]
+                start = time.perf_counter()
+                try:
+                    response = await client.post(f"/{endpoint}", headers=headers, **request_for(endpoint, n))
+                    status = response.status_code
+                    ok = status == 200 and (endpoint not in ("ai-tutor", "code-review")
+                                            or response.json().get("status") == "success")
+                    for stage, ms in parse_server_timing(response.headers.get("server-timing", "")).items():
+                        result["stages"].setdefault(stage, []).append(ms)
+                except httpx.HTTPError as e:
+                    status, ok = type(e).__name__, False
+                result["latencies"].append(time.perf_counter() - start)
+                result["statuses"][str(status)] = result["statuses"].get(str(status), 0) + 1
+                if not ok:
+                    result["errors"] += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+        metrics_after = (await client.get("/metrics")).text
+
+    report = {"concurrency": concurrency, "duration_s": round(elapsed, 2), "endpoints": {}}
+    all_latencies = []
+    for endpoint, result in results.items():
+        latencies = result["latencies"]
+        all_latencies.extend(latencies)
+        report["endpoints"][endpoint] = {
+            "requests": len(latencies),
+            "errors": result["errors"],
+            "rps": round(len(latencies) / elapsed, 2),
+            "p50_ms": round(percentile(latencies, 0.5) * 1000, 1),
+            "p95_ms": round(percentile(latencies, 0.95) * 1000, 1),
+            "p99_ms": round(percentile(latencies, 0.99) * 1000, 1),
+            "statuses": result["statuses"],
+            "stages_mean_ms": {
+                stage: round(sum(values) / len(values), 2) for stage, values in result["stages"].items()
+            }
+        }
+    report["total"] = {
+        "requests": len(all_latencies),
+        "errors": sum(result["errors"] for result in results.values()),
+        "rps": round(len(all_latencies) / elapsed, 2),
+        "p50_ms": round(percentile(all_latencies, 0.5) * 1000, 1),
+        "p95_ms": round(percentile(all_latencies, 0.95) * 1000, 1),
+        "p99_ms": round(percentile(all_latencies, 0.99) * 1000, 1)
+    }
+    report["event_loop_lag"] = histogram_delta(
+        parse_histogram(metrics_before, "app_event_loop_lag_seconds"),
+        parse_histogram(metrics_after, "app_event_loop_lag_seconds")
+    )
+    return report
+
+
+def print_report(report: dict):
+    print(f"{'endpoint':>14}  {'requests':>8}  {'errors':>6}  {'rps':>7}  {'p50 (ms)':>9}  {'p95 (ms)':>9}  {'p99 (ms)':>9}")
+    for name, row in list(report["endpoints"].items()) + [("total", report["total"])]:
+        print(
+            f"{name:>14}  {row['requests']:8d}  {row['errors']:6d}  {row['rps']:7.2f}  "
+            f"{row['p50_ms']:9.1f}  {row['p95_ms']:9.1f}  {row['p99_ms']:9.1f}"
+        )
+    lag = report["event_loop_lag"]
+    print(
+        f"\nevent loop lag: mean {lag['mean_ms']:.2f} ms, p99 <= {lag['p99_ms']:g} ms, "
+        f"max <= {lag['max_ms']:g} ms ({lag['samples']} samples)"
+    )
+    print("\nmean stage time (ms, from Server-Timing):")
+    for name, row in report["endpoints"].items():
+        stages = ", ".join(f"{stage} {ms:.2f}" for stage, ms in row["stages_mean_ms"].items())
+        print(f"{name:>14}  {stages}")
+
+
+def wait_until_up(url: str, process: subprocess.Popen, timeout: float = 30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{' '.join(process.args)} exited with {process.returncode}")
+        try:
+            httpx.get(url, timeout=1)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up within {timeout}s")
+
+
+def spawn(args, workdir: str) -> list:
+    """Start the fake LLM server and a backend wired to it; returns the processes."""
+    fake_url = f"http://127.0.0.1:{args.fake_port}"
+    fake = subprocess.Popen([
+        sys.executable, os.path.join(BACKEND_DIR, "benchmarks", "fake_llm_server.py"),
+        "--port", str(args.fake_port), "--latency", str(args.latency),
+        "--tokens-per-second", str(args.tokens_per_second), "--error-rate", str(args.error_rate)
+    ])
+    wait_until_up(f"{fake_url}/stats", fake)
+
+    env = dict(
+        os.environ,
+        GROQ_BASE_URL=fake_url,
+        groq_api_key="fake",
+        api_key="fake",
+        gemini_api_endpoint=fake_url,
+        llm_providers="groq:fake-model",
+        llm_cache_db=os.path.join(workdir, "llm_cache.sqlite3"),
+        job_db=os.path.join(workdir, "jobs.sqlite3"),
+        image_hash_db=os.path.join(workdir, "image_descriptions.sqlite3"),
+        log_level=os.environ.get("log_level", "WARNING")
+    )
+    backend = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app:app", "--port", str(args.port), "--log-level", "warning"],
+        cwd=BACKEND_DIR, env=env
+    )
+    try:
+        wait_until_up(f"http://127.0.0.1:{args.port}/metrics", backend)
+    except RuntimeError:
+        fake.terminate()
+        raise
+    return [fake, backend]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--spawn", action="store_true", help="start the fake LLM server and a backend to test")
+    parser.add_argument("--port", type=int, default=8765, help="backend port with --spawn")
+    parser.add_argument("--fake-port", type=int, default=9100)
+    parser.add_argument("--endpoints", default="generate-code,modify-code,analyze-image,code-review,ai-tutor")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=20, help="seconds")
+    parser.add_argument("--timeout", type=float, default=120, help="per-request timeout in seconds")
+    parser.add_argument("--cache", action="store_true", help="let requests use the backend's caches")
+    parser.add_argument("--latency", type=float, default=0.5, help="fake LLM time to first token (--spawn)")
+    parser.add_argument("--tokens-per-second", type=float, default=200, help="fake LLM token rate (--spawn)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fake LLM failure rate (--spawn)")
+    parser.add_argument("--json", help="also write the report to this file")
+    parser.add_argument("--max-loop-lag-ms", type=float, help="fail if p99 event-loop lag exceeds this")
+    parser.add_argument("--max-p95-ms", type=float, help="fail if overall p95 latency exceeds this")
+    parser.add_argument("--min-rps", type=float, help="fail if overall throughput is below this")
+    args = parser.parse_args()
+
+    processes = []
+    with tempfile.TemporaryDirectory() as workdir:
+        try:
+            if args.spawn:
+                processes = spawn(args, workdir)
+                args.url = f"http://127.0.0.1:{args.port}"
+            report = asyncio.run(run_load(
+                args.url, args.endpoints.split(","), args.concurrency, args.duration, args.cache, args.timeout
+            ))
+        finally:
+            for process in reversed(processes):
+                process.terminate()
+                process.wait()
+
+    print_report(report)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+    failures = []
+    if args.max_loop_lag_ms is not None and report["event_loop_lag"]["p99_ms"] > args.max_loop_lag_ms:
+        failures.append(f"event loop lag p99 {report['event_loop_lag']['p99_ms']:g} ms > {args.max_loop_lag_ms:g} ms")
+    if args.max_p95_ms is not None and report["total"]["p95_ms"] > args.max_p95_ms:
+        failures.append(f"p95 latency {report['total']['p95_ms']} ms > {args.max_p95_ms:g} ms")
+    if args.min_rps is not None and report["total"]["rps"] < args.min_rps:
+        failures.append(f"throughput {report['total']['rps']} rps < {args.min_rps:g} rps")
+    if failures:
+        print("\nFAILED: " + "; ".join(failures))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
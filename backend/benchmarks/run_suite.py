@@ -0,0 +1,53 @@
+"""Run the microbenchmarks and then a load test against a spawned backend and fake LLM.
+
+Run from the backend directory:
+
+    python benchmarks/run_suite.py [--quick] [-- load_test.py options, e.g. --max-loop-lag-ms 50]
+
+--quick uses small inputs and a short load test, for a fast regression check.
+Exits non-zero if any benchmark fails (including load_test.py thresholds).
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+MICROBENCHMARKS = [
+    # (script, full arguments, --quick arguments)
+    ("bench_css_parser.py", [], ["--sizes", "10K,100K", "--repeat", "2"]),
+    ("bench_code_blocks.py", [], ["--sizes", "10K,100K", "--repeat", "2"]),
+    ("bench_clean_text.py", [], ["--sizes", "100K", "--repeat", "5"]),
+]
+
+
+def run(script: str, arguments: list) -> bool:
+    print(f"\n== {script} {' '.join(arguments)}".rstrip(), flush=True)
+    return subprocess.run([sys.executable, os.path.join(BENCHMARKS_DIR, script), *arguments]).returncode == 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--quick", action="store_true")
+    parser.add_argument("--skip-load", action="store_true", help="only run the microbenchmarks")
+    parser.add_argument("load_test_args", nargs="*", help="passed through to load_test.py (after --)")
+    args = parser.parse_args()
+
+    failed = []
+    for script, full, quick in MICROBENCHMARKS:
+        if not run(script, quick if args.quick else full):
+            failed.append(script)
+
+    if not args.skip_load:
+        load_args = ["--spawn", *(["--duration", "5", "--concurrency", "8"] if args.quick else []), *args.load_test_args]
+        if not run("load_test.py", load_args):
+            failed.append("load_test.py")
+
+    if failed:
+        print(f"\nFailed: {', '.join(failed)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,461 @@
+import asyncio
+import hashlib
+import json
+import logging
+import random
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+def cache_key(*parts) -> str:
+    """Hash the parts that determine a completion into a stable cache key."""
+    payload = json.dumps(parts, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """Two-tier response cache: in-process LRU with TTL, optional SQLite on disk.
+
+    The memory tier evicts least recently used entries once the stored text
+    exceeds max_bytes. The disk tier survives restarts and is only touched
+    from worker threads so it never blocks the event loop.
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, ttl: float = 3600, db_path: str = None):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.db_path = db_path
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.db = None
+        self.db_lock = threading.Lock()
+        if db_path:
+            self.db = sqlite3.connect(db_path, check_same_thread=False)
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS responses "
+                "(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self.db.commit()
+
+    def _memory_get(self, key: str):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.time():
+            self._memory_delete(key)
+            return None
+        self.entries.move_to_end(key)
+        return value
+
+    def _memory_set(self, key: str, value: str, expires_at: float):
+        self._memory_delete(key)
+        self.entries[key] = (expires_at, value)
+        self.size += len(value)
+        while self.size > self.max_bytes and self.entries:
+            oldest = next(iter(self.entries))
+            self._memory_delete(oldest)
+            self.evictions += 1
+
+    def _memory_delete(self, key: str):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.size -= len(entry[1])
+
+    def _disk_get(self, key: str):
+        with self.db_lock:
+            row = self.db.execute(
+                "SELECT value, expires_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if row[1] < time.time():
+                self.db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self.db.commit()
+                return None
+            return row
+
+    def _disk_set(self, key: str, value: str, expires_at: float):
+        with self.db_lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO responses (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, value, expires_at)
+            )
+            self.db.execute("DELETE FROM responses WHERE expires_at < ?", (time.time(),))
+            self.db.commit()
+
+    async def get(self, key: str):
+        """Return the cached value for key, or None on a miss."""
+        value = self._memory_get(key)
+        if value is None and self.db is not None:
+            try:
+                row = await asyncio.to_thread(self._disk_get, key)
+            except sqlite3.Error as e:
+                logging.error(f"Response cache read error: {str(e)}")
+                row = None
+            if row is not None:
+                value = row[0]
+                self._memory_set(key, value, row[1])
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    async def set(self, key: str, value: str):
+        """Store value under key in both tiers."""
+        expires_at = time.time() + self.ttl
+        self._memory_set(key, value, expires_at)
+        if self.db is not None:
+            try:
+                await asyncio.to_thread(self._disk_set, key, value, expires_at)
+            except sqlite3.Error as e:
+                logging.error(f"Response cache write error: {str(e)}")
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self.entries),
+            "bytes": self.size,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "persistent": self.db is not None
+        }
+
+
+class PerceptualHashIndex:
+    """Vision descriptions keyed by 256-bit perceptual image hashes.
+
+    A lookup returns the description of the closest stored hash within
+    threshold differing bits among images of the same aspect ratio (within
+    aspect_tolerance), so re-saved, recompressed or rescaled screenshots
+    reuse an earlier analysis. Entries are kept in memory, least recently
+    used evicted past max_entries, and mirrored to SQLite so the index
+    survives restarts.
+    """
+
+    def __init__(self, max_entries: int = 5000, threshold: int = 10, db_path: str = None,
+                 aspect_tolerance: float = 0.02):
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.aspect_tolerance = aspect_tolerance
+        self.entries = OrderedDict()  # (hash, aspect ratio) -> description
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.db = None
+        self.db_lock = threading.Lock()
+        if db_path:
+            self.db = sqlite3.connect(db_path, check_same_thread=False)
+            columns = [row[1] for row in self.db.execute("PRAGMA table_info(image_descriptions)")]
+            if columns and "aspect" not in columns:
+                # 64-bit hashes from before aspect ratios were stored can't be compared
+                self.db.execute("DROP TABLE image_descriptions")
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS image_descriptions "
+                "(hash TEXT NOT NULL, aspect REAL NOT NULL, description TEXT NOT NULL, used_at REAL NOT NULL, "
+                "PRIMARY KEY (hash, aspect))"
+            )
+            self.db.commit()
+            rows = self.db.execute(
+                "SELECT hash, aspect, description FROM image_descriptions ORDER BY used_at DESC LIMIT ?",
+                (max_entries,)
+            ).fetchall()
+            for image_hash, aspect, description in reversed(rows):
+                self.entries[(int(image_hash, 16), aspect)] = description
+
+    @staticmethod
+    def aspect(width: int, height: int) -> float:
+        return round(width / height, 4) if height else 0.0
+
+    def _nearest(self, image_hash: int, aspect: float):
+        best = None
+        best_distance = self.threshold + 1
+        for key in self.entries:
+            candidate, candidate_aspect = key
+            if abs(candidate_aspect - aspect) > self.aspect_tolerance * max(aspect, candidate_aspect):
+                continue
+            distance = (candidate ^ image_hash).bit_count()
+            if distance < best_distance:
+                best, best_distance = key, distance
+                if distance == 0:
+                    break
+        return best
+
+    def _disk_touch(self, key: tuple):
+        with self.db_lock:
+            self.db.execute(
+                "UPDATE image_descriptions SET used_at = ? WHERE hash = ? AND aspect = ?",
+                (time.time(), f"{key[0]:064x}", key[1])
+            )
+            self.db.commit()
+
+    def _disk_set(self, key: tuple, description: str):
+        with self.db_lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO image_descriptions (hash, aspect, description, used_at) VALUES (?, ?, ?, ?)",
+                (f"{key[0]:064x}", key[1], description, time.time())
+            )
+            self.db.execute(
+                "DELETE FROM image_descriptions WHERE rowid NOT IN "
+                "(SELECT rowid FROM image_descriptions ORDER BY used_at DESC LIMIT ?)",
+                (self.max_entries,)
+            )
+            self.db.commit()
+
+    async def get(self, image_hash: int, width: int, height: int):
+        """Return the description stored for the nearest similar image of the same shape, or None."""
+        match = self._nearest(image_hash, self.aspect(width, height))
+        if match is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(match)
+        if self.db is not None:
+            try:
+                await asyncio.to_thread(self._disk_touch, match)
+            except sqlite3.Error as e:
+                logging.error(f"Image hash index write error: {str(e)}")
+        return self.entries[match]
+
+    async def set(self, image_hash: int, width: int, height: int, description: str):
+        """Store the description for an image hash and its dimensions."""
+        key = (image_hash, self.aspect(width, height))
+        self.entries.pop(key, None)
+        self.entries[key] = description
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+        if self.db is not None:
+            try:
+                await asyncio.to_thread(self._disk_set, key, description)
+            except sqlite3.Error as e:
+                logging.error(f"Image hash index write error: {str(e)}")
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self.entries),
+            "max_entries": self.max_entries,
+            "threshold": self.threshold,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "persistent": self.db is not None
+        }
+
+# Words that phrase a question rather than say what it is about
+QUESTION_STOPWORDS = frozenset("""
+a about an and are can could describe do does explain give i in is it me my of on or please show
+should tell that the this to what whats with would you your
+""".split())
+# Words that change what is being asked ("why use grid" is not "when to use grid"): kept, and must match
+QUESTION_INTERROGATIVES = frozenset(("how", "when", "where", "which", "who", "why"))
+QUESTION_WORD_RE = re.compile(r"[a-z0-9][a-z0-9+#.-]*")
+
+MINHASH_PERMUTATIONS = 64
+MINHASH_BANDS = 16  # 4 rows each: pairs at Jaccard 0.5 share a band about 65% of the time, at 0.8 over 99%
+_MERSENNE_PRIME = (1 << 61) - 1
+_seeds = random.Random(20240611)
+_PERMUTATIONS = [
+    (_seeds.randrange(1, _MERSENNE_PRIME), _seeds.randrange(0, _MERSENNE_PRIME))
+    for _ in range(MINHASH_PERMUTATIONS)
+]
+
+
+def question_words(question: str) -> frozenset:
+    """The content words of a question, lowercased, with plurals folded."""
+    words = set()
+    for word in QUESTION_WORD_RE.findall(question.lower().replace("\u2019", "'").replace("'s", "")):
+        word = word.rstrip(".-")
+        if not word or word in QUESTION_STOPWORDS:
+            continue
+        if word.isalpha():  # not node.js, h1 or c++
+            if len(word) > 4 and word.endswith("ies"):
+                word = word[:-3] + "y"
+            elif len(word) > 4 and word.endswith("sses"):
+                word = word[:-2]
+            elif len(word) > 3 and word.endswith("s") and not word.endswith(("ss", "us", "is")):
+                word = word[:-1]
+        words.add(word)
+    return frozenset(words)
+
+
+def minhash(words: frozenset) -> tuple:
+    """MinHash signature of a word set; matching positions estimate Jaccard similarity."""
+    hashes = [int.from_bytes(hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest(), "big")
+              for word in words]
+    return tuple(min((a * h + b) % _MERSENNE_PRIME for h in hashes) for a, b in _PERMUTATIONS)
+
+
+class QuestionIndex:
+    """Answers to past questions, matched by content words so rephrasings reuse them.
+
+    Questions are reduced to their content words, dropping filler like
+    "what is" or "explain" and folding plurals. A lookup returns the answer
+    stored in the same context whose word set has the highest Jaccard
+    similarity, if it reaches threshold and both ask the same kind of
+    question (the same why/how/when words). MinHash signatures banded into an
+    LSH table pick the candidates, so a lookup compares against the few
+    entries sharing a band rather than all of them. Entries are kept in
+    memory, least recently used evicted past max_entries, and mirrored to
+    SQLite so the index survives restarts. Rows stored under another version
+    (the prompt template they were answered with) are dropped on load.
+    """
+
+    def __init__(self, max_entries: int = 5000, threshold: float = 0.8, db_path: str = None, version: str = ""):
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.version = version
+        self.entries = OrderedDict()  # key -> entry, least recently used first
+        self.buckets = {}  # (context, band, band signature) -> keys
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.db = None
+        self.db_lock = threading.Lock()
+        if db_path:
+            self.db = sqlite3.connect(db_path, check_same_thread=False)
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS tutor_answers ("
+                "key TEXT PRIMARY KEY, version TEXT NOT NULL, context TEXT NOT NULL, question TEXT NOT NULL, "
+                "answer TEXT NOT NULL, reasoning TEXT NOT NULL, created_at REAL NOT NULL, used_at REAL NOT NULL)"
+            )
+            self.db.execute("DELETE FROM tutor_answers WHERE version != ?", (version,))
+            self.db.commit()
+            rows = self.db.execute(
+                "SELECT context, question, answer, reasoning, created_at FROM tutor_answers "
+                "ORDER BY used_at DESC LIMIT ?",
+                (max_entries,)
+            ).fetchall()
+            for context, question, answer, reasoning, created_at in reversed(rows):
+                self._add(context, question, answer, reasoning, created_at)
+
+    def _bands(self, context: str, signature: tuple) -> list:
+        rows = MINHASH_PERMUTATIONS // MINHASH_BANDS
+        return [(context, band, signature[band * rows:(band + 1) * rows]) for band in range(MINHASH_BANDS)]
+
+    def _add(self, context: str, question: str, answer: str, reasoning: str, created_at: float):
+        words = question_words(question)
+        if not words:
+            return None
+        key = cache_key(context, sorted(words))
+        self._remove(key)
+        entry = {
+            "context": context,
+            "question": question,
+            "words": words,
+            "signature": minhash(words),
+            "answer": answer,
+            "reasoning": reasoning,
+            "created_at": created_at
+        }
+        self.entries[key] = entry
+        for band in self._bands(context, entry["signature"]):
+            self.buckets.setdefault(band, set()).add(key)
+        while len(self.entries) > self.max_entries:
+            self._remove(next(iter(self.entries)))
+            self.evictions += 1
+        return key
+
+    def _remove(self, key: str):
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return
+        for band in self._bands(entry["context"], entry["signature"]):
+            keys = self.buckets.get(band)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.buckets[band]
+
+    def _nearest(self, context: str, words: frozenset):
+        candidates = set()
+        for band in self._bands(context, minhash(words)):
+            candidates.update(self.buckets.get(band, ()))
+        best = None
+        best_similarity = self.threshold
+        interrogatives = words & QUESTION_INTERROGATIVES
+        for key in candidates:
+            stored = self.entries[key]["words"]
+            if stored & QUESTION_INTERROGATIVES != interrogatives:
+                continue
+            similarity = len(words & stored) / len(words | stored)
+            if similarity >= best_similarity:
+                best, best_similarity = key, similarity
+        return best, best_similarity
+
+    def _disk_touch(self, key: str):
+        with self.db_lock:
+            self.db.execute("UPDATE tutor_answers SET used_at = ? WHERE key = ?", (time.time(), key))
+            self.db.commit()
+
+    def _disk_set(self, key: str, entry: dict):
+        with self.db_lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO tutor_answers "
+                "(key, version, context, question, answer, reasoning, created_at, used_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, self.version, entry["context"], entry["question"], entry["answer"], entry["reasoning"],
+                 entry["created_at"], time.time())
+            )
+            self.db.execute(
+                "DELETE FROM tutor_answers WHERE key NOT IN "
+                "(SELECT key FROM tutor_answers ORDER BY used_at DESC LIMIT ?)",
+                (self.max_entries,)
+            )
+            self.db.commit()
+
+    async def get(self, context: str, question: str):
+        """Return the best stored match for question in context, or None.
+
+        A match is {"question", "answer", "reasoning", "similarity", "answered_at"},
+        where question is the stored question that was matched.
+        """
+        words = question_words(question)
+        key, similarity = self._nearest(context, words) if words else (None, 0.0)
+        if key is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        if self.db is not None:
+            try:
+                await asyncio.to_thread(self._disk_touch, key)
+            except sqlite3.Error as e:
+                logging.error(f"Question index write error: {str(e)}")
+        entry = self.entries[key]
+        return {
+            "question": entry["question"],
+            "answer": entry["answer"],
+            "reasoning": entry["reasoning"],
+            "similarity": round(similarity, 3),
+            "answered_at": entry["created_at"]
+        }
+
+    async def set(self, context: str, question: str, answer: str, reasoning: str = ""):
+        """Store the answer to a question; questions without content words are skipped."""
+        key = self._add(context, question, answer, reasoning or "", time.time())
+        if key is not None and self.db is not None:
+            try:
+                await asyncio.to_thread(self._disk_set, key, self.entries[key])
+            except sqlite3.Error as e:
+                logging.error(f"Question index write error: {str(e)}")
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self.entries),
+            "max_entries": self.max_entries,
+            "threshold": self.threshold,
+            "buckets": len(self.buckets),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "persistent": self.db is not None
+        }
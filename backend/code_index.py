@@ -0,0 +1,464 @@
+import re
+from html.parser import HTMLParser
+
+from css_parser import top_level_blocks
+from tokens import estimate_tokens
+
+VOID_ELEMENTS = {
+    'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input',
+    'link', 'meta', 'source', 'track', 'wbr'
+}
+
+STOPWORDS = {
+    'the', 'and', 'for', 'with', 'that', 'this', 'make', 'add', 'change',
+    'please', 'can', 'you', 'into', 'from', 'all', 'should', 'more', 'less',
+    'some', 'them', 'its', 'use', 'using', 'want', 'would', 'like', 'new'
+}
+
+JS_NAME_PATTERNS = [
+    re.compile(r'^(?:export\s+)?(?:async\s+)?function\s*\*?\s*([A-Za-z_$][\w$]*)'),
+    re.compile(r'^(?:export\s+)?class\s+([A-Za-z_$][\w$]*)'),
+    re.compile(r'^(?:export\s+)?(?:const|let|var)\s+([A-Za-z_$][\w$]*)'),
+    re.compile(r'^([A-Za-z_$][\w$.]*)\s*\('),
+]
+
+# Listener statements on an element (getElementById('x') or querySelector('#x'))
+# or on window/document; named '#x:click' or 'window:load' so each is unique
+JS_LISTENER = re.compile(
+    r'^(?:document\.(?:getElementById\(\s*[\'"]([\w-]+)|querySelector\(\s*[\'"]#([\w-]+))[\'"]\s*\)'
+    r'|(window|document))\s*\??\.\s*'
+    r'(?:addEventListener\(\s*[\'"]([\w:-]+)[\'"]|on(\w+)\s*=(?!=))'
+)
+
+WORD = re.compile(r'[A-Za-z][A-Za-z0-9]*')
+CAMEL_PARTS = re.compile(r'[A-Z]?[a-z0-9]+|[A-Z]+(?![a-z])')
+
+
+def terms(text: str) -> set:
+    """Lowercased words of text, with camelCase and kebab-case names split into parts."""
+    words = set()
+    for word in WORD.findall(text):
+        lowered = word.lower()
+        words.add(lowered)
+        for part in CAMEL_PARTS.findall(word):
+            words.add(part.lower())
+    return {word for word in words if len(word) > 2 and word not in STOPWORDS}
+
+
+def css_fragments(css_text: str) -> list:
+    """One fragment per top-level CSS rule or at-rule block."""
+    fragments = []
+    for selector, _, _, block_start, block_end in top_level_blocks(css_text):
+        text = css_text[block_start:block_end].strip()
+        fragments.append({
+            "language": "css",
+            "name": selector,
+            "text": text,
+            "start": block_start,
+            "end": block_end,
+            "identifiers": terms(selector),
+            "references": set(re.findall(r'[.#]([A-Za-z_][\w-]*)', selector))
+        })
+    return fragments
+
+
+def js_statements(js_text: str) -> list:
+    """Split JavaScript into top-level statements as (start, end) spans.
+
+    Tracks brace depth while skipping strings, template literals and
+    comments; a statement ends at a newline once depth is back to zero and
+    the statement ends with ';' or '}'.
+    """
+    spans = []
+    depth = 0
+    start = 0
+    i = 0
+    length = len(js_text)
+    quote = None
+
+    while i < length:
+        char = js_text[i]
+        if quote:
+            if char == '\\':
+                i += 1
+            elif char == quote:
+                quote = None
+        elif char in '"\'`':
+            quote = char
+        elif js_text.startswith('//', i):
+            newline = js_text.find('\n', i)
+            i = length if newline == -1 else newline
+            continue
+        elif js_text.startswith('/*', i):
+            close = js_text.find('*/', i + 2)
+            i = length if close == -1 else close + 2
+            continue
+        elif char in '{([':
+            depth += 1
+        elif char in '})]':
+            depth = max(depth - 1, 0)
+        elif char == '\n' and depth == 0:
+            statement = js_text[start:i].strip()
+            if statement and statement[-1] in ';}':
+                spans.append((start, i))
+                start = i + 1
+        i += 1
+
+    if js_text[start:].strip():
+        spans.append((start, length))
+    return spans
+
+
+def _strip_leading_comments(statement: str) -> str:
+    return re.sub(r'^(?:\s*(?://[^\n]*|/\*.*?\*/))*\s*', '', statement, flags=re.DOTALL)
+
+
+def js_name(statement: str) -> str:
+    """Name of a top-level JavaScript statement (function, class, variable, listener or call target)."""
+    # Skip leading comments so a documented function still gets its name
+    body = _strip_leading_comments(statement)
+    listener = JS_LISTENER.match(body)
+    if listener:
+        element_id, selector_id, target, event, handler = listener.groups()
+        target = f"#{element_id or selector_id}" if target is None else target
+        return f"{target}:{event or handler}"
+    for pattern in JS_NAME_PATTERNS:
+        match = pattern.match(body)
+        if match:
+            return match.group(1)
+    return ''
+
+
+def js_key(statement: str) -> str:
+    """js_name of statement if it identifies the statement, else '' (plain calls share names)."""
+    body = _strip_leading_comments(statement)
+    if JS_NAME_PATTERNS[-1].match(body) and not JS_LISTENER.match(body):
+        return ''
+    return js_name(statement)
+
+
+def js_fragments(js_text: str) -> list:
+    """One fragment per top-level JavaScript statement."""
+    fragments = []
+    for start, end in js_statements(js_text):
+        text = js_text[start:end].strip()
+        name = js_name(text)
+        fragments.append({
+            "language": "javascript",
+            "name": name or text.split('\n', 1)[0][:60],
+            "text": text,
+            "start": start,
+            "end": end,
+            "identifiers": terms(name),
+            "references": set(re.findall(r'getElementById\(\s*[\'"]([\w-]+)', text))
+            | set(re.findall(r'querySelector(?:All)?\(\s*[\'"][.#]([\w-]+)', text))
+            | set(re.findall(r'classList\.\w+\(\s*[\'"]([\w-]+)', text))
+        })
+    return fragments
+
+
+class _HTMLSegmenter(HTMLParser):
+    """Record the span, depth and attributes of every element in an HTML snippet."""
+
+    def __init__(self, text: str):
+        super().__init__(convert_charrefs=True)
+        self.text = text
+        self.line_offsets = [0]
+        for match in re.finditer('\n', text):
+            self.line_offsets.append(match.end())
+        self.stack = []
+        self.elements = []
+
+    def _offset(self) -> int:
+        line, column = self.getpos()
+        return self.line_offsets[line - 1] + column
+
+    def _record(self, depth, tag, start, end, attrs):
+        attrs = dict(attrs)
+        self.elements.append({
+            "depth": depth,
+            "tag": tag,
+            "start": start,
+            "end": end,
+            "id": attrs.get('id') or '',
+            "classes": (attrs.get('class') or '').split()
+        })
+
+    def handle_starttag(self, tag, attrs):
+        start = self._offset()
+        if tag in VOID_ELEMENTS:
+            self._record(len(self.stack), tag, start, start + len(self.get_starttag_text()), attrs)
+        else:
+            self.stack.append((tag, start, attrs))
+
+    def handle_startendtag(self, tag, attrs):
+        start = self._offset()
+        self._record(len(self.stack), tag, start, start + len(self.get_starttag_text()), attrs)
+
+    def handle_endtag(self, tag):
+        if not any(open_tag == tag for open_tag, _, _ in self.stack):
+            return
+        close = self.text.find('>', self._offset())
+        end = len(self.text) if close == -1 else close + 1
+        # Close any unclosed children (e.g. <li> without </li>) along with this element
+        while self.stack:
+            open_tag, start, attrs = self.stack.pop()
+            self._record(len(self.stack), open_tag, start, end, attrs)
+            if open_tag == tag:
+                break
+
+    def finish(self):
+        """Close elements left open at the end of the snippet."""
+        while self.stack:
+            open_tag, start, attrs = self.stack.pop()
+            self._record(len(self.stack), open_tag, start, len(self.text), attrs)
+
+
+def html_elements(html_text: str) -> list:
+    """All elements in html_text with their spans, ordered by start offset."""
+    segmenter = _HTMLSegmenter(html_text)
+    try:
+        segmenter.feed(html_text)
+        segmenter.close()
+    except Exception:
+        pass  # best effort on malformed markup
+    segmenter.finish()
+    return sorted(segmenter.elements, key=lambda element: element["start"])
+
+
+def html_fragments(html_text: str) -> list:
+    """One fragment per section of the page.
+
+    Descends through single wrapper elements (html, body, a lone container
+    div) so a page is split into its meaningful sections.
+    """
+    elements = html_elements(html_text)
+    depth = 0
+    start, end = 0, len(html_text)
+    while True:
+        level = [
+            element for element in elements
+            if element["depth"] == depth and start <= element["start"] and element["end"] <= end
+            and element["tag"] != 'head'
+        ]
+        if len(level) != 1:
+            break
+        wrapper = level[0]
+        if not any(
+            element["depth"] == depth + 1
+            and wrapper["start"] <= element["start"] and element["end"] <= wrapper["end"]
+            for element in elements
+        ):
+            break
+        start, end = wrapper["start"], wrapper["end"]
+        depth += 1
+
+    level_ids = {id(element) for element in level}
+    fragments = []
+    for position, element in enumerate(elements):
+        if id(element) not in level_ids:
+            continue
+        text = html_text[element["start"]:element["end"]]
+        # Elements are sorted by start, so descendants follow their ancestor
+        inner = []
+        for other in elements[position:]:
+            if other["start"] >= element["end"]:
+                break
+            inner.append(other)
+        ids = {other["id"] for other in inner if other["id"]}
+        classes = {name for other in inner for name in other["classes"]}
+        label = element["tag"]
+        if element["id"]:
+            label += f"#{element['id']}"
+        if element["classes"]:
+            label += "." + ".".join(element["classes"])
+        fragments.append({
+            "language": "html",
+            "name": label,
+            "text": text,
+            "start": element["start"],
+            "end": element["end"],
+            "id": element["id"],
+            "tag": element["tag"],
+            "classes": element["classes"],
+            "identifiers": terms(" ".join([element["tag"], *ids, *classes])),
+            "references": ids | classes
+        })
+    return fragments
+
+
+def build_index(existing_code: dict) -> list:
+    """Index html sections, CSS rules and JavaScript statements of a project."""
+    return (
+        html_fragments(existing_code.get('html', '') or '')
+        + css_fragments(existing_code.get('css', '') or '')
+        + js_fragments(existing_code.get('javascript', '') or '')
+    )
+
+
+def rank_fragments(fragments: list, prompt: str) -> list:
+    """Score fragments against the prompt, most relevant first.
+
+    Identifier matches (selectors, function names, ids and classes) weigh
+    more than matches in the body. Fragments that reference the ids or
+    classes of a matching fragment get a smaller boost, so the CSS and JS
+    for a relevant section come along with it.
+    """
+    prompt_terms = terms(prompt)
+    scores = []
+    for fragment in fragments:
+        text_terms = terms(fragment["text"])
+        score = 0
+        for term in prompt_terms:
+            if term in fragment["identifiers"]:
+                score += 3
+            elif term in text_terms:
+                score += 1
+        scores.append(score)
+
+    related = set()
+    for fragment, score in zip(fragments, scores):
+        if score > 0:
+            related |= fragment["references"]
+    for index, fragment in enumerate(fragments):
+        if scores[index] == 0 and fragment["references"] & related:
+            scores[index] = 1
+
+    order = sorted(range(len(fragments)), key=lambda index: -scores[index])
+    return [(fragments[index], scores[index]) for index in order]
+
+
+def select_fragments(fragments: list, prompt: str, token_budget: int) -> list:
+    """The fragments most relevant to prompt that fit in token_budget, most relevant first."""
+    selected = []
+    used = 0
+    for fragment, score in rank_fragments(fragments, prompt):
+        if score == 0:
+            break
+        cost = estimate_tokens(fragment["text"])
+        if used + cost > token_budget:
+            continue
+        selected.append(fragment)
+        used += cost
+    return selected
+
+
+def select_context(existing_code: dict, prompt: str, token_budget: int, index: list = None):
+    """Pick the fragments most relevant to prompt that fit in token_budget.
+
+    Returns (selected, outline): selected maps language to the chosen
+    fragment texts in source order, outline maps language to the names of
+    everything left out. index is a prebuilt build_index(existing_code).
+    """
+    fragments = index if index is not None else build_index(existing_code)
+    selected = select_fragments(fragments, prompt, token_budget)
+
+    chosen = {id(fragment) for fragment in selected}
+    context = {'html': [], 'css': [], 'javascript': []}
+    outline = {'html': [], 'css': [], 'javascript': []}
+    for fragment in fragments:
+        if id(fragment) in chosen:
+            context[fragment["language"]].append(fragment["text"])
+        else:
+            outline[fragment["language"]].append(fragment["name"])
+    return context, outline
+
+
+def merge_js_fragments(existing_js: str, returned_js: str) -> str:
+    """Replace declarations and listeners by name and append new statements."""
+    existing = {}
+    for start, end in js_statements(existing_js):
+        name = js_key(existing_js[start:end].strip())
+        if name:
+            existing[name] = (start, end)
+
+    seen = {' '.join(existing_js[start:end].split()) for start, end in js_statements(existing_js)}
+    replacements = {}
+    appended = []
+    for start, end in js_statements(returned_js):
+        text = returned_js[start:end].strip()
+        name = js_key(text)
+        if name and name in existing:
+            replacements[existing[name]] = text
+        elif ' '.join(text.split()) not in seen:
+            appended.append(text)
+
+    merged = existing_js
+    for (start, end), text in sorted(replacements.items(), reverse=True):
+        original = merged[start:end]
+        indent = original[:len(original) - len(original.lstrip())]
+        merged = merged[:start] + indent + text + merged[end:]
+    if appended:
+        merged = merged.rstrip() + "\n\n" + "\n\n".join(appended)
+    return merged
+
+
+def merge_html_fragments(existing_html: str, returned_html: str, sent: list = None) -> str:
+    """Replace elements by id (or unique tag and classes) and append new ones.
+
+    Returned elements matched by neither are paired by tag and position
+    with the html fragments that were sent to the model: the first
+    unmatched <header> replaces the first sent <header> and so on. Without
+    sent, only sections whose tag is unique in existing_html are paired.
+    Elements left over after that are appended.
+    """
+    existing = html_elements(existing_html)
+    if sent is None:
+        sections = html_fragments(existing_html)
+        tags = [fragment["tag"] for fragment in sections]
+        sent = [fragment for fragment in sections if tags.count(fragment["tag"]) == 1]
+    replacements = {}
+    unmatched = []
+    for fragment in html_elements(returned_html):
+        if fragment["depth"] != 0:
+            continue
+        text = returned_html[fragment["start"]:fragment["end"]]
+        match = None
+        if fragment["id"]:
+            match = next((element for element in existing if element["id"] == fragment["id"]), None)
+        if match is None and fragment["classes"]:
+            candidates = [
+                element for element in existing
+                if element["tag"] == fragment["tag"] and element["classes"] == fragment["classes"]
+            ]
+            if len(candidates) == 1:
+                match = candidates[0]
+        if match is not None:
+            replacements[(match["start"], match["end"])] = text
+        else:
+            unmatched.append((fragment["tag"], text))
+
+    # Sent fragments not already covered by a match, in source order, per tag
+    by_tag = {}
+    for fragment in sorted(sent, key=lambda fragment: fragment["start"]):
+        if not any(start < fragment["end"] and fragment["start"] < end for start, end in replacements):
+            by_tag.setdefault(fragment["tag"], []).append(fragment)
+    appended = []
+    for tag, text in unmatched:
+        candidates = by_tag.get(tag)
+        if candidates:
+            fragment = candidates.pop(0)
+            replacements[(fragment["start"], fragment["end"])] = text
+        else:
+            appended.append(text)
+
+    # Drop replacements nested inside another replaced element
+    spans = sorted(replacements, key=lambda span: (span[0], -span[1]))
+    outer = []
+    for span in spans:
+        if outer and span[1] <= outer[-1][1]:
+            continue
+        outer.append(span)
+
+    merged = existing_html
+    for start, end in reversed(outer):
+        merged = merged[:start] + replacements[(start, end)] + merged[end:]
+    if appended:
+        # Insert new sections before </body> when the snippet is a full page
+        close_body = merged.lower().rfind('</body>')
+        addition = "\n" + "\n".join(appended) + "\n"
+        if close_body != -1:
+            merged = merged[:close_body] + addition + merged[close_body:]
+        else:
+            merged = merged.rstrip() + addition
+    return merged
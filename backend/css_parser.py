@@ -0,0 +1,204 @@
+import re
+
+COMMENT = re.compile(r'/\*.*?\*/', re.DOTALL)
+# Block delimiters, plus the starts of comments and strings so braces inside them are skipped
+TOKEN = re.compile(r'[{}"\']|/\*')
+STRING_END = {
+    '"': re.compile(r'(?:\\.|[^"\\])*"', re.DOTALL),
+    "'": re.compile(r"(?:\\.|[^'\\])*'", re.DOTALL),
+}
+
+
+class CSSNode:
+    """A rule (`.a { ... }`) or at-rule (`@media ... { ... }`, `@import ...;`).
+
+    Offsets index into the parsed source: start..end covers the whole node,
+    body_start..body_end the text between its braces (equal for at-rule
+    statements without a block).
+    """
+
+    __slots__ = ('prelude', 'declarations', 'children', 'has_block', 'start', 'body_start', 'body_end', 'end')
+
+    def __init__(self, prelude: str, start: int, body_start: int, has_block: bool = True):
+        self.prelude = prelude
+        self.has_block = has_block
+        self.declarations = []
+        self.children = []
+        self.start = start
+        self.body_start = body_start
+        self.body_end = body_start
+        self.end = body_start
+
+    def __repr__(self):
+        return f"CSSNode({self.prelude!r}, {len(self.declarations)} declarations, {len(self.children)} children)"
+
+
+def _clean_prelude(text: str) -> str:
+    if '/*' in text:
+        text = COMMENT.sub('', text)
+    return ' '.join(text.split())
+
+
+def _split_outside_strings(text: str, separator: str) -> list:
+    """str.split that rejoins pieces whose separator sat inside a quoted string."""
+    parts = []
+    pending = None
+    for part in text.split(separator):
+        if pending is not None:
+            part = pending + separator + part
+        if (part.count('"') - part.count('\\"')) % 2 or (part.count("'") - part.count("\\'")) % 2:
+            pending = part
+        else:
+            parts.append(part)
+            pending = None
+    if pending is not None:
+        parts.append(pending)
+    return parts
+
+
+def _declarations(text: str) -> list:
+    """Split a block body into (property, value) pairs."""
+    if '/*' in text:
+        text = COMMENT.sub('', text)
+    parts = _split_outside_strings(text, ';') if ('"' in text or "'" in text) else text.split(';')
+    declarations = []
+    for part in parts:
+        colon = part.find(':')
+        if colon == -1:
+            continue
+        key = part[:colon].strip()
+        if not key:
+            continue
+        value = part[colon + 1:].strip()
+        if '\n' in value or '  ' in value:
+            value = ' '.join(value.split())
+        declarations.append((key, value))
+    return declarations
+
+
+def _statements(css_text: str, start: int, end: int, nodes: list) -> int:
+    """Emit statement at-rules (@import, @charset) found in css_text[start:end].
+
+    Returns the offset where the text after the last statement begins.
+    """
+    text = css_text[start:end]
+    if ';' not in text:
+        return start
+    position = start
+    pieces = _split_outside_strings(text, ';')
+    for piece in pieces[:-1]:
+        prelude = _clean_prelude(piece)
+        if prelude.startswith('@'):
+            offset = len(piece) - len(piece.lstrip())
+            node = CSSNode(prelude, position + offset, position + len(piece), has_block=False)
+            node.end = position + len(piece) + 1
+            nodes.append(node)
+        position += len(piece) + 1
+    return position
+
+
+def parse_stylesheet(css_text: str) -> list:
+    """Parse CSS into a tree of CSSNode in source order.
+
+    Single linear pass that jumps between braces with a precompiled regex:
+    comments and strings are skipped whole, and preludes and declaration
+    blocks are sliced out of the source by index instead of being built up
+    character by character. Nested blocks (@media, @supports, @keyframes,
+    CSS nesting) become children, and duplicate selectors are kept as
+    separate nodes.
+    """
+    root = []
+    stack = []  # open nodes, innermost last
+    segment_start = 0  # start of the text since the last brace
+    length = len(css_text)
+    search = TOKEN.search
+    i = 0
+
+    while True:
+        match = search(css_text, i)
+        if match is None:
+            break
+        i = match.start()
+        char = css_text[i]
+
+        if char == '{':
+            parent = stack[-1] if stack else None
+            if parent is None:
+                segment_start = _statements(css_text, segment_start, i, root)
+            else:
+                # Declarations before a nested block (CSS nesting)
+                last_semicolon = css_text.rfind(';', segment_start, i)
+                if last_semicolon != -1:
+                    parent.declarations.extend(_declarations(css_text[segment_start:last_semicolon]))
+                    segment_start = last_semicolon + 1
+            prelude_text = css_text[segment_start:i]
+            offset = len(prelude_text) - len(prelude_text.lstrip())
+            node = CSSNode(_clean_prelude(prelude_text), segment_start + offset, i + 1)
+            (parent.children if parent is not None else root).append(node)
+            stack.append(node)
+            segment_start = i + 1
+            i += 1
+        elif char == '}':
+            if stack:
+                node = stack.pop()
+                if segment_start < i:
+                    node.declarations.extend(_declarations(css_text[segment_start:i]))
+                node.body_end = i
+                node.end = i + 1
+            segment_start = i + 1
+            i += 1
+        elif char == '/':
+            close = css_text.find('*/', i + 2)
+            i = length if close == -1 else close + 2
+        else:
+            string_end = STRING_END[char].match(css_text, i + 1)
+            i = length if string_end is None else string_end.end()
+
+    if stack:
+        # Unterminated blocks run to the end of the source
+        stack[-1].declarations.extend(_declarations(css_text[segment_start:length]))
+        for node in stack:
+            node.body_end = length
+            node.end = length
+    else:
+        _statements(css_text, segment_start, length, root)
+
+    return root
+
+def top_level_blocks(css_text: str) -> list:
+    """Return (selector, body_start, body_end, block_start, block_end) for each top-level CSS block."""
+    return [
+        (node.prelude, node.body_start, node.body_end, node.start, node.end)
+        for node in parse_stylesheet(css_text)
+        if node.has_block
+    ]
+
+
+def merge_declarations(body: str, edit_body: str) -> str:
+    """Apply the declarations in edit_body to a declaration block's text.
+
+    The last declaration of each edited property gets the new value and
+    unknown properties are appended; everything else, including earlier
+    declarations of an edited property (vendor fallbacks such as
+    display: -webkit-box before display: flex), keeps its original text.
+    """
+    edits = dict(_declarations(edit_body))
+    pieces = _split_outside_strings(body, ';') if ('"' in body or "'" in body) else body.split(';')
+    last_piece = {}
+    for index, piece in enumerate(pieces):
+        for key, _ in _declarations(piece):
+            if key in edits:
+                last_piece[key] = index
+    for key, index in last_piece.items():
+        piece = pieces[index]
+        indent = piece[:len(piece) - len(piece.lstrip())]
+        pieces[index] = f"{indent}{key}: {edits[key]}"
+    merged = ';'.join(pieces)
+
+    added = [f"{key}: {value};" for key, value in edits.items() if key not in last_piece]
+    if not added:
+        return merged
+    content = merged.rstrip()
+    if content and not content.endswith(';'):
+        content += ';'
+    return content + ''.join(f"\n    {declaration}" for declaration in added) + "\n"
@@ -0,0 +1,220 @@
+import hashlib
+import zlib
+
+from starlette.datastructures import Headers, MutableHeaders
+
+try:
+    import brotli
+except ImportError:  # optional: without it responses are gzip-compressed only
+    brotli = None
+
+COMPRESSIBLE_TYPES = {
+    "application/json",
+    "application/x-ndjson",
+    "application/javascript",
+    "image/svg+xml"
+}
+
+ENCODING_SUFFIXES = ("-gzip", "-br")
+
+# Statuses that never carry a body (RFC 9110 6.4.1)
+BODYLESS_STATUSES = (204, 304)
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """Whether an If-None-Match header lists etag, in any content-coding variant."""
+    if if_none_match.strip() == "*":
+        return True
+    wanted = etag.strip('"')
+    for tag in if_none_match.split(","):
+        tag = tag.strip().removeprefix("W/").strip('"')
+        for suffix in ENCODING_SUFFIXES:
+            tag = tag.removesuffix(suffix)
+        if tag == wanted:
+            return True
+    return False
+
+
+def accepted_encoding(accept_encoding: str):
+    """Pick br or gzip from an Accept-Encoding header, or None."""
+    accepted = set()
+    for entry in accept_encoding.lower().split(","):
+        coding, _, params = entry.partition(";")
+        if params.replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            continue
+        accepted.add(coding.strip())
+    if brotli is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted:
+        return "gzip"
+    return None
+
+
+class ETagMiddleware:
+    """Give complete 200 responses a strong ETag and answer If-None-Match with 304.
+
+    The tag is a hash of the response body, so an unchanged result (a
+    repeated generation, an unchanged project version) costs the client
+    only headers. Responses with a Content-Length are buffered to hash them
+    (inner middleware may still deliver them in pieces); streamed responses
+    are passed through untouched.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        if_none_match = Headers(scope=scope).get("if-none-match")
+        start = None
+        chunks = []
+
+        async def send_with_etag(message):
+            nonlocal start
+            if message["type"] == "http.response.start":
+                headers = Headers(raw=message["headers"])
+                if message["status"] == 200 and "content-length" in headers and "etag" not in headers:
+                    start = message
+                    return
+                await send(message)
+                return
+            if message["type"] != "http.response.body" or start is None:
+                await send(message)
+                return
+
+            chunks.append(message.get("body", b""))
+            if message.get("more_body", False):
+                return
+            body = b"".join(chunks)
+            headers = MutableHeaders(raw=list(start["headers"]))
+            etag = f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+            headers["ETag"] = etag
+            if if_none_match and etag_matches(if_none_match, etag):
+                del headers["content-length"]
+                await send({"type": "http.response.start", "status": 304, "headers": headers.raw})
+                await send({"type": "http.response.body", "body": b""})
+                return
+            await send({**start, "headers": headers.raw})
+            await send({"type": "http.response.body", "body": body})
+
+        await self.app(scope, receive, send_with_etag)
+
+
+class _Compressor:
+    def __init__(self, encoding: str, gzip_level: int, brotli_quality: int):
+        self.encoding = encoding
+        if encoding == "br":
+            self.compressor = brotli.Compressor(quality=brotli_quality)
+        else:
+            # wbits=31 writes a gzip header and trailer
+            self.compressor = zlib.compressobj(gzip_level, zlib.DEFLATED, 31)
+
+    def chunk(self, data: bytes) -> bytes:
+        """Compress data and flush, so a streamed event reaches the client right away."""
+        if self.encoding == "br":
+            return self.compressor.process(data) + self.compressor.flush()
+        return self.compressor.compress(data) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self, data: bytes = b"") -> bytes:
+        if self.encoding == "br":
+            return self.compressor.process(data) + self.compressor.finish()
+        return self.compressor.compress(data) + self.compressor.flush()
+
+
+class CompressionMiddleware:
+    """Compress text and JSON responses with brotli (when installed) or gzip.
+
+    Responses with a Content-Length are compressed whole, unless they are
+    under minimum_size. Streamed responses (NDJSON events) are compressed
+    chunk by chunk with a flush after each, so events are not held back. An
+    ETag gets a -br/-gzip suffix, since it now names a different byte
+    sequence. Responses without a body (HEAD, 1xx, 204, 304) pass through
+    untouched.
+    """
+
+    def __init__(self, app, minimum_size: int = 500, gzip_level: int = 6, brotli_quality: int = 5):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = accepted_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None or scope["method"] == "HEAD":
+            await self.app(scope, receive, send)
+            return
+
+        start = None
+        compressor = None
+        chunks = []
+
+        def compressible(headers) -> bool:
+            content_type = headers.get("content-type", "").split(";")[0].strip()
+            return (
+                "content-encoding" not in headers
+                and (content_type.startswith("text/") or content_type in COMPRESSIBLE_TYPES)
+            )
+
+        def encoded_headers(headers):
+            headers["Content-Encoding"] = encoding
+            headers.add_vary_header("Accept-Encoding")
+            if "etag" in headers and not headers["etag"].startswith("W/"):
+                headers["ETag"] = headers["etag"][:-1] + f'-{encoding}"'
+            return headers
+
+        async def send_compressed(message):
+            nonlocal start, compressor
+            if message["type"] == "http.response.start":
+                if message["status"] < 200 or message["status"] in BODYLESS_STATUSES:
+                    await send(message)
+                    return
+                start = message
+                return
+            if message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            if start is not None:
+                headers = MutableHeaders(raw=list(start["headers"]))
+                if not compressible(headers):
+                    await send(start)
+                    start = None
+                    await send(message)
+                    return
+                if "content-length" in headers:
+                    # A complete body, possibly delivered in pieces: compress it whole
+                    chunks.append(message.get("body", b""))
+                    if message.get("more_body", False):
+                        return
+                    held, start = start, None
+                    body = b"".join(chunks)
+                    if len(body) >= self.minimum_size:
+                        body = _Compressor(encoding, self.gzip_level, self.brotli_quality).finish(body)
+                        encoded_headers(headers)
+                        headers["Content-Length"] = str(len(body))
+                    await send({**held, "headers": headers.raw})
+                    await send({"type": "http.response.body", "body": body})
+                    return
+                held, start = start, None
+                compressor = _Compressor(encoding, self.gzip_level, self.brotli_quality)
+                encoded_headers(headers)
+                await send({**held, "headers": headers.raw})
+                await send({"type": "http.response.body", "body": compressor.chunk(message.get("body", b"")),
+                            "more_body": message.get("more_body", False)})
+                return
+
+            if compressor is None:
+                await send(message)
+            elif message.get("more_body", False):
+                await send({"type": "http.response.body", "body": compressor.chunk(message.get("body", b"")),
+                            "more_body": True})
+            else:
+                await send({"type": "http.response.body", "body": compressor.finish(message.get("body", b""))})
+
+        await self.app(scope, receive, send_compressed)
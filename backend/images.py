@@ -0,0 +1,136 @@
+import io
+
+from PIL import Image
+from starlette.datastructures import Headers
+from starlette.exceptions import HTTPException
+from starlette.responses import JSONResponse
+
+# Formats Gemini accepts as-is; anything else is re-encoded
+PASSTHROUGH_FORMATS = {'PNG', 'JPEG', 'WEBP'}
+
+
+class ImageTooLarge(Exception):
+    """Raised when an upload exceeds the configured byte limit."""
+
+
+class UploadSizeLimit:
+    """Refuse request bodies over max_bytes on the given paths before they are spooled.
+
+    Starlette receives and spools a whole multipart body before the handler
+    runs, so the limit has to apply here. A Content-Length over the limit is
+    answered with 413 without reading the body, and a body without one
+    (chunked) is counted as it arrives and rejected once it crosses the limit.
+    """
+
+    def __init__(self, app, paths: tuple, max_bytes: int):
+        self.app = app
+        self.paths = set(paths)
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+
+        detail = f"Upload exceeds {self.max_bytes} bytes"
+        length = Headers(scope=scope).get("content-length", "")
+        if length.isdigit() and int(length) > self.max_bytes:
+            await JSONResponse({"detail": detail}, status_code=413)(scope, receive, send)
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    # Raised inside body parsing, FastAPI re-raises it and answers 413
+                    raise HTTPException(status_code=413, detail=detail)
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+
+async def read_upload(upload, max_bytes: int, chunk_size: int = 256 * 1024) -> bytes:
+    """Read an UploadFile in chunks, refusing a file over max_bytes.
+
+    The request body as a whole is bounded earlier by UploadSizeLimit; this
+    applies the limit to the file itself, without copying more than that.
+    """
+    chunks = []
+    total = 0
+    while True:
+        chunk = await upload.read(chunk_size)
+        if not chunk:
+            break
+        total += len(chunk)
+        if total > max_bytes:
+            raise ImageTooLarge(f"Image exceeds {max_bytes} bytes")
+        chunks.append(chunk)
+    return b''.join(chunks)
+
+
+def dhash(img: Image.Image, size: int = 16) -> int:
+    """Difference hash: one bit per horizontally adjacent pixel pair of a small grayscale copy.
+
+    Re-saved, recompressed or rescaled copies of an image hash to the same or
+    nearby values, so similar images are found by Hamming distance. The
+    default 256 bits keep enough detail to tell mostly-white UI mockups
+    apart; at 8x8 their hashes are nearly all zeros.
+    """
+    small = img.convert('L').resize((size + 1, size), Image.Resampling.BOX)
+    pixels = small.tobytes()
+    value = 0
+    for row in range(size):
+        offset = row * (size + 1)
+        for column in range(size):
+            value = (value << 1) | (pixels[offset + column] < pixels[offset + column + 1])
+    return value
+
+
+def prepare_image(data: bytes, max_dimension: int, encode_format: str = 'WEBP', quality: int = 85) -> dict:
+    """Decode an upload and produce the bytes to send to the vision model.
+
+    Runs in a worker process. Images in a supported format that already fit
+    within max_dimension are passed through untouched; others are downscaled
+    (JPEGs decode straight to the reduced size) and re-encoded to
+    encode_format. image_info describes the original upload, and hash is
+    its dhash.
+    """
+    img = Image.open(io.BytesIO(data))
+    info = {
+        "width": img.size[0],
+        "height": img.size[1],
+        "format": img.format,
+        "mode": img.mode
+    }
+
+    if img.format in PASSTHROUGH_FORMATS and max(img.size) <= max_dimension:
+        return {
+            "image_info": info,
+            "hash": dhash(img),
+            "data": data,
+            "mime_type": f"image/{img.format.lower()}"
+        }
+
+    if img.format == 'JPEG':
+        img.draft('RGB', (max_dimension, max_dimension))
+    img.thumbnail((max_dimension, max_dimension))
+    image_hash = dhash(img)
+
+    encode_format = encode_format.upper()
+    if encode_format == 'JPEG':
+        img = img.convert('RGB')
+    elif img.mode not in ('RGB', 'RGBA'):
+        img = img.convert('RGBA' if 'A' in img.mode or 'transparency' in img.info else 'RGB')
+
+    output = io.BytesIO()
+    img.save(output, format=encode_format, quality=quality)
+    return {
+        "image_info": info,
+        "hash": image_hash,
+        "data": output.getvalue(),
+        "mime_type": f"image/{encode_format.lower()}"
+    }
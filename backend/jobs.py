@@ -0,0 +1,297 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+ACTIVE = (QUEUED, RUNNING)
+
+
+class JobQueue:
+    """Persistent job queue for long generations, worked by local asyncio tasks.
+
+    Jobs live in SQLite, so queued work survives restarts and several
+    processes can share one queue: each claims the oldest queued job with a
+    single UPDATE, and a process started with workers=0 only accepts jobs.
+    Identical active jobs are deduplicated by key. A job whose client stops
+    polling for abandon_after seconds is cancelled; finished jobs are kept
+    for retention seconds. Running jobs hold a lease that their process
+    renews, so jobs of a process that died are re-queued once it lapses.
+    """
+
+    def __init__(self, db_path: str, workers: int = 2, abandon_after: float = 120,
+                 retention: float = 86400, poll_interval: float = 1.0, lease: float = 30):
+        self.workers = workers
+        self.lease = lease
+        self.abandon_after = abandon_after
+        self.retention = retention
+        self.poll_interval = poll_interval
+        self.handlers = {}
+        self.running = {}  # job id -> asyncio task running it in this process
+        self.tasks = []
+        self.wakeup = None
+        self.changed = {}  # job id -> asyncio.Event set on status changes
+        self.db_lock = threading.Lock()
+        self.db = sqlite3.connect(db_path, check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, kind TEXT NOT NULL, payload TEXT NOT NULL, dedupe_key TEXT, "
+            "status TEXT NOT NULL, result TEXT, error TEXT, "
+            "created_at REAL NOT NULL, updated_at REAL NOT NULL, last_seen_at REAL NOT NULL)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS jobs_dedupe ON jobs (dedupe_key, status)")
+        self.db.commit()
+
+    def register(self, kind: str, handler):
+        """Register the coroutine function that runs jobs of kind; it gets the payload dict."""
+        self.handlers[kind] = handler
+
+    # SQLite access, always from worker threads
+
+    def _execute(self, sql: str, params: tuple = ()):
+        with self.db_lock:
+            rows = self.db.execute(sql, params).fetchall()
+            self.db.commit()
+            return rows
+
+    def _submit(self, kind: str, payload: str, dedupe_key: str):
+        with self.db_lock:
+            now = time.time()
+            row = self.db.execute(
+                "SELECT id, status FROM jobs WHERE dedupe_key = ? AND status IN (?, ?) ORDER BY created_at LIMIT 1",
+                (dedupe_key, *ACTIVE)
+            ).fetchone()
+            if row is not None:
+                self.db.execute("UPDATE jobs SET last_seen_at = ? WHERE id = ?", (now, row["id"]))
+                self.db.commit()
+                return row["id"], row["status"]
+            job_id = uuid.uuid4().hex
+            self.db.execute(
+                "INSERT INTO jobs (id, kind, payload, dedupe_key, status, created_at, updated_at, last_seen_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, kind, payload, dedupe_key, QUEUED, now, now, now)
+            )
+            self.db.commit()
+            return job_id, None
+
+    def _claim(self):
+        rows = self._execute(
+            "UPDATE jobs SET status = ?, updated_at = ? WHERE id = "
+            "(SELECT id FROM jobs WHERE status = ? ORDER BY created_at LIMIT 1) "
+            "RETURNING id, kind, payload",
+            (RUNNING, time.time(), QUEUED)
+        )
+        return rows[0] if rows else None
+
+    def _finish(self, job_id: str, status: str, result: str = None, error: str = None):
+        # Only a running job can finish, so a cancellation is never overwritten
+        self._execute(
+            "UPDATE jobs SET status = ?, result = ?, error = ?, updated_at = ? WHERE id = ? AND status = ?",
+            (status, result, error, time.time(), job_id, RUNNING)
+        )
+
+    def _reap(self):
+        now = time.time()
+        abandoned = []
+        if self.abandon_after:
+            abandoned = [row["id"] for row in self._execute(
+                "UPDATE jobs SET status = ?, error = ?, updated_at = ? "
+                "WHERE status IN (?, ?) AND last_seen_at < ? RETURNING id",
+                (CANCELLED, json.dumps({"detail": "Abandoned by client"}), now, *ACTIVE, now - self.abandon_after)
+            )]
+        self._execute(
+            "DELETE FROM jobs WHERE status NOT IN (?, ?) AND updated_at < ?",
+            (*ACTIVE, now - self.retention)
+        )
+        cancelled = []
+        running_here = list(self.running)
+        if running_here:
+            placeholders = ", ".join("?" for _ in running_here)
+            # Renew the lease on jobs running here...
+            self._execute(
+                f"UPDATE jobs SET updated_at = ? WHERE status = ? AND id IN ({placeholders})",
+                (now, RUNNING, *running_here)
+            )
+            # ...and pick up ones cancelled from another process
+            cancelled = [row["id"] for row in self._execute(
+                f"SELECT id FROM jobs WHERE status = ? AND id IN ({placeholders})",
+                (CANCELLED, *running_here)
+            )]
+        # Jobs whose process stopped renewing their lease are run again
+        self._execute(
+            "UPDATE jobs SET status = ?, last_seen_at = ? WHERE status = ? AND updated_at < ?",
+            (QUEUED, now, RUNNING, now - self.lease)
+        )
+        return set(abandoned) | set(cancelled)
+
+    # Public API
+
+    async def submit(self, kind: str, payload: dict, dedupe_key: str) -> dict:
+        """Queue a job, or return the matching queued/running job if there is one."""
+        job_id, existing_status = await asyncio.to_thread(
+            self._submit, kind, json.dumps(payload), dedupe_key
+        )
+        if self.wakeup is not None:
+            self.wakeup.set()
+        return {
+            "jobId": job_id,
+            "status": existing_status or QUEUED,
+            "deduplicated": existing_status is not None
+        }
+
+    async def get(self, job_id: str, touch: bool = True):
+        """Return a job's status (and result or error once finished), or None if unknown.
+
+        Polling marks the job as still wanted by its client.
+        """
+        if touch:
+            await asyncio.to_thread(
+                self._execute, "UPDATE jobs SET last_seen_at = ? WHERE id = ?", (time.time(), job_id)
+            )
+        rows = await asyncio.to_thread(
+            self._execute,
+            "SELECT id, kind, status, result, error, created_at, updated_at FROM jobs WHERE id = ?",
+            (job_id,)
+        )
+        if not rows:
+            return None
+        row = rows[0]
+        job = {
+            "jobId": row["id"],
+            "kind": row["kind"],
+            "status": row["status"],
+            "createdAt": row["created_at"],
+            "updatedAt": row["updated_at"]
+        }
+        if row["result"] is not None:
+            job["result"] = json.loads(row["result"])
+        if row["error"] is not None:
+            job["error"] = json.loads(row["error"])
+        return job
+
+    async def cancel(self, job_id: str) -> bool:
+        """Cancel a queued or running job; returns False if it had already finished."""
+        rows = await asyncio.to_thread(
+            self._execute,
+            "UPDATE jobs SET status = ?, updated_at = ? WHERE id = ? AND status IN (?, ?) RETURNING id",
+            (CANCELLED, time.time(), job_id, *ACTIVE)
+        )
+        if not rows:
+            return False
+        self._cancel_local(job_id)
+        return True
+
+    async def watch(self, job_id: str):
+        """Yield the job's state each time its status changes, until it finishes."""
+        last_status = None
+        while True:
+            job = await self.get(job_id)
+            if job is None:
+                return
+            if job["status"] != last_status:
+                last_status = job["status"]
+                yield job
+            if job["status"] not in ACTIVE:
+                return
+            event = self.changed.setdefault(job_id, asyncio.Event())
+            try:
+                await asyncio.wait_for(event.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            event.clear()
+
+    def _notify(self, job_id: str):
+        event = self.changed.pop(job_id, None)
+        if event is not None:
+            event.set()
+
+    def _cancel_local(self, job_id: str):
+        task = self.running.get(job_id)
+        if task is not None:
+            task.cancel()
+        self._notify(job_id)
+
+    async def _run(self, job):
+        handler = self.handlers.get(job["kind"])
+        try:
+            if handler is None:
+                raise ValueError(f"No handler for job kind {job['kind']!r}")
+            result = await handler(json.loads(job["payload"]))
+            await asyncio.to_thread(self._finish, job["id"], SUCCEEDED, json.dumps(result))
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            error = {
+                "status_code": getattr(e, "status_code", 500),
+                "detail": getattr(e, "detail", str(e))
+            }
+            logging.error(f"Job {job['id']} failed: {error['detail']}")
+            await asyncio.to_thread(self._finish, job["id"], FAILED, None, json.dumps(error))
+
+    async def _worker(self):
+        while True:
+            try:
+                job = await asyncio.to_thread(self._claim)
+            except sqlite3.Error as e:
+                logging.error(f"Job queue claim error: {str(e)}")
+                job = None
+            if job is None:
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self.wakeup.clear()
+                continue
+            self._notify(job["id"])
+            task = asyncio.create_task(self._run(job))
+            self.running[job["id"]] = task
+            try:
+                await asyncio.shield(task)
+            except asyncio.CancelledError:
+                if not task.done():
+                    # The worker itself is shutting down
+                    task.cancel()
+                    raise
+            finally:
+                self.running.pop(job["id"], None)
+                self._notify(job["id"])
+
+    async def _reaper(self):
+        while True:
+            await asyncio.sleep(min(self.lease / 3, 5))
+            try:
+                for job_id in await asyncio.to_thread(self._reap):
+                    self._cancel_local(job_id)
+            except sqlite3.Error as e:
+                logging.error(f"Job queue reaper error: {str(e)}")
+
+    def start(self):
+        """Start the worker and reaper tasks; call from a running event loop."""
+        self.wakeup = asyncio.Event()
+        self.tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self.tasks.append(asyncio.create_task(self._reaper()))
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+    def stats(self) -> dict:
+        counts = {row["status"]: row["count"] for row in self._execute(
+            "SELECT status, COUNT(*) AS count FROM jobs GROUP BY status"
+        )}
+        return {
+            "workers": self.workers,
+            "running_here": len(self.running),
+            **{status: counts.get(status, 0) for status in (QUEUED, RUNNING, SUCCEEDED, FAILED, CANCELLED)}
+        }
@@ -0,0 +1,141 @@
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+import time
+import uuid
+
+# Set per request by the HTTP middleware: {"request_id": ..., "sample_payloads": bool}
+request_context = contextvars.ContextVar("log_request_context", default=None)
+
+# Attributes every LogRecord has; anything else came from extra= and is a structured field
+STANDARD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+PAYLOAD_SAMPLE_RATE = 0.0
+PAYLOAD_MAX_CHARS = 2000
+
+
+class ContextQueueHandler(logging.handlers.QueueHandler):
+    """Queue handler that leaves formatting to the listener thread.
+
+    The stock QueueHandler formats the message in the calling thread; this
+    one only stamps the request id (which lives in the caller's context) and
+    enqueues the record, so %-style arguments are formatted on the listener
+    thread instead of the request path.
+    """
+
+    def prepare(self, record):
+        context = request_context.get()
+        record.request_id = context["request_id"] if context else None
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, message, request id and extra fields."""
+
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage()
+        }
+        if getattr(record, "request_id", None):
+            entry["request_id"] = record.request_id
+        for key, value in vars(record).items():
+            if key not in STANDARD_ATTRIBUTES and key != "request_id":
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """The previous plain format, with the request id and extra fields appended."""
+
+    def __init__(self):
+        super().__init__('%(asctime)s - %(levelname)s - %(message)s')
+
+    def format(self, record):
+        text = super().format(record)
+        fields = [
+            f"{key}={value}" for key, value in vars(record).items()
+            if key not in STANDARD_ATTRIBUTES and key != "request_id"
+        ]
+        if getattr(record, "request_id", None):
+            fields.insert(0, f"request_id={record.request_id}")
+        return f"{text} [{' '.join(fields)}]" if fields else text
+
+
+def setup_logging(level: str = "INFO", log_format: str = "text", payload_sample_rate: float = 0.0,
+                  payload_max_chars: int = 2000):
+    """Route all logging through a queue drained by a background thread.
+
+    Request handlers only enqueue records; formatting and writing to stderr
+    happen on the listener thread.
+    """
+    global PAYLOAD_SAMPLE_RATE, PAYLOAD_MAX_CHARS
+    PAYLOAD_SAMPLE_RATE = payload_sample_rate
+    PAYLOAD_MAX_CHARS = payload_max_chars
+
+    output = logging.StreamHandler(sys.stderr)
+    output.setFormatter(JsonFormatter() if log_format == "json" else TextFormatter())
+    log_queue = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(ContextQueueHandler(log_queue))
+    root.setLevel(level.upper())
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
+
+def start_request(request_id: str = None):
+    """Open a logging context for a request and return the token for end_request.
+
+    Whether the request's payloads get logged is decided once here, so a
+    sampled request logs its prompt and its response together.
+    """
+    return request_context.set({
+        "request_id": request_id or uuid.uuid4().hex[:16],
+        "sample_payloads": PAYLOAD_SAMPLE_RATE > 0 and random.random() < PAYLOAD_SAMPLE_RATE,
+        "started": time.perf_counter()
+    })
+
+
+def end_request(token):
+    request_context.reset(token)
+
+
+def current_request_id():
+    context = request_context.get()
+    return context["request_id"] if context else None
+
+
+def elapsed_ms() -> float:
+    """Milliseconds since the current request started, or 0 outside a request."""
+    context = request_context.get()
+    return round((time.perf_counter() - context["started"]) * 1000, 1) if context else 0.0
+
+
+def log_payload(label: str, text: str, **fields):
+    """Log a prompt or response body at DEBUG, only for sampled requests.
+
+    Unsampled requests skip it entirely. Sampled ones log the size, with the
+    text cut to PAYLOAD_MAX_CHARS.
+    """
+    context = request_context.get()
+    if not (context and context["sample_payloads"] and logging.getLogger().isEnabledFor(logging.DEBUG)):
+        return
+    text = text or ""
+    logging.debug(
+        "%s payload", label,
+        extra={"payload": text[:PAYLOAD_MAX_CHARS], "payload_chars": len(text), **fields}
+    )
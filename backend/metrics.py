@@ -0,0 +1,188 @@
+import asyncio
+import bisect
+import time
+from contextlib import contextmanager
+
+# Latency buckets in seconds, from in-process parsing up to slow LLM completions
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+LAG_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value) -> str:
+    if value == float('inf'):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """A named metric with one value per combination of label values."""
+
+    type = "untyped"
+
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self.values = {}
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(labels.get(name, "") for name in self.label_names)
+
+    def samples(self):
+        """Yield (suffix, label string, value) for the exposition format."""
+        for key, value in self.values.items():
+            yield "", _labels(self.label_names, key), value
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        for suffix, labels, value in self.samples():
+            lines.append(f"{self.name}{suffix}{labels} {_number(value)}")
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def set(self, value: float, **labels):
+        self.values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    """Cumulative-bucket histogram; each label set keeps bucket counts, a sum and a count."""
+
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        series = self.values.get(key)
+        if series is None:
+            series = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def samples(self):
+        for key, (counts, total, count) in self.values.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                yield "_bucket", _labels(self.label_names, key, f'le="{_number(bound)}"'), cumulative
+            yield "_sum", _labels(self.label_names, key), total
+            yield "_count", _labels(self.label_names, key), count
+
+
+class MetricsRegistry:
+    """Holds the process's metrics and renders them in the Prometheus text format.
+
+    Metrics are updated from the event loop only, so there is no locking.
+    """
+
+    def __init__(self):
+        self.metrics = {}
+
+    def _add(self, metric: Metric) -> Metric:
+        if metric.name in self.metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labels: tuple = ()) -> Counter:
+        return self._add(Counter(name, help, labels))
+
+    def gauge(self, name: str, help: str, labels: tuple = ()) -> Gauge:
+        return self._add(Gauge(name, help, labels))
+
+    def histogram(self, name: str, help: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS) -> Histogram:
+        return self._add(Histogram(name, help, labels, buckets))
+
+    def render(self) -> str:
+        return "\n".join(metric.render() for metric in self.metrics.values()) + "\n"
+
+
+class StageTimer:
+    """Times named stages of request handling into a histogram and an error counter.
+
+    Use as `with timer("llm", timings):`. Exceptions leaving the block are
+    counted by type. When timings is a list, (stage, seconds) is appended
+    to it so the request can report its own breakdown.
+    """
+
+    def __init__(self, registry: MetricsRegistry, prefix: str = "app"):
+        self.duration = registry.histogram(
+            f"{prefix}_stage_duration_seconds", "Time spent in each stage of request handling", ("stage",)
+        )
+        self.errors = registry.counter(
+            f"{prefix}_stage_errors_total", "Exceptions raised out of each stage, by type", ("stage", "type")
+        )
+
+    @contextmanager
+    def __call__(self, stage: str, timings: list = None):
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception as e:
+            self.errors.inc(stage=stage, type=type(e).__name__)
+            raise
+        finally:
+            seconds = time.perf_counter() - start
+            self.duration.observe(seconds, stage=stage)
+            if timings is not None:
+                timings.append((stage, seconds))
+
+
+def server_timing(timings: list, total: float = None) -> str:
+    """Format (stage, seconds) pairs as a Server-Timing header value.
+
+    Repeated stages are summed, keeping the order each first ran in.
+    """
+    totals = {}
+    for stage, seconds in timings:
+        totals[stage] = totals.get(stage, 0.0) + seconds
+    entries = [f"{stage};dur={seconds * 1000:.2f}" for stage, seconds in totals.items()]
+    if total is not None:
+        entries.append(f"total;dur={total * 1000:.2f}")
+    return ", ".join(entries)
+
+
+async def monitor_loop_lag(histogram: Histogram, interval: float = 0.5):
+    """Record how late the event loop wakes from a sleep of interval seconds.
+
+    Anything that blocks the loop (CPU-bound parsing, synchronous I/O) shows
+    up directly as lag.
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        histogram.observe(max(loop.time() - start - interval, 0.0))
@@ -0,0 +1,317 @@
+import re
+
+FENCE = "```"
+# Reasoning models (deepseek-r1) wrap their chain of thought in these before answering
+THINK_OPEN = "<think>"
+THINK_CLOSE = "</think>"
+
+# Fence info strings the model uses for each language we extract
+LANGUAGE_ALIASES = {
+    'html': 'html',
+    'htm': 'html',
+    'xhtml': 'html',
+    'css': 'css',
+    'javascript': 'javascript',
+    'js': 'javascript',
+    'jsx': 'javascript',
+    'mjs': 'javascript',
+    'ecmascript': 'javascript',
+}
+
+ANSI_ESCAPE = re.compile(r'\x1B(?:[@-Z\\-_]|\[[0-?]*[ -/]*[@-~])')
+# C0 controls other than tab/newline/CR, DEL and C1 controls
+CONTROL_CHARS = re.compile(r'[\x00-\x08\x0b\x0c\x0e-\x1f\x7f-\x9f]+')
+LANGUAGE_TOKEN = re.compile(r'[ \t]*([A-Za-z0-9_+#.-]*)')
+# The rest of a fence info string after the language: words and key=value attributes (title="x")
+INFO_ATTRIBUTES = re.compile(r'''(?:[\w-]+(?:=(?:"[^"\n]*"|'[^'\n]*'|[^\s"'<>{}();]+))?\s*)*''')
+HTML_EMBEDDED = re.compile(
+    r'<(style|script)\b([^>]*)>(.*?)</\1\s*>',
+    re.DOTALL | re.IGNORECASE
+)
+
+
+def clean_text(text: str, keep_unicode: bool = False) -> str:
+    """Clean and sanitize text output from Groq.
+
+    Strips ANSI escape sequences and surrounding whitespace on every line.
+    By default non-ASCII characters are dropped; with keep_unicode they are
+    kept (emoji, accented UI strings) and only control characters are
+    removed. Each step runs in C over the whole text, and the rare ones
+    (carriage returns, escapes) only run when their marker is present.
+    """
+    if not text:
+        return ""
+    if not keep_unicode:
+        text = text.encode('ascii', 'ignore').decode('ascii')
+    if '\r' in text:
+        text = text.replace('\r\n', '\n').replace('\r', '\n')
+    if '\x1b' in text:
+        text = ANSI_ESCAPE.sub('', text)
+    if keep_unicode:
+        text = CONTROL_CHARS.sub('', text)
+    return '\n'.join(line.strip() for line in text.split('\n')).strip()
+
+
+def split_reasoning(text: str) -> tuple:
+    """Split a leading <think>...</think> reasoning trace off model output.
+
+    Returns (reasoning, answer) with one search for the closing tag. Output
+    whose opening tag was dropped but still has </think> is split at the
+    close; a trace cut off before </think> is all reasoning. Text without a
+    trace comes back unchanged with empty reasoning.
+    """
+    if not text:
+        return "", text or ""
+    close = text.find(THINK_CLOSE)
+    start = len(text) - len(text.lstrip())
+    if close == -1:
+        if text.startswith(THINK_OPEN, start):
+            return text[start + len(THINK_OPEN):].strip(), ""
+        return "", text
+    opened = text.startswith(THINK_OPEN, start)
+    if not opened and THINK_OPEN in text[:close]:
+        # A <think> block later in the answer isn't a leading trace
+        return "", text
+    reasoning = text[start + len(THINK_OPEN) if opened else 0:close]
+    return reasoning.strip(), text[close + len(THINK_CLOSE):].lstrip()
+
+
+class ReasoningFilter:
+    """Separate a leading <think> trace from streamed output as it arrives.
+
+    feed() returns (reasoning, answer) text for each chunk. Only a possible
+    partial tag is held back between chunks; once the trace is closed (or the
+    output turns out not to start with one) text passes straight through.
+    Unlike split_reasoning, a trace missing its opening tag can't be told
+    apart from the answer while streaming, so it passes through as answer.
+    """
+
+    def __init__(self):
+        self.state = "start"  # start -> thinking -> closed -> answer
+        self.pending = ""
+
+    def feed(self, chunk: str) -> tuple:
+        if self.state == "answer":
+            return "", chunk
+        if self.state == "closed":
+            # Drop the whitespace between </think> and the answer
+            chunk = chunk.lstrip()
+            if chunk:
+                self.state = "answer"
+            return "", chunk
+        text = self.pending + chunk
+        self.pending = ""
+
+        if self.state == "start":
+            stripped = text.lstrip()
+            if not stripped or THINK_OPEN.startswith(stripped):
+                self.pending = text  # whitespace or a partial <think> so far
+                return "", ""
+            if not stripped.startswith(THINK_OPEN):
+                self.state = "answer"
+                return "", text
+            self.state = "thinking"
+            text = stripped[len(THINK_OPEN):]
+
+        close = text.find(THINK_CLOSE)
+        if close != -1:
+            answer = text[close + len(THINK_CLOSE):].lstrip()
+            self.state = "answer" if answer else "closed"
+            return text[:close], answer
+        # Hold back a tail that could be the start of </think>
+        for size in range(min(len(THINK_CLOSE) - 1, len(text)), 0, -1):
+            if THINK_CLOSE.startswith(text[-size:]):
+                self.pending = text[-size:]
+                return text[:-size], ""
+        return text, ""
+
+    def flush(self) -> tuple:
+        """Return whatever is still held back once the stream ends."""
+        pending, self.pending = self.pending, ""
+        if self.state == "thinking":
+            return pending, ""
+        return "", pending
+
+
+def normalize_language(info: str) -> str:
+    """Map a fence info string (```JS, ```jsx, ```HTML) to html/css/javascript, or ''."""
+    return LANGUAGE_ALIASES.get(info.lower(), '')
+
+
+def _open_fence(text: str, start: int, final: bool = False):
+    """Parse the fence opening at start; return (info, code_start) or None if incomplete.
+
+    info is the first word of the info string (```html title="x" gives html).
+    With final, text is complete and a fence line without a newline (a
+    one-line block at the end) still opens a block.
+    """
+    token = LANGUAGE_TOKEN.match(text, start + 3)
+    info = token.group(1)
+    newline = text.find('\n', token.end())
+    if newline == -1:
+        if not final:
+            return None
+        newline = len(text)
+    rest = text[token.end():newline].strip()
+    if rest and not INFO_ATTRIBUTES.fullmatch(rest):
+        # Code on the same line as the fence (```html <div>...), as the old regexes allowed
+        return info, token.end()
+    return info, min(newline + 1, len(text))
+
+
+def find_code_blocks(text: str) -> list:
+    """Find every fenced code block in text in a single left-to-right pass.
+
+    Returns dicts with the raw info string, the normalized language ('' for
+    languages we don't extract), the stripped code, and offsets: start/end
+    cover the fences, code_start/code_end the code between them. An
+    unterminated final block runs to the end of the text.
+    """
+    blocks = []
+    position = 0
+    length = len(text)
+
+    while True:
+        start = text.find(FENCE, position)
+        if start == -1:
+            break
+        opened = _open_fence(text, start, final=True)
+        info, code_start = opened
+        close = text.find(FENCE, code_start)
+        code_end = length if close == -1 else close
+        end = length if close == -1 else close + 3
+        blocks.append({
+            "info": info,
+            "language": normalize_language(info),
+            "code": text[code_start:code_end].strip(),
+            "start": start,
+            "end": end,
+            "code_start": code_start,
+            "code_end": code_end
+        })
+        position = end
+
+    return blocks
+
+
+def merge_blocks(blocks: list) -> dict:
+    """Join blocks of the same language, in order, into html/css/javascript strings."""
+    parts = {
+        'html': [],
+        'css': [],
+        'javascript': []
+    }
+    for block in blocks:
+        if block["language"] in parts and block["code"]:
+            parts[block["language"]].append(block["code"])
+    return {key: "\n\n".join(value) for key, value in parts.items()}
+
+
+def extract_code_blocks(text: str) -> dict:
+    """Extract code blocks from the Groq output.
+
+    All ```html/```css/```javascript blocks (and aliases such as ```js,
+    ```jsx or ```HTML) are found in one pass; several blocks of the same
+    language are concatenated.
+    """
+    return merge_blocks(find_code_blocks(text))
+
+
+def find_html_blocks(html_content: str) -> list:
+    """Find inline <style> and <script> elements of an HTML document in one pass.
+
+    Uses the same block shape as find_code_blocks. External scripts
+    (<script src=...>) and non-JavaScript script types are left alone.
+    """
+    blocks = []
+    for match in HTML_EMBEDDED.finditer(html_content):
+        tag, attributes = match.group(1).lower(), match.group(2).lower()
+        if tag == 'script':
+            if 'src=' in attributes:
+                continue
+            script_type = re.search(r'type\s*=\s*["\']?([^"\'\s>]+)', attributes)
+            if script_type and 'javascript' not in script_type.group(1) and script_type.group(1) != 'module':
+                continue
+        blocks.append({
+            "info": tag,
+            "language": 'css' if tag == 'style' else 'javascript',
+            "code": match.group(3).strip(),
+            "start": match.start(),
+            "end": match.end(),
+            "code_start": match.start(3),
+            "code_end": match.end(3)
+        })
+    return blocks
+
+
+def split_html_document(html_content: str) -> dict:
+    """Split a combined document into html, css and javascript.
+
+    The html part is the document with the extracted <style>/<script>
+    elements cut out, assembled from slices in the same pass.
+    """
+    blocks = find_html_blocks(html_content)
+    pieces = []
+    position = 0
+    for block in blocks:
+        pieces.append(html_content[position:block["start"]])
+        position = block["end"]
+    pieces.append(html_content[position:])
+
+    code = merge_blocks(blocks)
+    code['html'] = ''.join(pieces)
+    return code
+
+
+class CodeBlockStream:
+    """Incrementally extract ```html / ```css / ```javascript blocks from streamed text.
+
+    Mirrors extract_code_blocks: fences are scanned once as text arrives,
+    language aliases are recognized, and repeated blocks of a language are
+    concatenated.
+    """
+
+    def __init__(self, keep_unicode: bool = False):
+        self.keep_unicode = keep_unicode
+        self.buffer = ""
+        self.pos = 0
+        self.open_lang = None
+        self.open_start = 0
+        self.blocks = {
+            'html': '',
+            'css': '',
+            'javascript': ''
+        }
+
+    def feed(self, chunk: str) -> list:
+        """Add streamed text and return (language, code) for blocks closed by it."""
+        self.buffer += chunk
+        finished = []
+        while True:
+            if self.open_lang is None:
+                start = self.buffer.find(FENCE, self.pos)
+                if start == -1:
+                    # Keep a possible partial fence for the next chunk
+                    self.pos = max(self.pos, len(self.buffer) - 2)
+                    break
+                opened = _open_fence(self.buffer, start)
+                if opened is None:
+                    self.pos = start
+                    break
+                info, self.open_start = opened
+                self.open_lang = normalize_language(info)
+                self.pos = self.open_start
+            end = self.buffer.find(FENCE, self.pos)
+            if end == -1:
+                self.pos = max(self.open_start, len(self.buffer) - 2)
+                break
+            code = clean_text(self.buffer[self.open_start:end], self.keep_unicode)
+            if self.open_lang and code:
+                if self.blocks[self.open_lang]:
+                    self.blocks[self.open_lang] += "\n\n" + code
+                else:
+                    self.blocks[self.open_lang] = code
+                finished.append((self.open_lang, code))
+            self.open_lang = None
+            self.pos = end + 3
+        return finished
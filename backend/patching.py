@@ -0,0 +1,107 @@
+import re
+
+
+class PatchError(Exception):
+    """Raised when a model-produced patch can't be applied to the existing code."""
+
+
+HUNK_HEADER = re.compile(r'^@@')
+
+
+def _normalize(line: str) -> str:
+    # Model output goes through clean_text, which strips indentation and
+    # non-ASCII characters, so hunks are matched on a similarly reduced form.
+    return ''.join(char for char in line if ord(char) < 128).strip()
+
+
+def parse_hunks(diff_text: str) -> list:
+    """Split a unified diff into hunks of (old_lines, new_lines)."""
+    hunks = []
+    old_lines, new_lines = [], []
+    in_hunk = False
+    seen_header = False
+
+    for line in diff_text.split('\n'):
+        # File headers only precede the first hunk; later, '---i;' removes '--i;'
+        if not seen_header and (line.startswith('---') or line.startswith('+++')):
+            continue
+        if HUNK_HEADER.match(line):
+            if in_hunk and (old_lines or new_lines):
+                hunks.append((old_lines, new_lines))
+            old_lines, new_lines = [], []
+            in_hunk = True
+            seen_header = True
+            continue
+        if line.startswith('\\'):
+            continue  # "\ No newline at end of file"
+        in_hunk = True
+        if line.startswith('-'):
+            old_lines.append(line[1:])
+        elif line.startswith('+'):
+            new_lines.append(line[1:])
+        else:
+            # Context lines may have lost their leading space in transit
+            line = line[1:] if line.startswith(' ') else line
+            old_lines.append(line)
+            new_lines.append(line)
+
+    if in_hunk and (old_lines or new_lines):
+        hunks.append((old_lines, new_lines))
+    return hunks
+
+
+def _find(lines: list, needle: list, start: int) -> int:
+    """Return the index of needle in lines, comparing normalized text, or -1."""
+    target = [_normalize(line) for line in needle]
+    size = len(target)
+    for i in range(start, len(lines) - size + 1):
+        if all(_normalize(lines[i + j]) == target[j] for j in range(size)):
+            return i
+    return -1
+
+
+def apply_unified_diff(original: str, diff_text: str) -> str:
+    """Apply unified diff hunks to original, locating each hunk by its content.
+
+    Line numbers in hunk headers are ignored because models rarely get them
+    right. Each hunk is searched for after the previous one first, then from
+    the top of the file; a hunk that matches nowhere, or has no context or
+    removed lines to match, raises PatchError.
+    """
+    hunks = parse_hunks(diff_text)
+    if not hunks:
+        raise PatchError("Patch contains no hunks")
+
+    lines = original.split('\n')
+    position = 0
+    for old_lines, new_lines in hunks:
+        # Trim blank context at the edges; models often add or drop it
+        while old_lines and not old_lines[0].strip() and new_lines and not new_lines[0].strip():
+            old_lines, new_lines = old_lines[1:], new_lines[1:]
+        while old_lines and not old_lines[-1].strip() and new_lines and not new_lines[-1].strip():
+            old_lines, new_lines = old_lines[:-1], new_lines[:-1]
+
+        if not old_lines:
+            # Without context there is no telling where the lines go (the end of
+            # an HTML document is after </html>), so let the caller fall back
+            raise PatchError("Hunk has no context or removed lines to locate it")
+
+        index = _find(lines, old_lines, position)
+        if index == -1:
+            index = _find(lines, old_lines, 0)
+        if index == -1:
+            raise PatchError(f"Hunk does not match existing code: {old_lines[0].strip()!r}")
+
+        # Keep the original text for unchanged context lines so indentation survives
+        replacement = []
+        old_normalized = {}
+        for offset, line in enumerate(old_lines):
+            old_normalized.setdefault(_normalize(line), []).append(lines[index + offset])
+        for line in new_lines:
+            originals = old_normalized.get(_normalize(line))
+            replacement.append(originals.pop(0) if originals else line)
+
+        lines[index:index + len(old_lines)] = replacement
+        position = index + len(replacement)
+
+    return '\n'.join(lines)
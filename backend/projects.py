@@ -0,0 +1,197 @@
+import asyncio
+import hashlib
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+SECTIONS = ('html', 'css', 'javascript')
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+class VersionConflict(Exception):
+    """A commit was based on a version that is no longer the project's latest."""
+
+    def __init__(self, project_id: str, parent: int, latest: int):
+        super().__init__(f"Version {parent} of project {project_id} is not the latest (version {latest})")
+        self.parent = parent
+        self.latest = latest
+
+
+class ProjectStore:
+    """Versioned projects whose html, css and javascript live in a content-addressed blob store.
+
+    Each version is a row of three blob hashes, so a version that changes
+    one section stores one new blob. Committing code identical to its base
+    returns the base version instead of creating one. Only the newest
+    max_versions versions of a project are kept, and blobs no version
+    references are deleted with them. Recently read blobs are kept in memory.
+    """
+
+    def __init__(self, db_path: str, max_versions: int = 50, max_cached_blobs: int = 1000):
+        self.max_versions = max_versions
+        self.max_cached_blobs = max_cached_blobs
+        self.blobs = OrderedDict()  # hash -> text, most recently used last
+        self.db_lock = threading.Lock()
+        self.db = sqlite3.connect(db_path, check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute("CREATE TABLE IF NOT EXISTS blobs (hash TEXT PRIMARY KEY, content TEXT NOT NULL)")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS project_versions ("
+            "project_id TEXT NOT NULL, version INTEGER NOT NULL, parent INTEGER, "
+            "html TEXT NOT NULL, css TEXT NOT NULL, javascript TEXT NOT NULL, created_at REAL NOT NULL, "
+            "PRIMARY KEY (project_id, version))"
+        )
+        self.db.commit()
+
+    def _cache_blob(self, blob_hash: str, text: str):
+        self.blobs[blob_hash] = text
+        self.blobs.move_to_end(blob_hash)
+        while len(self.blobs) > self.max_cached_blobs:
+            self.blobs.popitem(last=False)
+
+    # SQLite access, always from worker threads
+
+    def _version_row(self, project_id: str, version: int = None):
+        if version is None:
+            return self.db.execute(
+                "SELECT * FROM project_versions WHERE project_id = ? ORDER BY version DESC LIMIT 1", (project_id,)
+            ).fetchone()
+        return self.db.execute(
+            "SELECT * FROM project_versions WHERE project_id = ? AND version = ?", (project_id, version)
+        ).fetchone()
+
+    def _get(self, project_id: str, version: int = None):
+        with self.db_lock:
+            row = self._version_row(project_id, version)
+            if row is None:
+                return None
+            code = {}
+            for section in SECTIONS:
+                blob_hash = row[section]
+                text = self.blobs.get(blob_hash)
+                if text is None:
+                    text = self.db.execute("SELECT content FROM blobs WHERE hash = ?", (blob_hash,)).fetchone()[0]
+                self._cache_blob(blob_hash, text)
+                code[section] = text
+            return {"projectId": project_id, "version": row["version"], "code": code}
+
+    def _commit(self, project_id: str, code: dict, parent: int = None):
+        hashes = {section: content_hash(code.get(section) or '') for section in SECTIONS}
+        with self.db_lock:
+            latest = self._version_row(project_id)
+            if parent is not None:
+                base = self._version_row(project_id, parent)
+                if base is None:
+                    return None
+                if base["version"] != latest["version"]:
+                    raise VersionConflict(project_id, parent, latest["version"])
+            else:
+                base = latest
+            if base is not None and all(base[section] == hashes[section] for section in SECTIONS):
+                return base["version"]
+
+            for section in SECTIONS:
+                if hashes[section] not in self.blobs:
+                    self.db.execute(
+                        "INSERT OR IGNORE INTO blobs (hash, content) VALUES (?, ?)",
+                        (hashes[section], code.get(section) or '')
+                    )
+                self._cache_blob(hashes[section], code.get(section) or '')
+            version = latest["version"] + 1 if latest is not None else 1
+            self.db.execute(
+                "INSERT INTO project_versions (project_id, version, parent, html, css, javascript, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (project_id, version, base["version"] if base is not None else None,
+                 hashes['html'], hashes['css'], hashes['javascript'], time.time())
+            )
+            pruned = self.db.execute(
+                "DELETE FROM project_versions WHERE project_id = ? AND version <= ?",
+                (project_id, version - self.max_versions)
+            ).rowcount
+            if pruned:
+                self.db.execute(
+                    "DELETE FROM blobs WHERE hash NOT IN ("
+                    "SELECT html FROM project_versions UNION SELECT css FROM project_versions "
+                    "UNION SELECT javascript FROM project_versions)"
+                )
+                self.blobs.clear()
+            self.db.commit()
+            return version
+
+    # Public API
+
+    async def create(self, code: dict) -> dict:
+        """Store code as version 1 of a new project."""
+        project_id = uuid.uuid4().hex
+        version = await asyncio.to_thread(self._commit, project_id, code)
+        return {"projectId": project_id, "version": version}
+
+    async def get(self, project_id: str, version: int = None):
+        """Return {"projectId", "version", "code"} for a version (the latest by default), or None."""
+        return await asyncio.to_thread(self._get, project_id, version)
+
+    async def commit(self, project_id: str, code: dict, parent: int = None):
+        """Store code as the project's next version, based on parent (the latest by default).
+
+        Returns the new version number, parent itself if nothing changed, or
+        None if the parent version doesn't exist. Raises VersionConflict if
+        parent is not the latest version, so a stale commit can't silently
+        fork the project and hide the newer versions' edits.
+        """
+        return await asyncio.to_thread(self._commit, project_id, code, parent)
+
+    def stats(self) -> dict:
+        with self.db_lock:
+            row = self.db.execute(
+                "SELECT COUNT(DISTINCT project_id) AS projects, COUNT(*) AS versions FROM project_versions"
+            ).fetchone()
+            blobs = self.db.execute("SELECT COUNT(*) FROM blobs").fetchone()[0]
+        return {
+            "projects": row["projects"],
+            "versions": row["versions"],
+            "blobs": blobs,
+            "cached_blobs": len(self.blobs)
+        }
+
+
+class DerivedCache:
+    """LRU of values derived from code sections, keyed by the section's content.
+
+    Parsed CSS blocks, fragment indexes and token counts of code a client
+    keeps sending back (or that a project version stores) are computed once
+    per distinct text rather than on every request. Cached values are
+    shared, so callers must not mutate them.
+    """
+
+    def __init__(self, max_entries: int = 512):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, kind: str, text: str, compute):
+        key = (kind, text)
+        value = self.entries.get(key)
+        if value is not None:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return value
+        self.misses += 1
+        value = compute(text)
+        self.entries[key] = value
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        return value
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self.entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses
+        }
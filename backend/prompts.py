@@ -0,0 +1,428 @@
+import string
+import time
+
+CODE_FORMAT = """Return the code in the exact format below:
+```html
+[Your HTML code here]
+```
+
+```css
+[Your CSS code here]
+```
+
+```javascript
+[Your JavaScript code here]
+```"""
+
+
+class PromptTemplate:
+    """A versioned prompt template, parsed once into literal text and placeholders.
+
+    Templates keep their instructions first and the per-request values
+    last, so the static prefix is identical across requests (which is what
+    upstream prompt caching keys on).
+    """
+
+    def __init__(self, name: str, version: int, text: str):
+        self.name = name
+        self.version = version
+        # literals[i] precedes fields[i]; the last literal follows the last field
+        self.literals = [""]
+        self.fields = []
+        for literal, field, _, _ in string.Formatter().parse(text):
+            # Escaped braces ({{ }}) come back as extra literal-only pieces
+            self.literals[-1] += literal
+            if field is not None:
+                self.fields.append(field)
+                self.literals.append("")
+        self.static_prefix = self.literals[0]
+
+    @property
+    def key(self) -> str:
+        return f"{self.name}@v{self.version}"
+
+    def render(self, values: dict) -> str:
+        pieces = [self.literals[0]]
+        for field, literal in zip(self.fields, self.literals[1:]):
+            pieces.append(str(values[field]))
+            pieces.append(literal)
+        return "".join(pieces)
+
+
+class PromptRegistry:
+    """Holds every prompt template and records how long rendering takes."""
+
+    def __init__(self):
+        self.templates = {}
+        self.timings = {}
+
+    def register(self, name: str, version: int, text: str) -> PromptTemplate:
+        template = PromptTemplate(name, version, text)
+        self.templates[name] = template
+        self.timings[name] = {"renders": 0, "total_ms": 0.0, "max_ms": 0.0}
+        return template
+
+    def render(self, name: str, **values) -> str:
+        start = time.perf_counter()
+        text = self.templates[name].render(values)
+        elapsed = (time.perf_counter() - start) * 1000
+        timing = self.timings[name]
+        timing["renders"] += 1
+        timing["total_ms"] += elapsed
+        timing["max_ms"] = max(timing["max_ms"], elapsed)
+        return text
+
+    def identify(self, prompt: str) -> str:
+        """Return "name@vN" of the template whose static prefix starts prompt, or ''.
+
+        Lets cache keys carry the template version without threading it
+        through every caller; the longest matching prefix wins.
+        """
+        best = None
+        for template in self.templates.values():
+            if template.static_prefix and prompt.startswith(template.static_prefix):
+                if best is None or len(template.static_prefix) > len(best.static_prefix):
+                    best = template
+        return best.key if best else ''
+
+    def stats(self) -> dict:
+        return {
+            name: {
+                "version": self.templates[name].version,
+                "renders": timing["renders"],
+                "avg_ms": round(timing["total_ms"] / timing["renders"], 4) if timing["renders"] else 0.0,
+                "max_ms": round(timing["max_ms"], 4)
+            }
+            for name, timing in self.timings.items()
+        }
+
+
+PROMPTS = PromptRegistry()
+
+PROMPTS.register("new_code_from_image", 1, """Act as a web development expert. Generate complete website code matching the description at the end.
+
+Requirements:
+- Pixel-perfect layout matching
+- Responsive design
+- Modern CSS (Flexbox/Grid)
+- Semantic HTML
+- Interactive elements where appropriate
+
+""" + CODE_FORMAT + """
+
+Description:
+{prompt}""")
+
+PROMPTS.register("new_code_web", 1, """Act as a web development expert. Create code for the request at the end.
+
+Create a web application following these guidelines:
+1. Semantic HTML5 structure
+2. Modern, responsive CSS
+3. Clean JavaScript with error handling
+4. Cross-browser compatible
+5. Performance optimized
+
+""" + CODE_FORMAT + """
+
+Request: {prompt}
+
+Requirements:
+{requirements}""")
+
+PROMPTS.register("new_code_game", 1, """Act as a web development expert. Create code for the request at the end.
+
+Create a browser game with:
+1. Clean JavaScript architecture
+2. Game state management
+3. User input handling
+4. Victory/loss conditions
+5. Error handling
+6. Responsive design
+
+""" + CODE_FORMAT + """
+
+Request: {prompt}
+
+Requirements:
+{requirements}""")
+
+# Sectioned generation: a shared structure plan, then html, css and javascript written concurrently
+PROMPTS.register("plan_structure", 1, """Act as a web development expert. Plan the structure of the project requested at the end. Do not write any code.
+
+Three developers will write the HTML, the CSS and the JavaScript separately and at the same time, using only this plan, so every name they must agree on has to be in it. List concisely:
+- Page sections in order, each with its element id
+- Class names and the elements that use them
+- Interactive elements, their ids and the events they handle
+- JavaScript functions: name, purpose and the ids/classes they use
+- State classes or data attributes toggled by JavaScript (e.g. .is-active)
+
+Keep the plan under 300 words.
+
+Project type: {kind}
+
+Request: {prompt}
+
+Requirements:
+{requirements}""")
+
+PROMPTS.register("section_html", 1, """Act as a web development expert. Write ONLY the HTML for the project at the end, following its structure plan exactly.
+
+- Use exactly the ids and class names in the plan; the CSS and JavaScript are being written against them at the same time
+- Semantic HTML5 body content only: no <html>, <head> or <body> tags, no <style> or <script> elements
+- Include every section and interactive element in the plan
+
+Return the code in a single ```html block.
+
+Structure plan:
+{plan}
+
+Project type: {kind}
+
+Request: {prompt}
+
+Requirements:
+{requirements}""")
+
+PROMPTS.register("section_css", 1, """Act as a web development expert. Write ONLY the CSS for the project at the end, following its structure plan exactly.
+
+- Style the ids, class names and state classes in the plan; the HTML and JavaScript are being written against them at the same time
+- Modern, responsive CSS (Flexbox/Grid)
+- No HTML or JavaScript
+
+Return the code in a single ```css block.
+
+Structure plan:
+{plan}
+
+Project type: {kind}
+
+Request: {prompt}
+
+Requirements:
+{requirements}""")
+
+PROMPTS.register("section_javascript", 1, """Act as a web development expert. Write ONLY the JavaScript for the project at the end, following its structure plan exactly.
+
+- Use exactly the ids, class names and function names in the plan; the HTML and CSS are being written against them at the same time
+- The script runs at the end of <body>, after the HTML has loaded
+- Clean JavaScript with error handling; for games, include state management, input handling and victory/loss conditions
+- No HTML or CSS
+
+Return the code in a single ```javascript block.
+
+Structure plan:
+{plan}
+
+Project type: {kind}
+
+Request: {prompt}
+
+Requirements:
+{requirements}""")
+
+PROMPTS.register("modify_code", 1, """Act as a web development expert. Please modify the existing code based on the request at the end.
+
+IMPORTANT GUIDELINES:
+1. Preserve ALL existing styles and functionality
+2. Only add or modify the specific styles or elements mentioned in the request
+3. Return complete, unmodified sections for HTML/JS if they don't need changes
+4. For CSS changes:
+   - Keep all existing CSS rules intact
+   - Only modify the specific properties mentioned
+   - Add new rules without removing existing ones
+
+Return the complete code with your specific modifications in clearly marked sections using the exact format below:
+```html
+[Your HTML code here]
+```
+
+```css
+[Your CSS code here]
+```
+
+```javascript
+[Your JavaScript code here]
+```
+
+Existing Elements Analysis:
+- HTML elements: {html_elements}...
+- JavaScript functions: {js_functions}...
+- CSS classes: {css_classes}...
+
+{code_context}
+
+Modification request: {prompt}""")
+
+PROMPTS.register("modify_code_pruned", 1, """Act as a web development expert. Please modify the existing code based on the request at the end.
+
+IMPORTANT GUIDELINES:
+1. Preserve ALL existing styles and functionality
+2. Only add or modify the specific styles or elements mentioned in the request
+3. Return ONLY what changes:
+   - The complete updated version of each HTML section, CSS rule or JavaScript function you modify
+   - Any new HTML sections, CSS rules or JavaScript you add
+   - Do not repeat code that stays the same, whether shown or not
+
+Return your changes in clearly marked sections using the exact format below:
+```html
+[Changed or new HTML sections]
+```
+
+```css
+[Changed or new CSS rules]
+```
+
+```javascript
+[Changed or new JavaScript functions]
+```
+
+{code_context}
+
+Modification request: {prompt}""")
+
+PROMPTS.register("modify_code_patch", 1, """Act as a web development expert. Please modify the existing code based on the request at the end.
+
+Do NOT return the full code. Return only the changes, using these sections:
+
+1. HTML changes as a unified diff in a ```html-patch block
+2. CSS changes in a ```css block containing ONLY the rules you add or change
+   - For an existing rule, list only the properties that change
+   - To delete a rule, write it with an empty body, e.g. `.old-banner {{}}`
+3. JavaScript changes as a unified diff in a ```javascript-patch block
+
+Omit any section that does not change. Each diff hunk starts with @@ and must
+include at least two unchanged context lines, copied exactly from the code shown.
+
+Example:
+```html-patch
+@@
+ <header>
+-  <h1>Old title</h1>
++  <h1>New title</h1>
+ </header>
+```
+
+```css
+.title {{
+    color: #1e40af;
+}}
+```
+
+{code_context}
+
+Modification request: {prompt}""")
+
+PROMPTS.register("code_context", 1, """Current Code:
+
+```html
+{html}
+```
+
+```css
+{css}
+```
+
+```javascript
+{javascript}
+```""")
+
+PROMPTS.register("code_context_pruned", 1, """The project is large, so only the parts relevant to this request are shown.
+
+Other existing code (not shown, keep it unchanged):
+{outline}
+
+Relevant Current Code:
+
+```html
+{html}
+```
+
+```css
+{css}
+```
+
+```javascript
+{javascript}
+```""")
+
+PROMPTS.register("image_description", 1, """Analyze this web design image and describe its structure. Include:
+1. Layout structure
+2. Color scheme
+3. UI components
+4. Typography
+5. Special features""")
+
+PROMPTS.register("image_to_code", 1, """Convert the web design description at the end into HTML, CSS, and JavaScript code.
+
+Generate complete code with:
+1. Semantic HTML5 structure
+2. Modern CSS (Flexbox/Grid)
+3. Clean JavaScript
+4. Responsive design
+5. Accessibility features
+
+""" + CODE_FORMAT + """
+
+Design Description:
+{description}""")
+
+PROMPTS.register("ai_tutor", 1, """You are an AI tutor specializing in web development.
+Provide a formal, educational response to the question at the end, maintaining a professional and courteous tone.
+
+Guidelines:
+1. Explain concepts clearly and professionally for learners
+2. Include practical examples where applicable
+3. Present complex topics in an organized, step-by-step manner
+4. Offer additional resources or guidance as appropriate
+
+Response Format:
+- Begin with a concise, formal explanation
+- Provide a structured breakdown of steps
+- Include a relevant code example if applicable
+- Conclude with formal suggestions for further learning
+
+Context: {context}
+Question: {prompt}""")
+
+PROMPTS.register("code_review", 1, """Act as an expert code reviewer.
+Perform a deep, comprehensive code analysis of the code at the end with precise, actionable feedback:
+
+COMPREHENSIVE REVIEW GUIDELINES:
+1. Code Quality Assessment
+   - Evaluate overall code structure
+   - Check adherence to best practices
+   - Assess readability and maintainability
+
+2. Performance Analysis
+   - Identify potential performance bottlenecks
+   - Suggest optimization strategies
+   - Recommend efficient alternatives
+
+3. Security Evaluation
+   - Detect potential security vulnerabilities
+   - Highlight risks and provide mitigation strategies
+   - Suggest defensive programming techniques
+
+4. Best Practices and Improvements
+   - Recommend code refactoring techniques
+   - Suggest modern coding patterns
+   - Provide specific, implementable suggestions
+
+5. Specific Focus Areas:
+   - Variable naming conventions
+   - Error handling
+   - Code modularity
+   - Potential memory leaks
+   - Unnecessary computations
+
+Output Format:
+- Provide a structured, detailed review
+- Use a professional, constructive tone
+- Prioritize actionable insights
+- Include code snippets for improvement where applicable
+
+Language: {language}
+
+Code to Review:
+{code}
+""")
@@ -0,0 +1,393 @@
+import asyncio
+import json
+import logging
+import time
+from collections import deque
+
+import httpx
+
+
+class ProviderError(Exception):
+    """Raised when every backend for a route has failed."""
+
+
+class Provider:
+    """One LLM backend: a service plus the model it serves.
+
+    Subclasses implement complete() and stream(); both take the system
+    prompt, the user prompt, temperature, max_tokens and an optional
+    timeout in seconds, which replaces the client library's own default.
+    """
+
+    kind = "provider"
+
+    def __init__(self, model: str, name: str = None):
+        self.model = model
+        self.name = name or f"{self.kind}:{model}"
+
+    async def complete(self, system: str, prompt: str, temperature: float, max_tokens: int,
+                       timeout: float = None) -> str:
+        raise NotImplementedError
+
+    async def stream(self, system: str, prompt: str, temperature: float, max_tokens: int, timeout: float = None):
+        yield await self.complete(system, prompt, temperature, max_tokens, timeout)
+
+
+class GroqProvider(Provider):
+    kind = "groq"
+
+    def __init__(self, client, model: str, name: str = None):
+        super().__init__(model, name)
+        self.client = client
+
+    def _messages(self, system: str, prompt: str) -> list:
+        return [
+            {
+                "role": "system",
+                "content": system
+            },
+            {
+                "role": "user",
+                "content": prompt
+            }
+        ]
+
+    async def complete(self, system, prompt, temperature, max_tokens, timeout=None):
+        chat_completion = await self.client.chat.completions.create(
+            messages=self._messages(system, prompt),
+            model=self.model,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            timeout=timeout
+        )
+        return chat_completion.choices[0].message.content
+
+    async def stream(self, system, prompt, temperature, max_tokens, timeout=None):
+        stream = await self.client.chat.completions.create(
+            messages=self._messages(system, prompt),
+            model=self.model,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            stream=True,
+            timeout=timeout
+        )
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+
+class GeminiProvider(Provider):
+    kind = "gemini"
+
+    def __init__(self, model: str, name: str = None):
+        super().__init__(model, name)
+        self.models = {}  # system prompt -> GenerativeModel
+
+    def _model(self, system: str):
+        import google.generativeai as genai
+        if system not in self.models:
+            self.models[system] = genai.GenerativeModel(self.model, system_instruction=system)
+        return self.models[system]
+
+    async def complete(self, system, prompt, temperature, max_tokens, timeout=None):
+        response = await self._model(system).generate_content_async(
+            prompt,
+            generation_config={"temperature": temperature, "max_output_tokens": max_tokens},
+            request_options={"timeout": timeout} if timeout else None
+        )
+        return response.text
+
+    async def stream(self, system, prompt, temperature, max_tokens, timeout=None):
+        response = await self._model(system).generate_content_async(
+            prompt,
+            generation_config={"temperature": temperature, "max_output_tokens": max_tokens},
+            request_options={"timeout": timeout} if timeout else None,
+            stream=True
+        )
+        async for chunk in response:
+            if chunk.text:
+                yield chunk.text
+
+
+class OpenAICompatibleProvider(Provider):
+    """Any server speaking the OpenAI chat completions API, e.g. a local model or stub."""
+
+    kind = "openai"
+
+    def __init__(self, base_url: str, model: str, api_key: str = None, name: str = None):
+        super().__init__(model, name or f"openai:{model}@{base_url}")
+        headers = {"Authorization": f"Bearer {api_key}"} if api_key else {}
+        self.client = httpx.AsyncClient(base_url=base_url.rstrip('/'), headers=headers, timeout=None)
+
+    def _body(self, system, prompt, temperature, max_tokens, stream=False) -> dict:
+        return {
+            "model": self.model,
+            "messages": [
+                {"role": "system", "content": system},
+                {"role": "user", "content": prompt}
+            ],
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+            "stream": stream
+        }
+
+    async def complete(self, system, prompt, temperature, max_tokens, timeout=None):
+        response = await self.client.post(
+            "/chat/completions", json=self._body(system, prompt, temperature, max_tokens), timeout=timeout
+        )
+        response.raise_for_status()
+        return response.json()["choices"][0]["message"]["content"]
+
+    async def stream(self, system, prompt, temperature, max_tokens, timeout=None):
+        async with self.client.stream(
+            "POST", "/chat/completions", json=self._body(system, prompt, temperature, max_tokens, stream=True),
+            timeout=timeout
+        ) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                data = line[5:].strip()
+                if data == "[DONE]":
+                    break
+                choices = json.loads(data).get("choices") or [{}]
+                content = choices[0].get("delta", {}).get("content")
+                if content:
+                    yield content
+
+
+class FakeProvider(Provider):
+    """In-process provider with a canned reply, for local development and tests."""
+
+    kind = "fake"
+
+    def __init__(self, model: str = "fake", reply: str = "", delay: float = 0.0,
+                 fail: bool = False, name: str = None):
+        super().__init__(model, name)
+        self.reply = reply
+        self.delay = delay
+        self.fail = fail
+        self.calls = 0
+
+    async def complete(self, system, prompt, temperature, max_tokens, timeout=None):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        if self.fail:
+            raise RuntimeError(f"{self.name} failed")
+        return self.reply
+
+    async def stream(self, system, prompt, temperature, max_tokens, timeout=None):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        if self.fail:
+            raise RuntimeError(f"{self.name} failed")
+        for i in range(0, len(self.reply), 16):
+            yield self.reply[i:i + 16]
+
+
+class LatencyTracker:
+    """Rolling latency and error rate over a provider's most recent calls."""
+
+    def __init__(self, window: int = 100):
+        self.samples = deque(maxlen=window)  # (seconds, ok)
+
+    def record(self, seconds: float, ok: bool):
+        self.samples.append((seconds, ok))
+
+    def percentile(self, fraction: float):
+        latencies = sorted(seconds for seconds, ok in self.samples if ok)
+        if not latencies:
+            return None
+        return latencies[min(int(len(latencies) * fraction), len(latencies) - 1)]
+
+    @property
+    def error_rate(self) -> float:
+        if not self.samples:
+            return 0.0
+        return sum(1 for _, ok in self.samples if not ok) / len(self.samples)
+
+    def stats(self) -> dict:
+        p50, p95 = self.percentile(0.5), self.percentile(0.95)
+        return {
+            "calls": len(self.samples),
+            "p50_ms": round(p50 * 1000, 1) if p50 is not None else None,
+            "p95_ms": round(p95 * 1000, 1) if p95 is not None else None,
+            "error_rate": round(self.error_rate, 3)
+        }
+
+
+class Router:
+    """Routes completions for each endpoint class to the fastest healthy provider.
+
+    Each route lists the providers allowed to serve it. Providers are ranked
+    by rolling p50 latency, with unhealthy ones (error rate at or above
+    max_error_rate) last and providers without enough samples tried first so
+    they get measured. A request that outlives the chosen provider's p95 is
+    hedged on the next candidate and the first answer wins; failures fail
+    over down the list. All calls share the given semaphore, and the timeout
+    given to complete() or stream() applies to each provider call.
+
+    on_call, if given, is called as on_call(provider_name, seconds, outcome)
+    after every provider call, with outcome "ok", "error" or "cancelled".
+    """
+
+    def __init__(self, providers: list, routes: dict = None, semaphore: asyncio.Semaphore = None,
+                 hedge: bool = True, min_hedge_delay: float = 2.0, max_error_rate: float = 0.5,
+                 min_samples: int = 5, on_call=None):
+        self.providers = {provider.name: provider for provider in providers}
+        self.routes = routes or {}
+        self.semaphore = semaphore or asyncio.Semaphore(8)
+        self.hedge = hedge
+        self.min_hedge_delay = min_hedge_delay
+        self.max_error_rate = max_error_rate
+        self.min_samples = min_samples
+        self.on_call = on_call
+        self.trackers = {name: LatencyTracker() for name in self.providers}
+        self.hedges = 0
+        self.failovers = 0
+
+    def candidates(self, route: str) -> list:
+        """Providers for route, best first."""
+        names = self.routes.get(route) or list(self.providers)
+        order = {name: index for index, name in enumerate(names)}
+
+        def rank(name):
+            tracker = self.trackers[name]
+            measured = len(tracker.samples) >= self.min_samples
+            unhealthy = measured and tracker.error_rate >= self.max_error_rate
+            p50 = tracker.percentile(0.5) if measured else None
+            return (unhealthy, measured, p50 or 0.0, order[name])
+
+        return [self.providers[name] for name in sorted(names, key=rank)]
+
+    def signature(self, route: str) -> list:
+        """Names of the providers that may answer route, for cache keys."""
+        return sorted(self.routes.get(route) or self.providers)
+
+    def _hedge_delay(self, provider: Provider) -> float:
+        p95 = self.trackers[provider.name].percentile(0.95)
+        return max(p95 or 0.0, self.min_hedge_delay)
+
+    def _record(self, provider: Provider, seconds: float, outcome: str):
+        # A cancelled attempt lost a hedge race: its elapsed time is a lower bound
+        # on its latency, and recording it keeps a slow provider from staying "unmeasured"
+        self.trackers[provider.name].record(seconds, outcome != "error")
+        if self.on_call is not None:
+            self.on_call(provider.name, seconds, outcome)
+
+    async def _attempt(self, provider: Provider, system, prompt, temperature, max_tokens, timeout) -> str:
+        async with self.semaphore:
+            start = time.perf_counter()
+            try:
+                content = await provider.complete(system, prompt, temperature, max_tokens, timeout)
+            except asyncio.CancelledError:
+                self._record(provider, time.perf_counter() - start, "cancelled")
+                raise
+            except Exception:
+                self._record(provider, time.perf_counter() - start, "error")
+                raise
+            self._record(provider, time.perf_counter() - start, "ok")
+            return content
+
+    async def complete(self, route: str, system: str, prompt: str, temperature: float = 0.7,
+                       max_tokens: int = 4096, timeout: float = None) -> str:
+        candidates = self.candidates(route)
+        pending = set()
+        errors = []
+        next_index = 0
+
+        def launch():
+            nonlocal next_index
+            provider = candidates[next_index]
+            next_index += 1
+            task = asyncio.create_task(self._attempt(provider, system, prompt, temperature, max_tokens, timeout))
+            task.provider = provider
+            pending.add(task)
+            return task
+
+        try:
+            launch()
+            while pending:
+                can_hedge = self.hedge and next_index < len(candidates) and len(pending) == 1
+                hedge_delay = self._hedge_delay(next(iter(pending)).provider) if can_hedge else None
+                done, pending_now = await asyncio.wait(
+                    pending, timeout=hedge_delay, return_when=asyncio.FIRST_COMPLETED
+                )
+                pending.intersection_update(pending_now)
+                if not done:
+                    # Slow: race the next-best provider against the current one
+                    self.hedges += 1
+                    launch()
+                    continue
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    errors.append(f"{task.provider.name}: {task.exception()}")
+                    logging.warning(f"LLM provider {task.provider.name} failed: {task.exception()}")
+                if not pending and next_index < len(candidates):
+                    self.failovers += 1
+                    launch()
+            raise ProviderError("; ".join(errors) or "No providers configured")
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def stream(self, route: str, system: str, prompt: str, temperature: float = 0.7,
+                     max_tokens: int = 4096, timeout: float = None):
+        """Stream from the best provider, failing over only until the first chunk arrives."""
+        errors = []
+        for index, provider in enumerate(self.candidates(route)):
+            if index:
+                self.failovers += 1
+            started = False
+            start = time.perf_counter()
+            async with self.semaphore:
+                try:
+                    async for text in provider.stream(system, prompt, temperature, max_tokens, timeout):
+                        if not started:
+                            # Rank streaming providers by time to first token
+                            self._record(provider, time.perf_counter() - start, "ok")
+                            started = True
+                        yield text
+                    return
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    if started:
+                        raise
+                    self._record(provider, time.perf_counter() - start, "error")
+                    errors.append(f"{provider.name}: {e}")
+                    logging.warning(f"LLM provider {provider.name} failed: {e}")
+        raise ProviderError("; ".join(errors) or "No providers configured")
+
+    def stats(self) -> dict:
+        return {
+            "providers": {name: tracker.stats() for name, tracker in self.trackers.items()},
+            "routes": {route: [provider.name for provider in self.candidates(route)] for route in self.routes},
+            "hedges": self.hedges,
+            "failovers": self.failovers
+        }
+
+
+def build_providers(spec: str, groq_client=None, openai_api_key: str = None) -> list:
+    """Build providers from a comma-separated spec.
+
+    Entries are kind:model, e.g. groq:llama-3.3-70b-versatile,
+    gemini:gemini-2.0-flash, openai:model@http://localhost:8080/v1 or
+    fake:name.
+    """
+    providers = []
+    for entry in filter(None, (part.strip() for part in spec.split(','))):
+        kind, _, model = entry.partition(':')
+        if kind == "groq":
+            providers.append(GroqProvider(groq_client, model))
+        elif kind == "gemini":
+            providers.append(GeminiProvider(model))
+        elif kind == "openai":
+            model, _, base_url = model.partition('@')
+            providers.append(OpenAICompatibleProvider(base_url, model, api_key=openai_api_key, name=entry))
+        elif kind == "fake":
+            providers.append(FakeProvider(model, name=entry))
+        else:
+            raise ValueError(f"Unknown LLM provider kind in {entry!r}")
+    return providers
@@ -0,0 +1,53 @@
+import asyncio
+
+
+class SingleFlight:
+    """Share one in-flight call among concurrent callers with the same key.
+
+    The shared call is shielded, so a caller that times out or disconnects
+    doesn't cancel the work the other callers are waiting on. Once the last
+    caller has gone, the call is cancelled rather than left running for
+    nobody.
+    """
+
+    def __init__(self):
+        self.in_flight = {}
+        self.calls = 0
+        self.coalesced = 0
+        self.abandoned = 0
+
+    async def do(self, key: str, fn):
+        """Await fn() unless a call for key is already running, then await that one."""
+        task = self.in_flight.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            self.calls += 1
+            task = asyncio.ensure_future(fn())
+            task.waiters = 0
+            self.in_flight[key] = task
+
+            def _forget(done):
+                if self.in_flight.get(key) is done:
+                    del self.in_flight[key]
+                if not done.cancelled():
+                    done.exception()  # mark retrieved even if every caller gave up
+
+            task.add_done_callback(_forget)
+
+        task.waiters += 1
+        try:
+            return await asyncio.shield(task)
+        finally:
+            task.waiters -= 1
+            if not task.waiters and not task.done():
+                self.abandoned += 1
+                task.cancel()
+
+    def stats(self) -> dict:
+        return {
+            "calls": self.calls,
+            "coalesced": self.coalesced,
+            "abandoned": self.abandoned,
+            "in_flight": len(self.in_flight)
+        }
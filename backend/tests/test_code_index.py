@@ -0,0 +1,42 @@
+from code_index import html_fragments, merge_html_fragments
+
+PAGE = """<html><body>
+<header><h1>Old</h1></header>
+<main id="content"><p>Body</p></main>
+<section><h2>One</h2></section>
+<section><h2>Two</h2></section>
+</body></html>"""
+
+
+def sections(tag: str) -> list:
+    return [fragment for fragment in html_fragments(PAGE) if fragment["tag"] == tag]
+
+
+def test_unique_section_without_id_is_replaced():
+    merged = merge_html_fragments(PAGE, "<header><h1>New</h1></header>")
+
+    assert "<header><h1>New</h1></header>" in merged
+    assert "Old" not in merged
+
+
+def test_element_with_id_is_replaced():
+    merged = merge_html_fragments(PAGE, '<main id="content"><p>Changed</p></main>')
+
+    assert merged.count("<main") == 1 and "Changed" in merged
+
+
+def test_unmatched_elements_pair_with_sent_fragments_by_tag_and_position():
+    merged = merge_html_fragments(
+        PAGE, "<section><h2>Two, edited</h2></section><section><h2>Three</h2></section>",
+        sent=sections("section")[1:]
+    )
+
+    assert "<section><h2>One</h2></section>" in merged
+    assert "<h2>Two</h2>" not in merged
+    assert merged.index("Two, edited") < merged.index("Three") < merged.index("</body>")
+
+
+def test_new_section_with_repeated_tag_is_appended_without_sent():
+    merged = merge_html_fragments(PAGE, "<section><h2>Three</h2></section>")
+
+    assert merged.count("<section>") == 3
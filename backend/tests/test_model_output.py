@@ -0,0 +1,27 @@
+from model_output import CodeBlockStream, extract_code_blocks
+
+
+def test_info_string_attributes_are_not_code():
+    blocks = extract_code_blocks('```html title="index.html"\n<p>Hi</p>\n```')
+
+    assert blocks["html"] == "<p>Hi</p>"
+
+
+def test_code_on_the_fence_line_is_kept():
+    assert extract_code_blocks("```javascript let x = 1;\n```")["javascript"] == "let x = 1;"
+
+
+def test_unterminated_one_line_block_at_end_is_extracted():
+    blocks = extract_code_blocks("```css\nbody {}\n```\n```html <p>Last</p>")
+
+    assert blocks["css"] == "body {}"
+    assert blocks["html"] == "<p>Last</p>"
+
+
+def test_stream_waits_for_the_whole_fence_line():
+    stream = CodeBlockStream()
+    finished = []
+    for char in '```html title="x"\n<p>Hi</p>\n```':
+        finished += stream.feed(char)
+
+    assert finished == [("html", "<p>Hi</p>")]
@@ -0,0 +1,146 @@
+import asyncio
+
+import pytest
+
+from providers import FakeProvider, ProviderError, Router
+
+
+class FailingStreamProvider(FakeProvider):
+    """Streams the first chunk of its reply, then fails."""
+
+    async def stream(self, system, prompt, temperature, max_tokens, timeout=None):
+        self.calls += 1
+        yield self.reply[:16]
+        raise RuntimeError(f"{self.name} dropped the stream")
+
+
+class TimeoutRecordingProvider(FakeProvider):
+    async def complete(self, system, prompt, temperature, max_tokens, timeout=None):
+        self.timeout = timeout
+        return await super().complete(system, prompt, temperature, max_tokens, timeout)
+
+
+def complete(router: Router, route: str = "generate", **kwargs) -> str:
+    return asyncio.run(router.complete(route, "system", "prompt", **kwargs))
+
+
+def stream(router: Router, route: str = "generate") -> str:
+    async def collect():
+        return "".join([text async for text in router.stream(route, "system", "prompt")])
+    return asyncio.run(collect())
+
+
+def measure(router: Router, name: str, seconds: float, ok: bool = True, calls: int = 5):
+    for _ in range(calls):
+        router.trackers[name].record(seconds, ok)
+
+
+def test_candidates_rank_unmeasured_then_fastest_then_unhealthy():
+    router = Router([
+        FakeProvider(name="slow"), FakeProvider(name="fast"), FakeProvider(name="broken"), FakeProvider(name="new")
+    ])
+    measure(router, "slow", 2.0)
+    measure(router, "fast", 0.5)
+    measure(router, "broken", 0.1, ok=False)
+
+    assert [provider.name for provider in router.candidates("generate")] == ["new", "fast", "slow", "broken"]
+
+
+def test_routes_restrict_candidates_and_signature():
+    router = Router([FakeProvider(name="a"), FakeProvider(name="b")], routes={"tutor": ["b"]})
+
+    assert [provider.name for provider in router.candidates("tutor")] == ["b"]
+    assert [provider.name for provider in router.candidates("generate")] == ["a", "b"]
+    assert router.signature("tutor") == ["b"]
+
+
+def test_failover_to_next_provider():
+    first = FakeProvider(name="first", fail=True)
+    second = FakeProvider(name="second", reply="from second")
+    router = Router([first, second], hedge=False)
+
+    assert complete(router) == "from second"
+    assert (first.calls, second.calls) == (1, 1)
+    assert router.failovers == 1
+
+
+def test_all_providers_failing_raises_provider_error():
+    router = Router([FakeProvider(name="a", fail=True), FakeProvider(name="b", fail=True)], hedge=False)
+
+    with pytest.raises(ProviderError, match="a: a failed; b: b failed"):
+        complete(router)
+
+
+def test_slow_provider_is_hedged_and_loser_cancelled():
+    outcomes = []
+    slow = FakeProvider(name="slow", reply="from slow", delay=1.0)
+    fast = FakeProvider(name="fast", reply="from fast", delay=0.01)
+    router = Router(
+        [slow, fast], min_hedge_delay=0.05,
+        on_call=lambda name, seconds, outcome: outcomes.append((name, outcome))
+    )
+
+    assert complete(router) == "from fast"
+    assert router.hedges == 1
+    assert ("fast", "ok") in outcomes and ("slow", "cancelled") in outcomes
+
+
+def test_no_hedge_when_disabled():
+    slow = FakeProvider(name="slow", reply="from slow", delay=0.1)
+    fast = FakeProvider(name="fast", reply="from fast")
+    router = Router([slow, fast], hedge=False, min_hedge_delay=0.01)
+
+    assert complete(router) == "from slow"
+    assert router.hedges == 0 and fast.calls == 0
+
+
+def test_timeout_is_passed_to_providers():
+    failing = TimeoutRecordingProvider(name="failing", fail=True)
+    slow = TimeoutRecordingProvider(name="slow", reply="from slow", delay=1.0)
+    hedge = TimeoutRecordingProvider(name="hedge", reply="from hedge")
+    router = Router([failing, slow, hedge], min_hedge_delay=0.05)
+
+    assert complete(router, timeout=42.0) == "from hedge"
+    assert router.failovers == 1 and router.hedges == 1
+    assert (failing.timeout, slow.timeout, hedge.timeout) == (42.0, 42.0, 42.0)
+
+
+def test_stream_fails_over_before_first_chunk():
+    first = FakeProvider(name="first", fail=True)
+    second = FakeProvider(name="second", reply="streamed from the second provider")
+    router = Router([first, second])
+
+    assert stream(router) == "streamed from the second provider"
+    assert router.failovers == 1
+
+
+def test_stream_failure_after_first_chunk_is_raised():
+    first = FailingStreamProvider(name="first", reply="partial reply that breaks off")
+    second = FakeProvider(name="second", reply="never used")
+    router = Router([first, second])
+
+    with pytest.raises(RuntimeError, match="dropped the stream"):
+        stream(router)
+    assert second.calls == 0
+
+
+def test_semaphore_bounds_concurrent_calls():
+    active = 0
+    peak = 0
+
+    class CountingProvider(FakeProvider):
+        async def complete(self, system, prompt, temperature, max_tokens, timeout=None):
+            nonlocal active, peak
+            active += 1
+            peak = max(peak, active)
+            try:
+                return await super().complete(system, prompt, temperature, max_tokens, timeout)
+            finally:
+                active -= 1
+
+    async def run():
+        router = Router([CountingProvider(name="p", reply="ok", delay=0.01)], semaphore=asyncio.Semaphore(2))
+        await asyncio.gather(*(router.complete("generate", "system", "prompt") for _ in range(6)))
+
+    asyncio.run(run())
+    assert peak == 2
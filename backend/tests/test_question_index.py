@@ -0,0 +1,69 @@
+import asyncio
+
+from cache import QuestionIndex, question_words
+
+
+def lookup(index: QuestionIndex, context: str, question: str):
+    match = asyncio.run(index.get(context, question))
+    return match and match["answer"]
+
+
+def build(*entries) -> QuestionIndex:
+    index = QuestionIndex()
+    for context, question, answer in entries:
+        asyncio.run(index.set(context, question, answer))
+    return index
+
+
+def test_question_words_drop_filler_and_fold_plurals():
+    assert question_words("What are CSS media queries, please?") == {"css", "media", "query"}
+    assert question_words("node.js vs deno") == {"node.js", "vs", "deno"}
+
+
+def test_rephrasing_reuses_answer_with_provenance():
+    index = build(("css", "what is flexbox?", "FLEX"))
+
+    match = asyncio.run(index.get("css", "explain flexbox please"))
+
+    assert match["answer"] == "FLEX"
+    assert match["question"] == "what is flexbox?"
+    assert match["similarity"] == 1.0
+
+
+def test_context_is_part_of_the_key():
+    index = build(("css", "what is flexbox", "FLEX"))
+
+    assert lookup(index, "javascript", "what is flexbox") is None
+
+
+def test_interrogatives_must_match():
+    index = build(("web", "why use semantic html", "WHY"), ("web", "when should i use grid", "WHEN"))
+
+    assert lookup(index, "web", "how to use semantic html") is None
+    assert lookup(index, "web", "why should I use semantic html?") == "WHY"
+    assert lookup(index, "web", "why should i use grid") is None
+    assert lookup(index, "web", "when to use grid") == "WHEN"
+
+
+def test_dissimilar_question_misses():
+    index = build(("css", "how to center a div with flexbox", "FLEX"))
+
+    assert lookup(index, "css", "how to center a div with grid") is None
+
+
+def test_eviction_bounds_entries_and_buckets():
+    index = QuestionIndex(max_entries=2)
+    for topic in ("grid", "flexbox", "animations"):
+        asyncio.run(index.set("css", f"explain {topic}", topic))
+
+    assert len(index.entries) == 2 and index.evictions == 1
+    assert lookup(index, "css", "explain grid") is None
+    assert all(index.buckets.values())
+
+
+def test_persists_and_drops_other_versions(tmp_path):
+    db_path = str(tmp_path / "tutor.sqlite3")
+    asyncio.run(QuestionIndex(db_path=db_path, version="v1").set("css", "explain the box model", "BOX"))
+
+    assert lookup(QuestionIndex(db_path=db_path, version="v1"), "css", "what is the box model") == "BOX"
+    assert not QuestionIndex(db_path=db_path, version="v2").entries
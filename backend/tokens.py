@@ -0,0 +1,59 @@
+import re
+
+# Approximates a BPE tokenizer: a word (with its leading space) or a run of up to
+# three digits is one token, long words are split every 8 letters, a line break
+# with its indentation is one token, and every other symbol is one token.
+TOKEN_PIECE = re.compile(r' ?[A-Za-z]{1,8}| ?[0-9]{1,3}|\n[ \t]*|[ \t]+|[^\sA-Za-z0-9]')
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimate how many tokens text uses, without a model-specific tokenizer.
+
+    Tends to overcount slightly for code, which is the safe side for
+    budgeting against a context window.
+    """
+    if not text:
+        return 0
+    return sum(1 for _ in TOKEN_PIECE.finditer(text))
+
+
+class TokenBudgetError(Exception):
+    """Raised when a prompt leaves too little of the context window for an answer."""
+
+
+def completion_budget(prompt_tokens: int, wanted: int, context_tokens: int, minimum: int) -> int:
+    """Clamp a wanted max_tokens to what the context window leaves after the prompt.
+
+    Raises TokenBudgetError when fewer than minimum tokens would be left.
+    """
+    available = context_tokens - prompt_tokens
+    if available < minimum:
+        raise TokenBudgetError(
+            f"Prompt is about {prompt_tokens} tokens; the model's {context_tokens}-token "
+            f"context leaves fewer than {minimum} for the answer"
+        )
+    return min(wanted, available)
+
+
+class TokenMeter:
+    """Running prompt/completion token totals per endpoint class."""
+
+    def __init__(self):
+        self.routes = {}
+
+    def record(self, route: str, prompt_tokens: int = 0, completion_tokens: int = 0, rejected: bool = False):
+        totals = self.routes.setdefault(route, {
+            "requests": 0,
+            "prompt_tokens": 0,
+            "completion_tokens": 0,
+            "rejected": 0
+        })
+        if rejected:
+            totals["rejected"] += 1
+            return
+        totals["requests"] += 1
+        totals["prompt_tokens"] += prompt_tokens
+        totals["completion_tokens"] += completion_tokens
+
+    def stats(self) -> dict:
+        return {route: dict(totals) for route, totals in self.routes.items()}